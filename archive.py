@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+import configparser
+
+import database
+
+
+SCHEMA = "archive"          # name the archive database is attached under
+OLDER_THAN_DAYS = 365       # appointments dated longer ago than this are archived
+BATCH_SIZE = 1000           # appointments moved per transaction
+BATCH_SLEEP = 0.01          # seconds between batches, so forms get a turn at the database
+
+SETTINGS = {"path": None, "older_than_days": OLDER_THAN_DAYS}
+
+# TEMP views over the appointments of both databases, for connections that
+# attached the archive. Names match appointments / appointments_view.
+ALL_TABLE = "appointments_all"
+ALL_VIEW = "appointments_all_view"
+
+INDEXES = {
+    "idx_appointments_date_time": "date, time",
+    "idx_appointments_pet_id": "pet_id",
+    "idx_appointments_service_id": "service_id",
+}
+
+
+# Next to the database by default, pet_clinic.db -> pet_clinic_archive.db
+def default_path(db_path):
+    base, extension = os.path.splitext(db_path)
+    return f"{base}_archive{extension or '.db'}"
+
+
+# Settings from the [archive] section of the config file, with `overrides`
+# (e.g. command line flags) on top
+def load_settings(config_path=database.CONFIG_PATH, overrides=None, db_path=database.DB_PATH):
+    settings = dict(SETTINGS)
+    config = configparser.ConfigParser()
+    if config_path and config.read(config_path) and config.has_section("archive"):
+        settings.update((key, value) for key, value in config["archive"].items() if key in SETTINGS)
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    settings["path"] = settings["path"] or default_path(db_path)
+    try:
+        settings["older_than_days"] = int(settings["older_than_days"])
+    except ValueError as e:
+        raise ValueError(f"Invalid archive setting: {e}")
+    if settings["older_than_days"] < 1:
+        raise ValueError("Only appointments at least a day old can be archived")
+    return settings
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("archive")
+    group.add_argument("--archive-db", help="archive database file (default: <database>_archive.db next to it)")
+    group.add_argument("--archive-older-than", type=int, dest="older_than_days",
+                       help=f"archive appointments older than this many days (default {OLDER_THAN_DAYS})")
+    return group
+
+
+def settings_from_args(args, profile):
+    overrides = {"path": args.archive_db, "older_than_days": args.older_than_days}
+    return load_settings(args.config, overrides, profile["path"])
+
+
+def cutoff(older_than_days, today=None):
+    """The first date that stays in the appointments table, YYYY-MM-DD."""
+    return ((today or datetime.date.today()) - datetime.timedelta(days=older_than_days)).isoformat()
+
+
+##### Attaching #########
+def is_attached(conn):
+    return any(row[1] == SCHEMA for row in conn.execute("PRAGMA database_list"))
+
+
+def attach(conn, path):
+    """ATTACH the archive database to `conn`, creating it if needed, and
+    add the TEMP views reading hot and archived appointments together.
+
+    Safe to call again on a connection that has it attached already. The
+    archive table has the columns of appointments, without the foreign keys
+    (they can't point into another database); columns added to appointments
+    later are added to it as well.
+    """
+    if is_attached(conn):
+        return
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+    # Moved rows are gone from the main database once the second transaction
+    # of a batch commits, so the copy has to be on disk by then
+    conn.execute(f"PRAGMA {SCHEMA}.journal_mode = wal")
+    conn.execute(f"PRAGMA {SCHEMA}.synchronous = full")
+
+    columns = [(row[1], row[2]) for row in conn.execute("PRAGMA main.table_info(appointments)")]
+    archived = {row[1] for row in conn.execute(f"PRAGMA {SCHEMA}.table_info(appointments)")}
+    if not archived:
+        definitions = ", ".join("id INTEGER PRIMARY KEY" if name == "id" else f"{name} {kind}" for name, kind in columns)
+        conn.execute(f"CREATE TABLE {SCHEMA}.appointments({definitions})")
+    for name, kind in columns:
+        if archived and name not in archived:
+            conn.execute(f"ALTER TABLE {SCHEMA}.appointments ADD COLUMN {name} {kind}")
+    for index, indexed in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.{index} ON appointments({indexed})")
+
+    # Both halves are plain selects, so sqlite pushes the table page's WHERE
+    # into each and merges their index-ordered rows for ORDER BY ... LIMIT.
+    # The joins are those of appointments_view (database._add_display_views).
+    column_list = ", ".join(f"a.{name}" for name, _ in columns)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS {ALL_TABLE} AS
+        SELECT {column_list} FROM main.appointments a
+        UNION ALL
+        SELECT {column_list} FROM {SCHEMA}.appointments a
+    """)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS {ALL_VIEW} AS
+        SELECT * FROM main.appointments_view
+        UNION ALL
+        SELECT {column_list}, p.name AS pet_name, p.owner_id AS owner_id, o.name AS owner_name,
+               s.service_name AS service_name, s.cost AS cost
+        FROM {SCHEMA}.appointments a
+        LEFT JOIN main.pets p ON p.id = a.pet_id
+        LEFT JOIN main.owners o ON o.id = p.owner_id
+        LEFT JOIN main.services s ON s.id = a.service_id
+    """)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch(id INTEGER PRIMARY KEY)")
+
+
+##### Archiving #########
+def _restore_visits(conn):
+    # The report rollups lost the batch when its rows were deleted, count it
+    # back in from the archived copies (database._add_report_rollups), with
+    # the price each visit was charged (database._add_appointment_price).
+    # Archived visits stay under the species their pet had at the time.
+    batch = "WHERE a.id IN (SELECT id FROM temp.archive_batch)"
+    conn.execute(f"""
+        INSERT INTO main.report_service_month(service_id, month, visits, revenue)
+        SELECT a.service_id, substr(a.date, 1, 7), COUNT(*), SUM(COALESCE(a.price, s.cost, 0))
+        FROM {SCHEMA}.appointments a LEFT JOIN main.services s ON s.id = a.service_id {batch} GROUP BY 1, 2
+        ON CONFLICT(service_id, month) DO UPDATE SET visits = visits + excluded.visits, revenue = revenue + excluded.revenue
+    """)
+    conn.execute(f"""
+        INSERT INTO main.report_species_month(species, month, visits)
+        SELECT COALESCE(p.species, 'unknown'), substr(a.date, 1, 7), COUNT(*)
+        FROM {SCHEMA}.appointments a LEFT JOIN main.pets p ON p.id = a.pet_id {batch} GROUP BY 1, 2
+        ON CONFLICT(species, month) DO UPDATE SET visits = visits + excluded.visits
+    """)
+    conn.execute(f"""
+        INSERT INTO main.report_day(date, visits)
+        SELECT a.date, COUNT(*) FROM {SCHEMA}.appointments a {batch} GROUP BY 1
+        ON CONFLICT(date) DO UPDATE SET visits = visits + excluded.visits
+    """)
+
+
+def archive_appointments(conn, path, before, batch_size=BATCH_SIZE, progress=None, should_stop=None):
+    """Move appointments dated before `before` (YYYY-MM-DD) into the archive.
+
+    Runs batch_size appointments at a time, each batch in two short
+    transactions: the first copies the batch into the archive, the second
+    copies it again (in case a row changed in between) and deletes it from
+    appointments. A transaction over two WAL databases is only atomic per
+    file, so the archive always holds a batch before it leaves the main
+    database; a crash in between leaves rows in both, and the next run
+    moves them again. Deleting goes through the usual triggers, so views
+    and the change log follow; reports keep counting archived visits.
+
+    progress(stats) is called after every batch and should_stop() before
+    it. Returns {"total", "archived", "seconds", "cancelled"}.
+    """
+    started = time.perf_counter()
+    attach(conn, path)
+    columns = ", ".join(row[1] for row in conn.execute("PRAGMA main.table_info(appointments)"))
+    # Rows whose date couldn't be read have no starts_at and stay put
+    due = "FROM main.appointments WHERE date < ? AND starts_at IS NOT NULL"
+    copy = (
+        f"INSERT OR REPLACE INTO {SCHEMA}.appointments ({columns}) "
+        f"SELECT {columns} FROM main.appointments WHERE id IN (SELECT id FROM temp.archive_batch)"
+    )
+    stats = {"total": conn.execute(f"SELECT COUNT(*) {due}", (before,)).fetchone()[0],
+             "archived": 0, "seconds": 0.0, "cancelled": False}
+
+    while True:
+        if should_stop is not None and should_stop():
+            stats["cancelled"] = True
+            break
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM temp.archive_batch")
+            moved = conn.execute(f"INSERT INTO temp.archive_batch(id) SELECT id {due} LIMIT ?", (before, batch_size)).rowcount
+            if moved:
+                conn.execute(copy)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if not moved:
+            break
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(copy)
+            conn.execute("DELETE FROM main.appointments WHERE id IN (SELECT id FROM temp.archive_batch)")
+            _restore_visits(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        stats["archived"] += moved
+        if progress is not None:
+            progress(dict(stats))
+        time.sleep(BATCH_SLEEP)
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old appointments into the archive database.")
+    database.add_profile_arguments(parser)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        profile = database.profile_from_args(args)
+        settings = settings_from_args(args, profile)
+    except ValueError as e:
+        parser.error(str(e))
+    if profile["server"]:
+        parser.error("archiving runs on the machine holding the database, not through --server")
+
+    conn = database.connect(profile)
+    try:
+        database.migrate(conn)
+        before = cutoff(settings["older_than_days"])
+        stats = archive_appointments(conn, settings["path"], before)
+        database.prune_change_log(conn)     # one entry per archived appointment
+    except sqlite3.Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"{stats['archived']} appointments before {before} moved to {settings['path']} in {stats['seconds']:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
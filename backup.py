@@ -0,0 +1,209 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+import configparser
+
+import database
+
+
+BACKUP_DIR = "backups"
+KEEP = 14               # snapshots kept, older ones are deleted
+EVERY_HOURS = 24        # how often the app takes one, 0 for never
+PAGES_PER_STEP = 256    # pages copied per step, 1 MB at the default page size
+STEP_SLEEP = 0.005      # seconds between steps, so writers get the database in between
+MAX_RESTARTS = 3        # restarts before the copy is finished in one step
+
+SETTINGS = {"dir": BACKUP_DIR, "keep": KEEP, "every_hours": EVERY_HOURS}
+
+
+class Cancelled(Exception):
+    pass
+
+
+# Settings from the [backup] section of the config file, with `overrides`
+# (e.g. command line flags) on top
+def load_settings(config_path=database.CONFIG_PATH, overrides=None):
+    settings = dict(SETTINGS)
+    config = configparser.ConfigParser()
+    if config_path and config.read(config_path) and config.has_section("backup"):
+        settings.update((key, value) for key, value in config["backup"].items() if key in SETTINGS)
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    try:
+        settings["keep"] = int(settings["keep"])
+        settings["every_hours"] = float(settings["every_hours"])
+    except ValueError as e:
+        raise ValueError(f"Invalid backup setting: {e}")
+    if settings["keep"] < 1:
+        raise ValueError("Backups to keep must be at least 1")
+    return settings
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("backups")
+    group.add_argument("--backup-dir", help=f"where snapshots go (default {BACKUP_DIR})")
+    group.add_argument("--backup-keep", type=int, help=f"snapshots to keep (default {KEEP})")
+    group.add_argument("--backup-every", type=float, dest="backup_every_hours",
+                       help=f"hours between automatic backups, 0 for none (default {EVERY_HOURS})")
+    return group
+
+
+def settings_from_args(args):
+    overrides = {"dir": args.backup_dir, "keep": args.backup_keep, "every_hours": args.backup_every_hours}
+    return load_settings(args.config, overrides)
+
+
+##### Snapshots #########
+# Snapshots of a database are named after its file, e.g. pet_clinic-20240101-120000.db
+def stem(path):
+    return os.path.splitext(os.path.basename(path))[0] or "memory"
+
+
+def _stem(conn):
+    return stem(next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"))
+
+
+def _pattern(name):
+    return re.compile(re.escape(name) + r"-\d{8}-\d{6}\.db")
+
+
+def snapshots(directory, name):
+    """Paths of the verified snapshots of database `name`, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    pattern = _pattern(name)
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if pattern.fullmatch(name)]
+
+
+def last_backup(directory, name):
+    """When the newest snapshot was taken, as a datetime, or None."""
+    found = snapshots(directory, name)
+    if not found:
+        return None
+    return datetime.datetime.strptime(os.path.basename(found[-1])[len(name) + 1:-3], "%Y%m%d-%H%M%S")
+
+
+def prune(directory, name, keep=KEEP):
+    """Delete all but the newest `keep` snapshots, returns the deleted paths."""
+    old = snapshots(directory, name)[:-keep]
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def verify(path, should_stop=None):
+    """PRAGMA integrity_check of a snapshot, ["ok"] when it is sound.
+    Stopping it raises sqlite3.OperationalError (interrupted)."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    if should_stop is not None:
+        conn.set_progress_handler(should_stop, 10000)
+    try:
+        return [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+
+
+def backup(conn, directory=BACKUP_DIR, keep=KEEP, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, progress=None, should_stop=None):
+    """Snapshot the database of `conn` into `directory` while it stays in use.
+
+    Copies PAGES_PER_STEP pages at a time with sqlite's backup API, letting
+    go of the database between steps, so forms and other clients carry on
+    writing meanwhile. A write from another connection restarts the copy;
+    after MAX_RESTARTS it is finished in one step, which in WAL mode reads
+    a consistent snapshot without holding up writers. The copy is then
+    checked with PRAGMA integrity_check, and only a sound one is given its
+    final name and counted towards the `keep` newest.
+
+    progress(stats) is called after every step and should_stop() before
+    it. Returns {"path", "pages", "done", "restarts", "seconds",
+    "removed", "cancelled"}; a copy failing the check is left as
+    <path>.corrupt and raises sqlite3.DatabaseError.
+    """
+    started = time.perf_counter()
+    name = _stem(conn)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{datetime.datetime.now():%Y%m%d-%H%M%S}.db")
+    partial = path + ".partial"
+    stats = {"path": path, "pages": 0, "done": 0, "restarts": 0, "seconds": 0.0, "removed": [], "cancelled": False}
+
+    def step(status, remaining, total):
+        if total - remaining < stats["done"]:
+            stats["restarts"] += 1
+        stats["pages"], stats["done"] = total, total - remaining
+        if progress is not None:
+            progress(dict(stats))
+        if should_stop is not None and should_stop():
+            raise Cancelled()
+        if stats["restarts"] >= MAX_RESTARTS and remaining:
+            raise InterruptedError()    # start over in one step
+
+    target = sqlite3.connect(partial)
+    try:
+        try:
+            conn.backup(target, pages=pages, progress=step, sleep=sleep)
+        except InterruptedError:
+            conn.backup(target)
+            stats["done"] = stats["pages"]
+        target.execute("PRAGMA journal_mode = delete")     # a standalone file, no -wal next to it
+    except Cancelled:
+        stats["cancelled"] = True
+    finally:
+        target.close()
+    if not stats["cancelled"]:
+        try:
+            problems = verify(partial, should_stop)
+        except sqlite3.OperationalError:
+            if should_stop is None or not should_stop():
+                raise
+            stats["cancelled"] = True
+    if stats["cancelled"]:
+        os.remove(partial)
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    if problems != ["ok"]:
+        os.replace(partial, path + ".corrupt")
+        raise sqlite3.DatabaseError(f"Backup failed its integrity check, kept as {path}.corrupt: {'; '.join(problems[:5])}")
+    os.replace(partial, path)
+    stats["removed"] = prune(directory, name, keep)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take a snapshot of the clinic database, e.g. from a scheduled task.")
+    parser.add_argument("--verify", metavar="SNAPSHOT", help="only check an existing snapshot")
+    database.add_profile_arguments(parser)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        problems = verify(args.verify)
+        print("\n".join(problems))
+        return 0 if problems == ["ok"] else 1
+
+    try:
+        profile = database.profile_from_args(args)
+        settings = settings_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if profile["server"]:
+        parser.error("backups are taken on the machine holding the database, not through --server")
+    conn = database.connect(profile)
+    try:
+        stats = backup(conn, settings["dir"], settings["keep"])
+    except sqlite3.Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"{stats['path']}: {stats['pages']} pages in {stats['seconds']:.2f}s, "
+          f"{stats['restarts']} restarts, {len(stats['removed'])} old snapshots removed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
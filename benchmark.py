@@ -0,0 +1,476 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import datetime
+import platform
+import statistics
+import subprocess
+
+import database
+import scheduling
+import repositories
+
+
+# Rows generated per appointment, so `--size 100k` gives 20k owners, 30k
+# pets and 100k appointments
+OWNERS_PER_APPOINTMENT = 0.2
+PETS_PER_OWNER = 1.5
+FIRST_DAY = datetime.date(2000, 1, 3)   # generated appointments run forward from here
+GENERATE_BATCH = 10000      # rows per executemany / transaction while generating
+
+DATA_DIR = "benchmark_data"
+OUTPUT = "benchmark_results.json"
+REPEAT = 5                  # runs of every timed operation
+SINGLE_OPS = 50             # records written one at a time per single-write run
+BULK_ROWS = 1000            # records per bulk-write run
+SLOWER = 1.2                # --compare flags medians this much slower
+NOISE = 0.0005              # ... and at least this many seconds slower
+
+# Column the "sorted" page loads sort by, descending
+SORT_COLUMNS = {"owners": "name", "pets": "name", "appointments": "date", "services": "service_name"}
+
+FIRST_NAMES = (
+    "Ann", "Ben", "Carla", "David", "Elena", "Farid", "Grace", "Hiro", "Ines", "James", "Kemi", "Liam",
+    "Maria", "Noah", "Olga", "Pedro", "Quinn", "Rosa", "Sam", "Tara", "Umar", "Vera", "Wei", "Yusuf", "Zoe",
+)
+LAST_NAMES = (
+    "Adams", "Brown", "Costa", "Dubois", "Evans", "Fischer", "Garcia", "Hughes", "Ito", "Jensen", "Khan",
+    "Lopez", "Murphy", "Nowak", "Okafor", "Patel", "Quinn", "Rossi", "Smith", "Tanaka", "Ueda", "Vargas",
+)
+STREETS = ("Elm", "Oak", "Maple", "Cedar", "Pine", "Birch", "Willow", "High", "Station", "Church", "Mill")
+PET_NAMES = (
+    "Rex", "Bella", "Max", "Luna", "Charlie", "Lucy", "Milo", "Daisy", "Rocky", "Coco", "Simba", "Nala",
+    "Oscar", "Ruby", "Teddy", "Molly", "Leo", "Chloe", "Buddy", "Pepper", "Ziggy", "Bean",
+)
+BREEDS = {
+    "dog": ("labrador", "beagle", "collie", "poodle", "terrier", "mixed"),
+    "cat": ("siamese", "persian", "maine coon", "tabby", "mixed"),
+    "rabbit": ("lop", "dutch", "rex"),
+    "bird": ("budgie", "cockatiel", "parrot"),
+    "hamster": ("syrian", "dwarf"),
+}
+SPECIES_WEIGHTS = {"dog": 50, "cat": 35, "rabbit": 7, "bird": 5, "hamster": 3}
+SERVICES = (
+    ("Check-up", 45.0, 30), ("Vaccination", 35.0, 15), ("Dental cleaning", 120.0, 60),
+    ("Microchipping", 30.0, 15), ("Neutering", 180.0, 90), ("X-ray", 95.0, 30),
+    ("Blood test", 60.0, 15), ("Grooming", 50.0, 45), ("Nail trim", 15.0, 15),
+    ("Surgery consult", 80.0, 30), ("Ultrasound", 110.0, 45), ("Follow-up", 25.0, 15),
+)
+
+
+##### Synthetic data #########
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000, plain numbers as they are."""
+    text = str(text).strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    try:
+        size = int(float(text[:-1] if scale != 1 else text) * scale)
+    except ValueError:
+        raise ValueError(f"Unrecognised size {text!r}, use e.g. 10k, 100k or 1M")
+    if size < 10:
+        raise ValueError("size must be at least 10")
+    return size
+
+
+def _owner(rng, number):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return (
+        number, f"{first} {last}", f"+1555{number:07d}", f"{first}.{last}{number}@example.com".lower(),
+        f"{rng.randint(1, 999)} {rng.choice(STREETS)} St",
+    )
+
+
+def _pet(rng, number, owners):
+    species = rng.choices(list(SPECIES_WEIGHTS), weights=list(SPECIES_WEIGHTS.values()))[0]
+    return (number, rng.choice(PET_NAMES), rng.randint(0, 18), species, rng.choice(BREEDS[species]), rng.randint(1, owners))
+
+
+# Appointments one after another within opening hours, with the odd gap, so
+# the generated calendar has no clashes and still has free slots
+def _appointments(rng, count, pets):
+    opens = scheduling.OPENING_TIME.hour * 60 + scheduling.OPENING_TIME.minute
+    closes = scheduling.CLOSING_TIME.hour * 60 + scheduling.CLOSING_TIME.minute
+    day, minute = FIRST_DAY, opens
+    for number in range(1, count + 1):
+        service_id = rng.randint(1, len(SERVICES))
+        duration = SERVICES[service_id - 1][2]
+        minute += scheduling.SLOT_MINUTES * rng.choice((0, 0, 0, 1, 2))
+        while day.weekday() not in scheduling.OPEN_WEEKDAYS or minute + duration > closes:
+            day, minute = day + datetime.timedelta(days=1), opens
+        yield number, day.isoformat(), f"{minute // 60:02d}:{minute % 60:02d}", rng.randint(1, pets), service_id
+        minute += duration
+
+
+def _insert(conn, sql, rows, progress=None):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == GENERATE_BATCH:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch = []
+            if progress:
+                progress()
+    conn.executemany(sql, batch)
+    conn.commit()
+
+
+def generate(conn, size, seed=1, progress=None):
+    """Fill an empty, migrated database with a synthetic clinic of `size`
+    appointments (and owners, pets and services to go with them), the same
+    data every time for the same size and seed. Returns {table: rows}."""
+    rng = random.Random(seed)
+    owners = max(1, int(size * OWNERS_PER_APPOINTMENT))
+    pets = max(1, int(owners * PETS_PER_OWNER))
+
+    _insert(conn, "INSERT INTO services (id, service_name, cost, duration_minutes) VALUES (?, ?, ?, ?)",
+            ((number, *service) for number, service in enumerate(SERVICES, 1)))
+    _insert(conn, "INSERT INTO owners (id, name, contact, email, address) VALUES (?, ?, ?, ?, ?)",
+            (_owner(rng, number) for number in range(1, owners + 1)), progress)
+    _insert(conn, "INSERT INTO pets (id, name, age, species, breed, owner_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (_pet(rng, number, owners) for number in range(1, pets + 1)), progress)
+    _insert(conn, "INSERT INTO appointments (id, date, time, pet_id, service_id) VALUES (?, ?, ?, ?, ?)",
+            _appointments(rng, size, pets), progress)
+    # Nothing is watching a fresh database, so its change log is just bulk
+    conn.execute("DELETE FROM change_log")
+    conn.commit()
+    conn.execute("ANALYZE")
+    return {"owners": owners, "pets": pets, "services": len(SERVICES), "appointments": size}
+
+
+# Base database for a size, generated once and reused by later runs
+def base_database(data_dir, size, seed, regenerate=False):
+    path = os.path.join(data_dir, f"clinic_{size}_seed{seed}.db")
+    if os.path.exists(path) and not regenerate:
+        return path, None
+    os.makedirs(data_dir, exist_ok=True)
+    partial = path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    started = time.perf_counter()
+    conn = database.connect({"path": partial, "journal_mode": "delete", "synchronous": "off"})
+    database.migrate(conn)
+    generate(conn, size, seed, lambda: print(".", end="", flush=True, file=sys.stderr))
+    conn.close()
+    os.replace(partial, path)
+    print(file=sys.stderr)
+    return path, time.perf_counter() - started
+
+
+# Fresh copy of the base database for the timed runs to write to
+def working_copy(base_path, path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    source, target = sqlite3.connect(base_path), sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    database.migrate(target)    # base databases kept from before a schema change
+    target.close()
+
+
+##### Timing #########
+def summarize(times):
+    times = sorted(times)
+    return {
+        "runs": len(times),
+        "min": round(times[0], 6),
+        "median": round(statistics.median(times), 6),
+        "p95": round(times[max(0, math.ceil(0.95 * len(times)) - 1)], 6),
+        "max": round(times[-1], 6),
+        "mean": round(statistics.fmean(times), 6),
+    }
+
+
+# Seconds per call of run(setup()), setup itself untimed
+def measure(run, repeat, setup=lambda: None):
+    times = []
+    for _ in range(repeat):
+        argument = setup()
+        started = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - started)
+    return summarize(times)
+
+
+##### Table pages #########
+# First page of a table view, loaded the way populate_table does it: a
+# SqlTableModel on the worker thread, done when the count and the first
+# chunk of rows are in
+def bench_pages(profile, repeat):
+    from PyQt5.QtCore import Qt, QCoreApplication, QEventLoop
+    from db_worker import DatabaseThread
+    from table_model import SqlTableModel
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    db = DatabaseThread(profile)
+
+    def wait(done):
+        while not done():
+            app.processEvents(QEventLoop.AllEvents | QEventLoop.WaitForMoreEvents)
+
+    def load(table_name, sort_column="id"):
+        model = SqlTableModel(db, table_name)
+        model.sort_column = sort_column
+        if sort_column != "id":
+            model.sort_order = Qt.DescendingOrder
+        state = {}
+        model.rowsInserted.connect(lambda *_: state.update(rows=True))
+        model.page_changed.connect(lambda *_: state.update(count=True))
+        model.load_failed.connect(lambda message: state.update(error=message))
+        model.refresh()
+        wait(lambda: "error" in state or ("count" in state and ("rows" in state or model.total_rows == 0)))
+        if "error" in state:
+            raise RuntimeError(f"Loading {table_name} failed: {state['error']}")
+        return model, state
+
+    def last_page(model_state):
+        model, state = model_state
+        state.pop("rows", None)
+        model.last_page()
+        wait(lambda: "rows" in state or "error" in state)
+
+    results = {}
+    try:
+        for table_name in repositories.REPOSITORIES:
+            def cold():
+                db.cache.clear()
+            results[f"populate.{table_name}.cold"] = measure(lambda _: load(table_name), repeat, cold)
+            results[f"populate.{table_name}.warm"] = measure(lambda _: load(table_name), repeat)
+            results[f"populate.{table_name}.sorted"] = measure(
+                lambda _: load(table_name, SORT_COLUMNS[table_name]), repeat, cold
+            )
+            results[f"populate.{table_name}.last_page"] = measure(
+                last_page, repeat, lambda: (cold(), load(table_name))[1]
+            )
+    finally:
+        db.close()
+    return results
+
+
+##### Writes #########
+# The repository calls behind the forms, table edits and deletes, on a
+# connection of their own
+def bench_writes(profile, repeat, single_ops=SINGLE_OPS, bulk_rows=BULK_ROWS):
+    repos = repositories.Repositories.open(profile)
+    conn = repos.conn
+    rng = random.Random(2)
+    numbers = iter(range(10 ** 9, 2 * 10 ** 9))
+    owners = conn.execute("SELECT MAX(id) FROM owners").fetchone()[0]
+    pets = conn.execute("SELECT MAX(id) FROM pets").fetchone()[0]
+    service_id = conn.execute("SELECT id FROM services ORDER BY duration_minutes DESC LIMIT 1").fetchone()[0]
+    slot_minutes = conn.execute("SELECT duration_minutes FROM services WHERE id = ?", (service_id,)).fetchone()[0]
+
+    # Free times after the generated calendar, one slot of the longest service apart
+    last_day = scheduling.from_minutes(conn.execute("SELECT MAX(starts_at) FROM appointments").fetchone()[0]).date()
+    opens = scheduling.OPENING_TIME.hour * 60 + scheduling.OPENING_TIME.minute
+    closes = scheduling.CLOSING_TIME.hour * 60 + scheduling.CLOSING_TIME.minute
+    per_day = (closes - opens) // slot_minutes
+    slots = (
+        (last_day + datetime.timedelta(days=1 + number // per_day), opens + number % per_day * slot_minutes)
+        for number in range(10 ** 9)
+    )
+
+    def owner():
+        number = next(numbers)
+        _, name, contact, email, address = _owner(rng, number)
+        return {"name": name, "contact": contact, "email": email, "address": address}
+
+    def pet(owner_id=None):
+        _, name, age, species, breed, any_owner = _pet(rng, 0, owners)
+        return {"name": name, "age": age, "species": species, "breed": breed, "owner_id": owner_id or any_owner}
+
+    def appointment():
+        day, minute = next(slots)
+        while day.weekday() not in scheduling.OPEN_WEEKDAYS:
+            day, minute = next(slots)
+        return {"date": day.isoformat(), "time": f"{minute // 60:02d}:{minute % 60:02d}",
+                "pet_id": rng.randint(1, pets), "service_id": service_id}
+
+    def single(add, make):
+        return lambda _: [add(**make()) for _ in range(single_ops)]
+
+    # An owner with two pets and no appointments, so deleting it cascades
+    # to the pets and isn't stopped by the appointments' foreign key
+    def owner_with_pets(count):
+        ids = []
+        with repos.transaction():
+            for _ in range(count):
+                owner_id = repos.owners.add(**owner())
+                repos.pets.add_many([pet(owner_id), pet(owner_id)])
+                ids.append(owner_id)
+        return ids
+
+    def random_ids(table_name, count):
+        top = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0]
+        return [row[0] for row in conn.execute(
+            f"SELECT id FROM {table_name} WHERE id >= ? ORDER BY id LIMIT ?", (rng.randint(1, max(1, top - count)), count)
+        )]
+
+    results = {}
+    try:
+        # Per record, so the numbers don't depend on SINGLE_OPS
+        for name, add, make in (
+            ("owner", repos.owners.add, owner), ("pet", repos.pets.add, pet),
+            ("service", repos.services.add, lambda: {"service_name": "Benchmark", "cost": 10, "duration_minutes": 15}),
+            ("appointment", repos.appointments.add, appointment),
+        ):
+            summary = measure(single(add, make), repeat)
+            results[f"insert.{name}.single"] = {
+                key: round(value / single_ops, 6) if key != "runs" else value for key, value in summary.items()
+            }
+        results["insert.owners.bulk"] = measure(repos.owners.add_many, repeat, lambda: [owner() for _ in range(bulk_rows)])
+        results["insert.appointments.bulk"] = measure(
+            repos.appointments.add_many, repeat, lambda: [appointment() for _ in range(bulk_rows // 10)]
+        )
+        results["update.owners.single"] = measure(
+            lambda owner_id: repos.owners.update(owner_id, address="1 Benchmark Rd"), repeat,
+            lambda: rng.randint(1, owners)
+        )
+        results["update.pets.bulk"] = measure(
+            repos.pets.update_many, repeat,
+            lambda: [(pet_id, {"age": rng.randint(0, 18)}) for pet_id in random_ids("pets", bulk_rows)]
+        )
+        results["update.appointments.reschedule"] = measure(
+            lambda update: repos.appointments.update(update[0], **update[1]), repeat,
+            lambda: (random_ids("appointments", 1)[0], {key: value for key, value in appointment().items() if key in ("date", "time")})
+        )
+        results["delete.owners.cascade"] = measure(lambda ids: repos.owners.delete(ids[0]), repeat, lambda: owner_with_pets(1))
+        results["delete.owners.cascade_bulk"] = measure(
+            repos.owners.delete_many, repeat, lambda: owner_with_pets(bulk_rows // 10)
+        )
+    finally:
+        repos.close()
+    return results
+
+
+##### Startup #########
+# Cold start of the app through its own --measure-startup, one process per run
+def bench_startup(profile, repeat, preset="default", page="view_appointments"):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pet-clinic.py")
+    command = [
+        sys.executable, script, "--measure-startup", "--page", page,
+        "--db", profile["path"], "--db-profile", preset, "--config", "",   # no local pet_clinic.ini
+    ]
+
+    runs = []
+    for _ in range(repeat):
+        finished = subprocess.run(command, capture_output=True, text=True, timeout=300)
+        lines = finished.stdout.strip().splitlines()
+        if finished.returncode != 0 or not lines:
+            return {"startup.error": finished.stderr.strip()[-500:] or f"exit code {finished.returncode}"}
+        runs.append(json.loads(lines[-1]))
+    return {
+        f"startup.{page}.{name}": summarize([run[name] for run in runs])
+        for name in runs[0] if name != "page"
+    }
+
+
+##### Results #########
+def _version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous, current, out=sys.stdout):
+    """Print the median of every result next to the one in `previous`."""
+    for size, results in current["sizes"].items():
+        before = previous.get("sizes", {}).get(size, {}).get("results", {})
+        print(f"size {size} ({previous.get('version', '?')} -> {current['version']})", file=out)
+        if not before:
+            print("  no earlier results for this size", file=out)
+        for name, result in results["results"].items():
+            if not isinstance(result, dict) or name not in before or not isinstance(before[name], dict):
+                continue
+            old, new = before[name]["median"], result["median"]
+            ratio = new / old if old else float("inf")
+            flag = "  SLOWER" if ratio >= SLOWER and new - old >= NOISE else ""
+            print(f"  {name:<40} {old * 1000:10.2f} ms {new * 1000:10.2f} ms {ratio:6.2f}x{flag}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time table loads, writes and startup on synthetic clinics of the given sizes "
+                    "(appointments; owners, pets and services are scaled to match)."
+    )
+    parser.add_argument("--size", nargs="+", default=["10k"], help="e.g. 10k 100k 1M (default 10k)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated data (default 1)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help=f"runs of every operation (default {REPEAT})")
+    parser.add_argument("--only", nargs="+", choices=("pages", "writes", "startup"),
+                        default=("pages", "writes", "startup"), help="groups of operations to run (default all)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help=f"where generated databases are kept (default {DATA_DIR})")
+    parser.add_argument("--regenerate", action="store_true", help="generate the databases again even if they exist")
+    parser.add_argument("--db-profile", choices=sorted(database.PROFILES), help="connection preset (default: default)")
+    parser.add_argument("-o", "--output", default=OUTPUT, help=f"JSON results file (default {OUTPUT})")
+    parser.add_argument("--compare", metavar="FILE", help="print the change against an earlier results file")
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = [parse_size(size) for size in args.size]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    report = {
+        "version": _version(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "profile": args.db_profile or "default",
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+    for size in sizes:
+        print(f"size {size}: preparing data", file=sys.stderr)
+        base_path, generate_seconds = base_database(args.data_dir, size, args.seed, args.regenerate)
+        work_path = os.path.join(args.data_dir, f"work_{size}.db")
+        profile = dict(database.PROFILES[report["profile"]], path=work_path)
+
+        conn = sqlite3.connect(base_path)
+        rows = {table_name: conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+                for table_name in repositories.REPOSITORIES}
+        conn.close()
+        results = {}
+        # Each group starts from an untouched copy, so earlier writes don't skew it
+        for group, bench in (
+            ("pages", bench_pages), ("writes", bench_writes),
+            ("startup", lambda profile, repeat: bench_startup(profile, repeat, report["profile"])),
+        ):
+            if group not in args.only:
+                continue
+            print(f"size {size}: {group}", file=sys.stderr)
+            working_copy(base_path, work_path)
+            results.update(bench(profile, args.repeat))
+        report["sizes"][str(size)] = {
+            "rows": rows,
+            "database_bytes": os.path.getsize(base_path),
+            "generate_seconds": None if generate_seconds is None else round(generate_seconds, 3),
+            "results": results,
+        }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
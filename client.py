@@ -0,0 +1,321 @@
+import json
+import sqlite3
+import http.client
+import urllib.parse
+from collections import deque
+
+import repositories
+import scheduling
+
+
+TIMEOUT = 30    # seconds to wait on the server
+
+# Server error types raised as the same exception here, so callers handle
+# a clash or a bad value the same way as with a local database
+ERRORS = {
+    "NotFound": LookupError,
+    "ValueError": ValueError,
+    "IntegrityError": sqlite3.IntegrityError,
+    "OperationalError": sqlite3.OperationalError,
+}
+
+# Statements a read connection may send, anything else has to go through
+# the repositories
+READS = ("SELECT", "WITH", "PRAGMA", "EXPLAIN", "VALUES")
+
+
+def _error(body, status):
+    message = body.get("error", f"server error {status}") if isinstance(body, dict) else f"server error {status}"
+    kind = body.get("type") if isinstance(body, dict) else None
+    if kind == "BookingConflict":
+        return scheduling.BookingConflict(message, body.get("conflicts", []))
+    return ERRORS.get(kind, sqlite3.DatabaseError)(message)
+
+
+class Client:
+    """JSON calls to a clinic server (server.py) over one kept-alive HTTP
+    connection. Like a sqlite connection it belongs to one thread."""
+
+    def __init__(self, url, token=None, timeout=TIMEOUT):
+        self.url = url.rstrip("/")
+        parts = urllib.parse.urlsplit(self.url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"Server URL should look like http://host:port, got {url!r}")
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.timeout = timeout
+        self._conn = None
+        self._streaming = None     # cursor still reading its response
+
+    def _send(self, method, path, data):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self._conn.request(method, path, data, self.headers)
+        return self._conn.getresponse()
+
+    def request(self, method, path, body=None, query=None, stream=False):
+        """Parsed JSON of the response, or the response itself to read
+        line by line with `stream`. Error responses raise."""
+        if self._streaming is not None:
+            self._streaming.buffer()     # the connection is needed for this request
+        if query:
+            path = f"{path}?{urllib.parse.urlencode(query)}"
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        # A kept-alive connection the server has since closed fails on first
+        # use; only reads are sent again, a write may have gone through
+        retry = method == "GET" or path == "/api/query"
+        try:
+            try:
+                response = self._send(method, path, data)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if not retry:
+                    raise
+                response = self._send(method, path, data)
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise sqlite3.OperationalError(f"Can't reach the clinic server at {self.url}: {e}")
+
+        if response.status >= 400 or not stream:
+            payload = response.read()
+            try:
+                body = json.loads(payload) if payload else None
+            except ValueError:
+                body = None
+            if response.status >= 400:
+                raise _error(body, response.status)
+            return body
+        return response
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RemoteCursor:
+    """The rows of one statement, read from a streamed /api/query response
+    a batch at a time as they are fetched."""
+
+    arraysize = 1
+    rowcount = -1
+    lastrowid = None
+
+    def __init__(self, columns, rows=(), client=None, response=None):
+        self.description = tuple((name, None, None, None, None, None, None) for name in columns) or None
+        self._rows = deque(rows)
+        self._client = client
+        self._response = response
+
+    def _read_batch(self):
+        line = self._response.readline()
+        message = json.loads(line) if line else {"error": "the server closed the connection mid result"}
+        if "rows" in message:
+            self._rows.extend(tuple(row) for row in message["rows"])
+            return True
+        self._finish()
+        if "error" in message:
+            raise _error(message, 500)
+        return False
+
+    def _finish(self):
+        if self._response is not None:
+            self._response.read()   # the chunked terminator, so the connection can be reused
+            self._response = None
+            if self._client._streaming is self:
+                self._client._streaming = None
+
+    # Pull in the rest, e.g. before another statement uses the connection
+    def buffer(self):
+        while self._response is not None and self._read_batch():
+            pass
+
+    def fetchone(self):
+        while not self._rows and self._response is not None and self._read_batch():
+            pass
+        return self._rows.popleft() if self._rows else None
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        while len(self._rows) < size and self._response is not None and self._read_batch():
+            pass
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+
+    def fetchall(self):
+        self.buffer()
+        rows = list(self._rows)
+        self._rows.clear()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self.buffer()
+        self._rows.clear()
+
+
+class RemoteConnection:
+    """Stands in for a sqlite3 connection when the app runs against a clinic
+    server (database.connect with a `server` in the profile).
+
+    Reads are sent as they are to /api/query, so table views, search,
+    reports and the rest work unchanged. Writes go through the server's
+    record endpoints: repositories.Repositories over this connection uses
+    repository() below. Everything else that writes, such as executemany()
+    or BEGIN, raises sqlite3.OperationalError.
+    """
+
+    in_transaction = False
+    read_only = True    # the server keeps the change log pruned
+
+    def __init__(self, url, token=None):
+        self.client = Client(url, token)
+
+    def execute(self, sql, parameters=()):
+        words = sql.split()
+        first = words[0].upper() if words else ""
+        if first not in READS:
+            raise sqlite3.OperationalError(f"{first} isn't possible through the clinic server, only reads are")
+        statement = " ".join(words).lower()
+        # The server's read connections are always query only
+        if statement == "pragma query_only":
+            return RemoteCursor(["query_only"], [(1,)])
+        if statement.startswith("pragma query_only ="):
+            return RemoteCursor([])
+        # data_version means nothing across the server's pool of connections;
+        # the newest change log entry moves on every write just the same
+        if statement == "pragma data_version":
+            sql = "SELECT COALESCE(MAX(seq), 0) FROM change_log"
+
+        params = parameters if isinstance(parameters, dict) else list(parameters)
+        response = self.client.request("POST", "/api/query", {"sql": sql, "params": params}, stream=True)
+        first_line = json.loads(response.readline())
+        cursor = RemoteCursor(first_line["columns"], client=self.client, response=response)
+        self.client._streaming = cursor
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        raise sqlite3.OperationalError("Batch writes go through the clinic server's record endpoints (repositories)")
+
+    def executescript(self, script):
+        raise sqlite3.OperationalError("Scripts can't be run through the clinic server")
+
+    def commit(self):
+        pass    # every server call commits on its own
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.client.close()
+
+    def repository(self, table, cache=None):
+        return REMOTE_REPOSITORIES.get(table, RemoteRepository)(self.client, table, cache)
+
+
+class RemoteRepository:
+    """repositories.Repository, over a clinic server's record endpoints.
+
+    Every call is one request and one transaction on the server; with a
+    QueryCache, writes bump the table like local ones do.
+    """
+
+    def __init__(self, client, table, cache=None):
+        self.client = client
+        self.table = table
+        self.cache = cache
+        self.record = repositories.REPOSITORIES[table].record
+        self.path = f"/api/{table}"
+
+    def _records(self, body):
+        return [self.record(**values) for values in body["records"]]
+
+    def _write(self, method, path, body=None):
+        try:
+            return self.client.request(method, path, body)
+        finally:
+            if self.cache is not None:
+                self.cache.bump(self.table)
+
+    ##### Reading #########
+    def get(self, record_id):
+        try:
+            return self.record(**self.client.request("GET", f"{self.path}/{int(record_id)}"))
+        except LookupError:
+            return None
+
+    def get_many(self, ids):
+        ids = [int(record_id) for record_id in ids]
+        found = {}
+        for start in range(0, len(ids), repositories.ID_CHUNK_SIZE):
+            chunk = ids[start:start + repositories.ID_CHUNK_SIZE]
+            body = self.client.request("GET", self.path, query={"ids": ",".join(map(str, chunk))})
+            found.update((record.id, record) for record in self._records(body))
+        return found
+
+    def list(self, limit=None, after_id=None):
+        """Records in id order; without a limit, every record, a page at a time."""
+        records = []
+        while True:
+            query = {"limit": limit} if limit is not None else {}
+            if after_id is not None:
+                query["after_id"] = after_id
+            body = self.client.request("GET", self.path, query=query)
+            records += self._records(body)
+            if limit is not None or body["last_id"] is None:
+                return records
+            after_id = body["last_id"]
+
+    def count(self):
+        return self.client.request("GET", f"{self.path}/count")["count"]
+
+    ##### Writing #########
+    def add(self, **values):
+        return self._write("POST", self.path, values)["id"]
+
+    def add_many(self, records):
+        return self._write("POST", self.path, list(records))["count"]
+
+    # A missing record is 0 changed, as with a local database
+    def update(self, record_id, **values):
+        try:
+            return self._write("PATCH", f"{self.path}/{int(record_id)}", values)["count"]
+        except LookupError:
+            return 0
+
+    def update_many(self, updates):
+        return self._write("PATCH", self.path, [dict(values, id=record_id) for record_id, values in updates])["count"]
+
+    def delete(self, record_id):
+        try:
+            return self._write("DELETE", f"{self.path}/{int(record_id)}")["count"]
+        except LookupError:
+            return 0
+
+    def delete_many(self, ids):
+        return self._write("DELETE", self.path, {"ids": list(ids)})["count"]
+
+
+class RemotePetRepo(RemoteRepository):
+    def for_owner(self, owner_id):
+        return self._records(self.client.request("GET", self.path, query={"owner_id": owner_id}))
+
+
+class RemoteAppointmentRepo(RemoteRepository):
+    def for_pet(self, pet_id):
+        return self._records(self.client.request("GET", self.path, query={"pet_id": pet_id}))
+
+
+REMOTE_REPOSITORIES = {
+    "pets": RemotePetRepo,
+    "appointments": RemoteAppointmentRepo,
+}
@@ -0,0 +1,98 @@
+import bisect
+
+import importer
+
+
+ID_CHUNK_SIZE = importer.ID_CHUNK_SIZE   # ids per "WHERE id IN (...)"
+MATCHES = 20            # suggestions shown at a time
+
+# Form fields holding the id of a record of another table
+FIELD_TABLES = {"owner_id": "owners", "pet_id": "pets", "service_id": "services"}
+
+# (id, name, details) of the records of every table that can be looked up
+SOURCES = {
+    "owners": "SELECT id, name, contact FROM owners",
+    "pets": "SELECT id, name, species || ', ' || breed FROM pets",
+    "services": "SELECT id, service_name, printf('%.2f', cost) FROM services",
+}
+
+
+def read(conn, table, ids=None):
+    """(id, name, details) rows of `table`, all of them or those of `ids`."""
+    if ids is None:
+        return conn.execute(SOURCES[table]).fetchall()
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        rows += conn.execute(f"{SOURCES[table]} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk).fetchall()
+    return rows
+
+
+def _prefixed(keys, prefix):
+    # Entries of a sorted list of (text, id) whose text starts with `prefix`
+    position = bisect.bisect_left(keys, (prefix,))
+    while position < len(keys) and keys[position][0].startswith(prefix):
+        yield keys[position][1]
+        position += 1
+
+
+class PrefixIndex:
+    """In-memory lookup of one table's records by id or name prefix.
+
+    Ids (as text) and lower-cased names are kept in sorted lists, so a
+    lookup is a binary search plus the matches themselves, whatever the
+    size of the table. Built once from read(conn, table), then kept up to
+    date with update() as records change, without reading the table again.
+    Doesn't touch the database itself, so reads can happen on the worker.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.records = {}   # id -> (name, details)
+        self._ids = []      # (str(id), id), sorted
+        self._names = []    # (name.lower(), id), sorted
+
+    def __len__(self):
+        return len(self.records)
+
+    def replace(self, rows):
+        self.records = {row_id: (name, details) for row_id, name, details in rows}
+        self._ids = sorted((str(row_id), row_id) for row_id in self.records)
+        self._names = sorted((str(name).lower(), row_id) for row_id, (name, _) in self.records.items())
+
+    def _remove(self, row_id):
+        name, _ = self.records.pop(row_id)
+        for keys, key in ((self._ids, (str(row_id), row_id)), (self._names, (str(name).lower(), row_id))):
+            position = bisect.bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def update(self, rows, deleted=()):
+        """Take in changed or new (id, name, details) rows and drop `deleted` ids."""
+        for row_id in deleted:
+            if row_id in self.records:
+                self._remove(row_id)
+        for row_id, name, details in rows:
+            if row_id in self.records:
+                self._remove(row_id)
+            self.records[row_id] = (name, details)
+            bisect.insort(self._ids, (str(row_id), row_id))
+            bisect.insort(self._names, (str(name).lower(), row_id))
+
+    def match(self, text, limit=MATCHES):
+        """(id, name, details) of up to `limit` records whose id or name
+        starts with `text`, id matches first."""
+        text = text.strip().lower()
+        if not text:
+            return []
+        found = []
+        seen = set()
+        for keys in (self._ids, self._names):
+            for row_id in _prefixed(keys, text):
+                if row_id not in seen:
+                    seen.add(row_id)
+                    found.append((row_id, *self.records[row_id]))
+                    if len(found) >= limit:
+                        return found
+        return found
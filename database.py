@@ -0,0 +1,726 @@
+import sqlite3
+import configparser
+
+
+DB_PATH = "pet_clinic.db"
+STATEMENT_CACHE_SIZE = 256  # prepared statements sqlite3 keeps per connection (default 128)
+CONFIG_PATH = "pet_clinic.ini"
+
+
+##### CONNECTION PROFILES #########
+# Pragmas applied to every connection. WAL lets the table views keep reading
+# while a form commits, and synchronous=NORMAL only fsyncs at checkpoints
+# instead of on every commit, which is safe in WAL mode (a power cut can lose
+# the last commits but never corrupts the file).
+PROFILES = {
+    "default": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -32000,           # negative means KiB, so ~32 MB
+        "mmap_size": 268435456,         # 256 MB
+        "temp_store": "memory",
+        "busy_timeout": 5.0,            # seconds to wait on a locked database
+    },
+    # fsync on every commit
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -32000,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+        "busy_timeout": 5.0,
+    },
+    # sqlite's own defaults, for network drives where WAL doesn't work
+    "compatible": {
+        "journal_mode": "delete",
+        "synchronous": "full",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "default",
+        "busy_timeout": 5.0,
+    },
+}
+
+CHOICES = {
+    "journal_mode": ("delete", "truncate", "persist", "memory", "wal", "off"),
+    "synchronous": ("off", "normal", "full", "extra"),
+    "temp_store": ("default", "file", "memory"),
+}
+INTEGER_SETTINGS = ("cache_size", "mmap_size")
+
+# Client mode: talk to a clinic server (server.py) instead of opening `path`
+CLIENT_SETTINGS = {"server": None, "server_token": None}
+
+DEFAULT_PROFILE = dict(PROFILES["default"], path=DB_PATH, **CLIENT_SETTINGS)
+
+
+def _check_profile(profile):
+    for name, choices in CHOICES.items():
+        profile[name] = str(profile[name]).lower()
+        if profile[name] not in choices:
+            raise ValueError(f"Invalid {name} {profile[name]!r}, expected one of {', '.join(choices)}")
+    for name in INTEGER_SETTINGS:
+        profile[name] = int(profile[name])
+    profile["busy_timeout"] = float(profile["busy_timeout"])
+    for name in CLIENT_SETTINGS:
+        profile[name] = profile.get(name) or None   # an empty setting in the file means none
+    return profile
+
+
+# Build a profile from the [database] section of the config file (if there is
+# one) with `overrides` on top, e.g. the command line flags
+def load_profile(config_path=CONFIG_PATH, overrides=None):
+    settings = {}
+    config = configparser.ConfigParser()
+    if config_path and config.read(config_path):
+        if config.has_section("database"):
+            settings.update(config["database"])
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+
+    preset = settings.pop("profile", "default")
+    if preset not in PROFILES:
+        raise ValueError(f"Unknown connection profile {preset!r}, expected one of {', '.join(PROFILES)}")
+    profile = dict(PROFILES[preset], path=DB_PATH, **CLIENT_SETTINGS)
+    profile.update(settings)
+    return _check_profile(profile)
+
+
+def add_profile_arguments(parser):
+    group = parser.add_argument_group("database")
+    group.add_argument("--db", dest="path", help=f"database file (default {DB_PATH})")
+    group.add_argument("--config", default=CONFIG_PATH, help=f"config file with a [database] section (default {CONFIG_PATH})")
+    group.add_argument("--db-profile", dest="profile", choices=sorted(PROFILES), help="connection preset (default: default)")
+    group.add_argument("--journal-mode", choices=CHOICES["journal_mode"])
+    group.add_argument("--synchronous", choices=CHOICES["synchronous"])
+    group.add_argument("--cache-size", type=int, help="PRAGMA cache_size, negative values are KiB")
+    group.add_argument("--mmap-size", type=int, help="PRAGMA mmap_size in bytes, 0 disables mmap")
+    group.add_argument("--temp-store", choices=CHOICES["temp_store"])
+    group.add_argument("--server", help="URL of a clinic server (server.py) to use instead of the database file")
+    group.add_argument("--server-token", help="token the server was started with")
+    return group
+
+
+def profile_from_args(args):
+    overrides = {
+        name: getattr(args, name)
+        for name in ("path", "profile", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store",
+                     "server", "server_token")
+    }
+    return load_profile(args.config, overrides)
+
+
+# With a profiling.QueryProfiler, every statement on the connection is timed.
+# A profile with a server gives a client.RemoteConnection to it instead.
+def connect(profile=None, profiler=None):
+    profile = _check_profile(dict(DEFAULT_PROFILE, **(profile or {})))
+    if profile["server"]:
+        import client
+        return client.RemoteConnection(profile["server"], profile["server_token"])
+    if profiler is None:
+        conn = sqlite3.connect(
+            profile["path"], timeout=profile["busy_timeout"], cached_statements=STATEMENT_CACHE_SIZE
+        )
+    else:
+        import profiling
+        conn = sqlite3.connect(
+            profile["path"], timeout=profile["busy_timeout"], cached_statements=STATEMENT_CACHE_SIZE,
+            factory=profiling.ProfiledConnection
+        )
+        profiler.attach(conn)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {profile['cache_size']}")
+    conn.execute(f"PRAGMA mmap_size = {profile['mmap_size']}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    return conn
+
+
+##### SCHEMA MIGRATIONS #########
+# Each migration brings the schema up by one version. The version lives in
+# PRAGMA user_version, so an up to date database is a single pragma read at
+# startup. Only ever append to MIGRATIONS, never edit one that has shipped.
+
+def _create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pets(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            species TEXT NOT NULL,
+            breed TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            FOREIGN KEY(owner_id) REFERENCES owners(id)
+                ON UPDATE CASCADE
+                ON DELETE CASCADE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS owners(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            address TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS appointments(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            pet_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            FOREIGN KEY(pet_id) REFERENCES pets(id)
+            FOREIGN KEY(service_id) REFERENCES services(id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS services(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_name TEXT NOT NULL,
+            cost REAL NOT NULL
+        )
+    """)
+
+
+def _add_foreign_key_and_date_indexes(conn):
+    # Child side of every foreign key, so cascades and "pets of owner X" /
+    # "appointments of pet X" don't scan the whole child table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_owner_id ON pets(owner_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_pet_id ON appointments(pet_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_service_id ON appointments(service_id)")
+    # Date lookups and sorting the appointments view by date
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_date_time ON appointments(date, time)")
+
+
+def _add_search_index(conn):
+    # External content FTS5 tables: the text stays in owners/pets, the index
+    # only holds tokens. prefix='2 3' keeps short prefix queries ("jo*") fast.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS owners_fts USING fts5(
+            name, contact, email, address,
+            content='owners', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS pets_fts USING fts5(
+            name, species, breed,
+            content='pets', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+
+    # Keep both indexes in step with their tables. Cascaded deletes of pets
+    # fire these triggers too.
+    for table, columns in (("owners", ("name", "contact", "email", "address")), ("pets", ("name", "species", "breed"))):
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {table}_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        # Index the rows that are already there
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def _add_appointment_schedule(conn):
+    import scheduling
+
+    conn.execute("ALTER TABLE services ADD COLUMN duration_minutes INTEGER NOT NULL DEFAULT 30")
+    # Minutes since 1970 in clinic wall clock time, see scheduling.to_minutes
+    conn.execute("ALTER TABLE appointments ADD COLUMN starts_at INTEGER")
+    conn.execute("ALTER TABLE appointments ADD COLUMN ends_at INTEGER")
+
+    # Rewrite the dates and times typed in so far as YYYY-MM-DD and HH:MM.
+    # Ones that can't be read are left alone and just don't get a timestamp.
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, date, time FROM appointments WHERE id > ? ORDER BY id LIMIT 5000", (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for appointment_id, date, time in rows:
+            try:
+                normalized = scheduling.normalize(date, time)
+            except ValueError:
+                continue
+            if normalized != (date, time):
+                updates.append(normalized + (appointment_id,))
+        conn.executemany("UPDATE appointments SET date = ?, time = ? WHERE id = ?", updates)
+
+    # Timestamps for the appointments that are already there
+    starts_at = "CAST(strftime('%s', {row}date || ' ' || {row}time) AS INTEGER) / 60"
+    conn.execute(f"""
+        UPDATE appointments
+        SET starts_at = {starts_at.format(row='')},
+            ends_at = {starts_at.format(row='')}
+                      + (SELECT duration_minutes FROM services WHERE services.id = appointments.service_id)
+    """)
+
+    # Interval index over the booked time of every appointment. rtree_i32
+    # keeps the minute timestamps exact (the float R*Tree rounds them).
+    # Filled in one go before the triggers exist, which is much faster than
+    # going through them row by row.
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS appointment_intervals USING rtree_i32(id, starts_at, ends_at)")
+    conn.execute("""
+        INSERT INTO appointment_intervals(id, starts_at, ends_at)
+        SELECT id, starts_at, ends_at FROM appointments WHERE starts_at IS NOT NULL AND ends_at IS NOT NULL
+    """)
+
+    # starts_at / ends_at follow date, time and the service duration whatever
+    # writes the row (form, import, table edit), and the R*Tree follows them
+    set_times = f"""
+        UPDATE appointments
+        SET starts_at = {starts_at.format(row='new.')},
+            ends_at = {starts_at.format(row='new.')} + (SELECT duration_minutes FROM services WHERE id = new.service_id)
+        WHERE id = new.id;
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS appointments_schedule_insert AFTER INSERT ON appointments BEGIN {set_times} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS appointments_schedule_update
+        AFTER UPDATE OF date, time, service_id ON appointments BEGIN {set_times} END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS appointment_intervals_update
+        AFTER UPDATE OF id, starts_at, ends_at ON appointments BEGIN
+            DELETE FROM appointment_intervals WHERE id = old.id;
+            INSERT INTO appointment_intervals(id, starts_at, ends_at)
+            SELECT new.id, new.starts_at, new.ends_at WHERE new.starts_at IS NOT NULL AND new.ends_at IS NOT NULL;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS appointment_intervals_delete AFTER DELETE ON appointments BEGIN
+            DELETE FROM appointment_intervals WHERE id = old.id;
+        END
+    """)
+
+
+def _add_change_log(conn):
+    # One row per inserted/updated/deleted record of the clinic tables, so an
+    # open window can tell which rows another process (or an import) changed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    """)
+    # The timestamps of a new appointment are filled in by a second UPDATE;
+    # logging only the typed-in columns keeps that from doubling the log
+    watched = {"appointments": " OF id, date, time, pet_id, service_id"}
+    for table in CHANGE_LOG_TABLES:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_log_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', new.id, 'insert');
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_log_update AFTER UPDATE{watched.get(table, "")} ON {table} BEGIN
+                INSERT INTO change_log(table_name, row_id, op) SELECT '{table}', old.id, 'delete' WHERE old.id IS NOT new.id;
+                INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', new.id, 'update');
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_log_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', old.id, 'delete');
+            END
+        """)
+
+
+def _add_report_rollups(conn):
+    # Visit counts per service and month, species and month, and day, kept up
+    # to date by triggers so reports read a few hundred rows instead of every
+    # appointment. Revenue is visits x the service's cost, worked out on read.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_service_month(
+            service_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            PRIMARY KEY (service_id, month)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_species_month(
+            species TEXT NOT NULL,
+            month TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            PRIMARY KEY (species, month)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_day(
+            date TEXT PRIMARY KEY,
+            visits INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    rebuild_reports(conn)
+
+    # What one appointment adds to the rollups, and takes away from them again
+    species = "COALESCE((SELECT species FROM pets WHERE id = {row}.pet_id), 'unknown')"
+    add = f"""
+        INSERT INTO report_service_month(service_id, month, visits) VALUES (new.service_id, substr(new.date, 1, 7), 1)
+            ON CONFLICT(service_id, month) DO UPDATE SET visits = visits + 1;
+        INSERT INTO report_species_month(species, month, visits) VALUES ({species.format(row="new")}, substr(new.date, 1, 7), 1)
+            ON CONFLICT(species, month) DO UPDATE SET visits = visits + 1;
+        INSERT INTO report_day(date, visits) VALUES (new.date, 1)
+            ON CONFLICT(date) DO UPDATE SET visits = visits + 1;
+    """
+    remove = f"""
+        UPDATE report_service_month SET visits = visits - 1 WHERE service_id = old.service_id AND month = substr(old.date, 1, 7);
+        DELETE FROM report_service_month WHERE service_id = old.service_id AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_species_month SET visits = visits - 1
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7);
+        DELETE FROM report_species_month
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_day SET visits = visits - 1 WHERE date = old.date;
+        DELETE FROM report_day WHERE date = old.date AND visits <= 0;
+    """
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS appointments_report_insert AFTER INSERT ON appointments BEGIN
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS appointments_report_update AFTER UPDATE OF date, pet_id, service_id ON appointments
+        WHEN old.date IS NOT new.date OR old.pet_id IS NOT new.pet_id OR old.service_id IS NOT new.service_id BEGIN
+            {remove}
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS appointments_report_delete AFTER DELETE ON appointments BEGIN
+            {remove}
+        END
+    """)
+    # A pet's species changing moves its visits, month by month
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS pets_report_species AFTER UPDATE OF species ON pets
+        WHEN old.species IS NOT new.species BEGIN
+            UPDATE report_species_month SET visits = visits - (
+                SELECT COUNT(*) FROM appointments WHERE pet_id = new.id AND substr(date, 1, 7) = report_species_month.month
+            ) WHERE species = old.species;
+            DELETE FROM report_species_month WHERE species = old.species AND visits <= 0;
+            INSERT INTO report_species_month(species, month, visits)
+                SELECT new.species, substr(date, 1, 7), COUNT(*) FROM appointments WHERE pet_id = new.id GROUP BY 2
+                ON CONFLICT(species, month) DO UPDATE SET visits = visits + excluded.visits;
+        END
+    """)
+
+
+def _add_display_views(conn):
+    # Rows with the names behind their ids, for the table views. Every join is
+    # on a primary key, so a page costs one rowid lookup per row and table.
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS pets_view AS
+        SELECT p.*, o.name AS owner_name
+        FROM pets p LEFT JOIN owners o ON o.id = p.owner_id
+    """)
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS appointments_view AS
+        SELECT a.*, p.name AS pet_name, p.owner_id AS owner_id, o.name AS owner_name,
+               s.service_name AS service_name, s.cost AS cost
+        FROM appointments a
+        LEFT JOIN pets p ON p.id = a.pet_id
+        LEFT JOIN owners o ON o.id = p.owner_id
+        LEFT JOIN services s ON s.id = a.service_id
+    """)
+
+
+def _add_reminder_outbox(conn):
+    # Appointment reminders waiting to go out and the ones sent, one per
+    # appointment and start time (a rescheduled appointment gets a new one).
+    # No foreign key, the history outlives deleted appointments.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reminder_outbox(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            appointment_id INTEGER NOT NULL,
+            starts_at INTEGER NOT NULL,
+            email TEXT,
+            contact TEXT,
+            message TEXT NOT NULL,
+            queued_at TEXT NOT NULL,
+            sent_at TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            UNIQUE(appointment_id, starts_at)
+        )
+    """)
+    # Finding the unsent ones reads only them, however long the history
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminder_outbox_unsent ON reminder_outbox(id) WHERE sent_at IS NULL")
+
+
+def _add_report_revenue(conn):
+    # Revenue per service and month as it was booked, rather than visits x
+    # today's cost, so repricing a service leaves past months alone. Rows
+    # already there can only be priced at the current costs.
+    conn.execute("ALTER TABLE report_service_month ADD COLUMN revenue REAL NOT NULL DEFAULT 0")
+    conn.execute("""
+        UPDATE report_service_month
+        SET revenue = visits * COALESCE((SELECT cost FROM services WHERE id = service_id), 0)
+    """)
+
+    # The triggers of _add_report_rollups, now also adding the service's cost
+    # at the time. What a single visit was charged isn't kept, so taking one
+    # away takes away the average of its service and month.
+    species = "COALESCE((SELECT species FROM pets WHERE id = {row}.pet_id), 'unknown')"
+    add = f"""
+        INSERT INTO report_service_month(service_id, month, visits, revenue)
+            VALUES (new.service_id, substr(new.date, 1, 7), 1, COALESCE((SELECT cost FROM services WHERE id = new.service_id), 0))
+            ON CONFLICT(service_id, month) DO UPDATE SET visits = visits + 1, revenue = revenue + excluded.revenue;
+        INSERT INTO report_species_month(species, month, visits) VALUES ({species.format(row="new")}, substr(new.date, 1, 7), 1)
+            ON CONFLICT(species, month) DO UPDATE SET visits = visits + 1;
+        INSERT INTO report_day(date, visits) VALUES (new.date, 1)
+            ON CONFLICT(date) DO UPDATE SET visits = visits + 1;
+    """
+    remove = f"""
+        UPDATE report_service_month SET visits = visits - 1, revenue = revenue - revenue / visits
+            WHERE service_id = old.service_id AND month = substr(old.date, 1, 7);
+        DELETE FROM report_service_month WHERE service_id = old.service_id AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_species_month SET visits = visits - 1
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7);
+        DELETE FROM report_species_month
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_day SET visits = visits - 1 WHERE date = old.date;
+        DELETE FROM report_day WHERE date = old.date AND visits <= 0;
+    """
+    for trigger in ("appointments_report_insert", "appointments_report_update", "appointments_report_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_insert AFTER INSERT ON appointments BEGIN
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_update AFTER UPDATE OF date, pet_id, service_id ON appointments
+        WHEN old.date IS NOT new.date OR old.pet_id IS NOT new.pet_id OR old.service_id IS NOT new.service_id BEGIN
+            {remove}
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_delete AFTER DELETE ON appointments BEGIN
+            {remove}
+        END
+    """)
+
+
+def _add_appointment_price(conn):
+    # What a visit was charged, the service's cost when it was booked. The
+    # report rollups add and take away exactly this, so moving or deleting a
+    # visit no longer works from the month's average (_add_report_revenue).
+    conn.execute("ALTER TABLE appointments ADD COLUMN price REAL")
+    # Bookings made so far are priced at today's costs; no trigger watches
+    # price, so this doesn't touch the change log or the rollups
+    conn.execute("UPDATE appointments SET price = (SELECT cost FROM services WHERE id = service_id)")
+    # Like starts_at, filled in for whatever writes the row (form, import,
+    # table edit). Changing the price later goes through the repositories,
+    # which reprice an appointment moved to another service.
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS appointments_price_insert AFTER INSERT ON appointments
+        WHEN new.price IS NULL BEGIN
+            UPDATE appointments SET price = (SELECT cost FROM services WHERE id = new.service_id) WHERE id = new.id;
+        END
+    """)
+
+    # The rollup triggers once more, with the price of the row. A new row's
+    # price may not be stamped yet when they run, so they fall back on the
+    # cost the stamp is about to use.
+    price = "COALESCE({row}.price, (SELECT cost FROM services WHERE id = {row}.service_id), 0)"
+    species = "COALESCE((SELECT species FROM pets WHERE id = {row}.pet_id), 'unknown')"
+    add = f"""
+        INSERT INTO report_service_month(service_id, month, visits, revenue)
+            VALUES (new.service_id, substr(new.date, 1, 7), 1, {price.format(row="new")})
+            ON CONFLICT(service_id, month) DO UPDATE SET visits = visits + 1, revenue = revenue + excluded.revenue;
+        INSERT INTO report_species_month(species, month, visits) VALUES ({species.format(row="new")}, substr(new.date, 1, 7), 1)
+            ON CONFLICT(species, month) DO UPDATE SET visits = visits + 1;
+        INSERT INTO report_day(date, visits) VALUES (new.date, 1)
+            ON CONFLICT(date) DO UPDATE SET visits = visits + 1;
+    """
+    remove = f"""
+        UPDATE report_service_month SET visits = visits - 1, revenue = revenue - {price.format(row="old")}
+            WHERE service_id = old.service_id AND month = substr(old.date, 1, 7);
+        DELETE FROM report_service_month WHERE service_id = old.service_id AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_species_month SET visits = visits - 1
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7);
+        DELETE FROM report_species_month
+            WHERE species = {species.format(row="old")} AND month = substr(old.date, 1, 7) AND visits <= 0;
+        UPDATE report_day SET visits = visits - 1 WHERE date = old.date;
+        DELETE FROM report_day WHERE date = old.date AND visits <= 0;
+    """
+    for trigger in ("appointments_report_insert", "appointments_report_update", "appointments_report_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_insert AFTER INSERT ON appointments BEGIN
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_update AFTER UPDATE OF date, pet_id, service_id ON appointments
+        WHEN old.date IS NOT new.date OR old.pet_id IS NOT new.pet_id OR old.service_id IS NOT new.service_id BEGIN
+            {remove}
+            {add}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER appointments_report_delete AFTER DELETE ON appointments BEGIN
+            {remove}
+        END
+    """)
+
+    # Revenue from the prices. Visits that are only counted, having been
+    # archived, keep their share of what the month had.
+    conn.execute("""
+        CREATE TEMP TABLE booked AS
+        SELECT service_id, substr(date, 1, 7) AS month, COUNT(*) AS visits, SUM(price) AS revenue
+        FROM appointments GROUP BY 1, 2
+    """)
+    conn.execute("""
+        UPDATE report_service_month
+        SET revenue = b.revenue + (report_service_month.visits - b.visits) * report_service_month.revenue
+                                  / report_service_month.visits
+        FROM temp.booked b
+        WHERE b.service_id = report_service_month.service_id AND b.month = report_service_month.month
+    """)
+    conn.execute("DROP TABLE temp.booked")
+
+
+MIGRATIONS = [
+    _create_tables,
+    _add_foreign_key_and_date_indexes,
+    _add_search_index,
+    _add_appointment_schedule,
+    _add_change_log,
+    _add_report_rollups,
+    _add_display_views,
+    _add_reminder_outbox,
+    _add_report_revenue,
+    _add_appointment_price,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"Database schema version {version} is newer than this app supports ({SCHEMA_VERSION})"
+        )
+
+    # Every pending migration runs in its own transaction together with the
+    # version bump, so a failed step leaves the database at the last good version
+    for next_version in range(version + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[next_version - 1](conn)
+            conn.execute(f"PRAGMA user_version = {next_version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    return SCHEMA_VERSION
+
+
+##### CHANGE LOG #########
+CHANGE_LOG_TABLES = ("owners", "pets", "appointments", "services")
+CHANGE_LOG_KEEP = 50000     # newest entries kept, older ones are pruned
+
+
+def last_change(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def changes_since(conn, seq, limit):
+    """Rows changed after change `seq`, as ({table: {row id: last op}}, new seq).
+
+    The dict is None instead when more than `limit` rows changed, or the log
+    was pruned past `seq`; callers should reload everything then.
+    """
+    rows = conn.execute(
+        "SELECT seq, table_name, row_id, op FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit + 1)
+    ).fetchall()
+    if not rows:
+        return {}, seq
+    if len(rows) > limit or rows[0][0] != seq + 1:
+        return None, last_change(conn)
+
+    changes = {}
+    for _, table_name, row_id, op in rows:
+        changes.setdefault(table_name, {})[row_id] = op
+    return changes, rows[-1][0]
+
+
+def prune_change_log(conn, keep=CHANGE_LOG_KEEP):
+    # Only once there is twice as much as we keep, so this is a rare write
+    first, last = conn.execute("SELECT MIN(seq), MAX(seq) FROM change_log").fetchone()
+    if first is not None and last - first >= 2 * keep:
+        conn.execute("DELETE FROM change_log WHERE seq <= ?", (last - keep,))
+        conn.commit()
+
+
+##### REPORTS #########
+REPORT_TABLES = ("report_service_month", "report_species_month", "report_day")
+
+
+# Recount the rollups from the appointments, e.g. after a bulk load done
+# with the triggers bypassed. On a connection with the archive attached
+# (archive.attach) archived visits are counted too, through its view.
+def rebuild_reports(conn):
+    archived = conn.execute("SELECT 1 FROM sqlite_temp_master WHERE type = 'view' AND name = 'appointments_all'").fetchone()
+    source = "appointments_all" if archived else "appointments"
+    for table in REPORT_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    # Before _add_report_revenue there is no revenue column yet
+    if any(row[1] == "revenue" for row in conn.execute("PRAGMA table_info(report_service_month)")):
+        conn.execute(f"""
+            INSERT INTO report_service_month(service_id, month, visits, revenue)
+            SELECT a.service_id, substr(a.date, 1, 7), COUNT(*), SUM(COALESCE(a.price, s.cost, 0))
+            FROM {source} a LEFT JOIN services s ON s.id = a.service_id
+            GROUP BY 1, 2
+        """)
+    else:
+        conn.execute(f"""
+            INSERT INTO report_service_month(service_id, month, visits)
+            SELECT service_id, substr(date, 1, 7), COUNT(*) FROM {source} GROUP BY 1, 2
+        """)
+    conn.execute(f"""
+        INSERT INTO report_species_month(species, month, visits)
+        SELECT COALESCE(p.species, 'unknown'), substr(a.date, 1, 7), COUNT(*)
+        FROM {source} a LEFT JOIN pets p ON p.id = a.pet_id
+        GROUP BY 1, 2
+    """)
+    conn.execute(f"INSERT INTO report_day(date, visits) SELECT date, COUNT(*) FROM {source} GROUP BY date")
+
+
+##### DISPLAY VIEWS #########
+# Table -> the view the table pages read instead, and for every table it
+# joins in, the column of the view holding that table's id. A write to one
+# of those tables changes what the view shows for rows with that id.
+DISPLAY_VIEWS = {
+    "pets": ("pets_view", {"owners": "owner_id"}),
+    "appointments": ("appointments_view", {"pets": "pet_id", "owners": "owner_id", "services": "service_id"}),
+}
@@ -0,0 +1,256 @@
+import itertools
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+
+import database
+from query_cache import QueryCache
+
+
+POLL_INTERVAL = 500         # ms between checks for changes made by other processes
+MAX_ROW_CHANGES = 2000      # more changed rows than this and views just reload
+
+
+class DatabaseWorker(QObject):
+    """Runs jobs against its own sqlite connection, inside the worker thread."""
+
+    finished = pyqtSignal(int, object)  # job id, result
+    failed = pyqtSignal(int, object)    # job id, exception
+
+    def __init__(self, profile, profiler=None):
+        super().__init__()
+        self.profile = profile
+        self.profiler = profiler
+        self.conn = None
+
+    @pyqtSlot(int, object)
+    def run_job(self, job_id, job):
+        try:
+            # sqlite connections belong to the thread that opened them
+            if self.conn is None:
+                self.conn = database.connect(self.profile, self.profiler)
+            result = job(self.conn)
+        except Exception as e:
+            if self.conn is not None and self.conn.in_transaction:
+                self.conn.rollback()
+            self.failed.emit(job_id, e)
+        else:
+            self.finished.emit(job_id, result)
+
+    @pyqtSlot()
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        QThread.currentThread().quit()
+
+
+class DatabaseThread(QObject):
+    """GUI side handle of the database worker.
+
+    A job is any callable taking a sqlite3 connection. submit() queues it
+    for the worker thread and returns straight away; the job's result (or
+    exception) comes back to on_result/on_error on the GUI thread. Jobs run
+    one at a time in submission order, so a write is always visible to the
+    reads queued after it.
+
+    Background jobs (polling and the like) don't count towards busy_changed,
+    so they don't flash the "Working..." status.
+
+    `cache` is the read cache shared by every job on this connection, see
+    fetch_all(), execute() and repositories.Repository. With a `profiler`
+    (profiling.QueryProfiler) every statement the jobs run is timed.
+    """
+
+    busy_changed = pyqtSignal(bool)
+    # Exception of a job submitted without on_error, for the window to show
+    job_failed = pyqtSignal(object)
+
+    _job_submitted = pyqtSignal(int, object)
+    _close_requested = pyqtSignal()
+
+    def __init__(self, profile=None, parent=None, profiler=None):
+        super().__init__(parent)
+        self.profiler = profiler
+        self._callbacks = {}
+        self._busy_jobs = set()
+        self.cache = QueryCache()
+        self._job_ids = itertools.count(1)
+
+        self._thread = QThread()
+        self._worker = DatabaseWorker(profile, profiler)
+        self._worker.moveToThread(self._thread)
+        self._job_submitted.connect(self._worker.run_job)
+        self._close_requested.connect(self._worker.close)
+        self._worker.finished.connect(self._on_finished)
+        self._worker.failed.connect(self._on_failed)
+        self._thread.start()
+
+    def submit(self, job, on_result=None, on_error=None, background=False):
+        job_id = next(self._job_ids)
+        self._callbacks[job_id] = (on_result, on_error)
+        if not background:
+            self._busy_jobs.add(job_id)
+            if len(self._busy_jobs) == 1:
+                self.busy_changed.emit(True)
+        self._job_submitted.emit(job_id, job)
+        return job_id
+
+    def is_busy(self):
+        return bool(self._busy_jobs)
+
+    # Let queued jobs finish, then close the connection and stop the thread
+    def close(self):
+        if self._thread.isRunning():
+            self._close_requested.emit()
+            self._thread.wait()
+
+    def _pop(self, job_id):
+        callbacks = self._callbacks.pop(job_id, (None, None))
+        if job_id in self._busy_jobs:
+            self._busy_jobs.discard(job_id)
+            if not self._busy_jobs:
+                self.busy_changed.emit(False)
+        return callbacks
+
+    @pyqtSlot(int, object)
+    def _on_finished(self, job_id, result):
+        on_result, _ = self._pop(job_id)
+        if on_result is not None:
+            on_result(result)
+
+    @pyqtSlot(int, object)
+    def _on_failed(self, job_id, error):
+        _, on_error = self._pop(job_id)
+        if on_error is not None:
+            on_error(error)
+        else:
+            self.job_failed.emit(error)
+
+
+class JobProgress(QObject):
+    """Progress reports from a running job.
+
+    Jobs call report() on the worker thread; `changed` is delivered on the
+    thread that created the JobProgress, so it can drive widgets directly.
+    """
+
+    changed = pyqtSignal(object)
+
+    def report(self, value):
+        self.changed.emit(value)
+
+
+class ChangeWatcher(QObject):
+    """Tells the views which rows changed, whoever changed them.
+
+    Every POLL_INTERVAL ms a background job reads PRAGMA data_version, which
+    moves whenever another connection (another process, an import running
+    on its own worker) commits. Only then is the change_log read. Our own
+    worker's commits don't move data_version, so call check() after them.
+
+    `changed` carries {table: {row id: "insert"|"update"|"delete"}}, or None
+    when so much changed that reloading is cheaper than going row by row.
+    """
+
+    changed = pyqtSignal(object)
+    # Why checking failed, once until a check works again (it's retried every poll)
+    failed = pyqtSignal(str)
+
+    def __init__(self, db, parent=None, interval=POLL_INTERVAL):
+        super().__init__(parent)
+        self.db = db
+        self._data_version = None
+        self._last_seq = None
+        self._pending = False
+        self._check_again = False
+        self._failing = False
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(lambda: self._poll(False))
+
+    # Start from the current state of the log, earlier changes are already on screen
+    def start(self):
+        def job(conn):
+            return conn.execute("PRAGMA data_version").fetchone()[0], database.last_change(conn)
+
+        def on_started(result):
+            self._data_version, self._last_seq = result
+            self._timer.start()
+
+        self.db.submit(job, on_started, background=True)
+
+    def stop(self):
+        self._timer.stop()
+
+    def check(self):
+        self._poll(True)
+
+    def _poll(self, force):
+        if self._last_seq is None:
+            return
+        if self._pending:
+            self._check_again = self._check_again or force
+            return
+
+        data_version, last_seq = self._data_version, self._last_seq
+
+        cache = self.db.cache
+
+        def job(conn):
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == data_version and not force:
+                return version, {}, last_seq
+            changes, seq = database.changes_since(conn, last_seq, MAX_ROW_CHANGES)
+            # Other connections' writes never went through our cache, forget
+            # what they touched before anything reads it again
+            if changes is None:
+                cache.clear()
+            else:
+                cache.bump(*changes)
+            if not getattr(conn, "read_only", False):    # a clinic server prunes its own
+                database.prune_change_log(conn)
+            return version, changes, seq
+
+        def on_result(result):
+            self._pending = False
+            self._failing = False
+            self._data_version, changes, self._last_seq = result
+            if changes != {}:
+                self.changed.emit(changes)
+            if self._check_again:
+                self._check_again = False
+                self._poll(True)
+
+        def on_error(error):
+            self._pending = False
+            if not self._failing:
+                self._failing = True
+                self.failed.emit(str(error))
+
+        self._pending = True
+        # A check after our own write shows as busy like the write itself
+        self.db.submit(job, on_result, on_error, background=not force)
+
+
+##### Common jobs #########
+# With a cache, the rows are served from it until one of `tables` is written
+def fetch_all(sql, params=(), cache=None, tables=()):
+    if cache is None:
+        return lambda conn: conn.execute(sql, params).fetchall()
+    return lambda conn: cache.fetch_all(conn, sql, params, tables)
+
+
+def fetch_one(sql, params=()):
+    return lambda conn: conn.execute(sql, params).fetchone()
+
+
+# Run one write statement and commit it, returns the new rowid for inserts.
+# Cached reads of `tables` are invalidated once it has committed.
+def execute(sql, params=(), cache=None, tables=()):
+    def job(conn):
+        cursor = conn.execute(sql, params)
+        conn.commit()
+        if cache is not None:
+            cache.bump(*tables)
+        return cursor.lastrowid
+    return job
+
@@ -0,0 +1,265 @@
+import os
+import sys
+import csv
+import json
+import zlib
+import struct
+import argparse
+from array import array
+
+import database
+
+
+BATCH_SIZE = 5000       # rows per fetchmany, and per row group in columnar files
+EXPORT_TABLES = ("owners", "pets", "services", "appointments")
+FORMATS = ("csv", "jsonl", "columnar")
+EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".pcol": "columnar"}
+
+
+def format_for_path(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+##### Writers #########
+# Each writer takes the column names, then batches of row tuples
+
+class CsvWriter:
+    def __init__(self, f, columns):
+        self.writer = csv.writer(f)
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonlWriter:
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+
+    def write_rows(self, rows):
+        self.f.writelines(json.dumps(dict(zip(self.columns, row)), default=str) + "\n" for row in rows)
+
+    def close(self):
+        pass
+
+
+# Columnar layout, all integers little endian:
+#
+#   file        = MAGIC, u32 header length, JSON header {"columns": [...]},
+#                 row group*, END_MARK, u64 total rows
+#   row group   = GROUP_MARK, u32 row count, one column chunk per column
+#   column chunk= kind (1 byte), u32 null mask length, zlib(null mask),
+#                 u32 data length, zlib(data)
+#
+# kind is b"i" (int64 array), b"d" (float64 array) or b"s" (int64 end offsets
+# followed by the UTF-8 text of every value). The null mask is one byte per
+# row, and empty when the chunk has no nulls. Every chunk is typed on its own,
+# so a column that mixes types in sqlite still round-trips as text.
+MAGIC = b"PCLCOL01"
+GROUP_MARK = b"RGRP"
+END_MARK = b"END!"
+
+
+def _encode_column(values):
+    present = [value for value in values if value is not None]
+    null_mask = b"" if len(present) == len(values) else bytes(value is None for value in values)
+
+    if all(type(value) is int for value in present):
+        kind = b"i"
+        data = array("q", (0 if value is None else value for value in values))
+    elif all(type(value) in (int, float) for value in present):
+        kind = b"d"
+        data = array("d", (0.0 if value is None else float(value) for value in values))
+    else:
+        kind = b"s"
+        encoded = [b"" if value is None else str(value).encode("utf-8") for value in values]
+        ends, total = array("q"), 0
+        for item in encoded:
+            total += len(item)
+            ends.append(total)
+        if sys.byteorder == "big":
+            ends.byteswap()
+        return kind, null_mask, ends.tobytes() + b"".join(encoded)
+
+    if sys.byteorder == "big":
+        data.byteswap()
+    return kind, null_mask, data.tobytes()
+
+
+def _decode_column(kind, null_mask, data, row_count):
+    if kind == b"s":
+        ends = array("q")
+        ends.frombytes(data[:8 * row_count])
+        if sys.byteorder == "big":
+            ends.byteswap()
+        blob = data[8 * row_count:]
+        values, start = [], 0
+        for end in ends:
+            values.append(blob[start:end].decode("utf-8"))
+            start = end
+    else:
+        values = array("q" if kind == b"i" else "d")
+        values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        values = values.tolist()
+
+    if null_mask:
+        values = [None if is_null else value for value, is_null in zip(values, null_mask)]
+    return values
+
+
+class ColumnarWriter:
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+        self.total_rows = 0
+        header = json.dumps({"columns": list(columns)}).encode("utf-8")
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        self.f.write(GROUP_MARK + struct.pack("<I", len(rows)))
+        for values in zip(*rows):
+            kind, null_mask, data = _encode_column(values)
+            null_mask = zlib.compress(null_mask) if null_mask else b""
+            data = zlib.compress(data)
+            self.f.write(kind + struct.pack("<I", len(null_mask)) + null_mask + struct.pack("<I", len(data)) + data)
+        self.total_rows += len(rows)
+
+    def close(self):
+        self.f.write(END_MARK + struct.pack("<Q", self.total_rows))
+
+
+def read_columnar(path):
+    """Yield the column names, then every row of a columnar export as a tuple."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a pet clinic columnar file")
+        header_length, = struct.unpack("<I", f.read(4))
+        columns = json.loads(f.read(header_length))["columns"]
+        yield columns
+
+        while True:
+            mark = f.read(4)
+            if mark == END_MARK:
+                return
+            if mark != GROUP_MARK:
+                raise ValueError(f"{path} is truncated or corrupt")
+            row_count, = struct.unpack("<I", f.read(4))
+            column_values = []
+            for _ in columns:
+                kind = f.read(1)
+                null_length, = struct.unpack("<I", f.read(4))
+                null_mask = zlib.decompress(f.read(null_length)) if null_length else b""
+                data_length, = struct.unpack("<I", f.read(4))
+                data = zlib.decompress(f.read(data_length))
+                column_values.append(_decode_column(kind, null_mask, data, row_count))
+            yield from zip(*column_values)
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "columnar": ColumnarWriter}
+
+
+##### Export #########
+def export_query(conn, sql, path, fmt=None, params=(), batch_size=BATCH_SIZE, progress=None, should_stop=None):
+    """Stream the result of a query into `path` in constant memory.
+
+    Rows are pulled with fetchmany(batch_size) and written batch by batch.
+    The file is written under a temporary name and only renamed into place
+    once complete, so a scheduled job never picks up half an export. The
+    query runs with PRAGMA query_only, so an export can't modify anything.
+    Returns the stats dict, `progress` gets it after every batch.
+    """
+    fmt = fmt or format_for_path(path)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    stats = {"path": path, "rows": 0, "cancelled": False}
+    temp_path = path + ".tmp"
+    query_only = conn.execute("PRAGMA query_only").fetchone()[0]
+    conn.execute("PRAGMA query_only = ON")
+    try:
+        cursor = conn.execute(sql, params)
+        if cursor.description is None:
+            raise ValueError("Only queries that return rows can be exported")
+        columns = [description[0] for description in cursor.description]
+
+        binary = fmt == "columnar"
+        with open(temp_path, "wb" if binary else "w", newline=None if binary else "", encoding=None if binary else "utf-8") as f:
+            writer = WRITERS[fmt](f, columns)
+            while True:
+                if should_stop is not None and should_stop():
+                    stats["cancelled"] = True
+                    break
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                writer.write_rows(rows)
+                stats["rows"] += len(rows)
+                if progress is not None:
+                    progress(dict(stats))
+            writer.close()
+        cursor.close()
+
+        if stats["cancelled"]:
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        conn.execute(f"PRAGMA query_only = {query_only}")
+    return stats
+
+
+def export_table(conn, table_name, path, fmt=None, **kwargs):
+    if table_name not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table {table_name!r}, expected one of {', '.join(EXPORT_TABLES)}")
+    return export_query(conn, f"SELECT * FROM {table_name} ORDER BY id", path, fmt, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a clinic table or query to CSV, JSONL or columnar (.pcol) files")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--table", choices=EXPORT_TABLES, help="table to export")
+    source.add_argument("--query", help="SELECT query to export")
+    parser.add_argument("-o", "--output", required=True, help="file to write")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"rows per fetch (default {BATCH_SIZE})")
+    database.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or format_for_path(args.output)
+    if fmt is None:
+        parser.error("can't tell the format from the file extension, pass --format")
+    try:
+        profile = database.profile_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    conn = database.connect(profile)
+    database.migrate(conn)
+
+    def report(stats):
+        print(f"\r{stats['rows']} rows written", end="", file=sys.stderr)
+
+    if args.table:
+        stats = export_table(conn, args.table, args.output, fmt, batch_size=args.batch_size, progress=report)
+    else:
+        stats = export_query(conn, args.query, args.output, fmt, batch_size=args.batch_size, progress=report)
+    report(stats)
+    print(f" to {args.output}", file=sys.stderr)
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+import itertools
+
+import database
+import scheduling
+
+
+BATCH_SIZE = 5000       # rows per executemany / transaction
+ID_CHUNK_SIZE = 500     # ids per "WHERE id IN (...)" foreign key lookup
+
+# Tables in the order they have to be imported for foreign keys to resolve
+IMPORT_ORDER = ("owners", "services", "pets", "appointments")
+
+TABLES = {
+    "owners": {
+        "columns": ("name", "contact", "email", "address"),
+        "integer": (),
+        "real": (),
+        "references": {},
+    },
+    "services": {
+        "columns": ("service_name", "cost", "duration_minutes"),
+        "integer": ("duration_minutes",),
+        "real": ("cost",),
+        "references": {},
+        "defaults": {"duration_minutes": scheduling.DEFAULT_DURATION},
+    },
+    "pets": {
+        "columns": ("name", "age", "species", "breed", "owner_id"),
+        "integer": ("age", "owner_id"),
+        "real": (),
+        "references": {"owner_id": "owners"},
+    },
+    "appointments": {
+        "columns": ("date", "time", "pet_id", "service_id"),
+        "integer": ("pet_id", "service_id"),
+        "real": (),
+        "references": {"pet_id": "pets", "service_id": "services"},
+        # Stored as YYYY-MM-DD / HH:MM so the database can time the appointment
+        "dates": ("date",),
+        "times": ("time",),
+    },
+}
+
+
+# Yield (line number, record dict, error) for every record of a .csv or
+# .jsonl file, one line at a time
+def read_records(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record, None
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, {"raw": line}, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, {"raw": line}, "expected a JSON object"
+                continue
+            yield line_number, record, None
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# One field as it is stored, raises ValueError with the reason
+def convert_value(spec, column, value):
+    if column in spec["integer"]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{column} must be a whole number, got {value!r}")
+    if column in spec["real"]:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{column} must be a number, got {value!r}")
+    if column in spec.get("dates", ()):
+        return scheduling.parse_date(value).isoformat()
+    if column in spec.get("times", ()):
+        return scheduling.parse_time(value).strftime("%H:%M")
+    return str(value).strip()
+
+
+# Record dict -> (id, *columns) row for the INSERT, raises ValueError with the reason
+def convert_record(spec, record):
+    row = []
+    record_id = record.get("id")
+    if record_id in (None, ""):
+        row.append(None)  # let sqlite assign one
+    else:
+        try:
+            row.append(int(record_id))
+        except (TypeError, ValueError):
+            raise ValueError(f"id must be a whole number, got {record_id!r}")
+
+    for column in spec["columns"]:
+        value = record.get(column)
+        if value is None or str(value).strip() == "":
+            if column in spec.get("defaults", {}):
+                row.append(spec["defaults"][column])
+                continue
+            raise ValueError(f"missing {column}")
+        row.append(convert_value(spec, column, value))
+    return tuple(row)
+
+
+def _existing_ids(conn, table_name, ids):
+    ids = list(ids)
+    existing = set()
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ", ".join("?" for _ in chunk)
+        existing.update(
+            row[0] for row in conn.execute(f"SELECT id FROM {table_name} WHERE id IN ({placeholders})", chunk)
+        )
+    return existing
+
+
+class _Rejects:
+    """Writes rejected records to a JSONL file, opened on the first reject."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+    def add(self, line_number, record, error):
+        self.count += 1
+        if self.path is None:
+            return
+        if self.file is None:
+            self.file = open(self.path, "w", encoding="utf-8")
+        self.file.write(json.dumps({"line": line_number, "error": error, "record": record}) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def import_file(conn, table_name, path, batch_size=BATCH_SIZE, rejects_path="", progress=None, should_stop=None):
+    """Stream the records of `path` into `table_name` in batched transactions.
+
+    Only one batch is held in memory at a time. Foreign keys of a batch are
+    checked with a few `id IN (...)` queries, then the good rows go in with
+    one executemany and one commit. Rejected records are written to
+    `rejects_path` (default: next to the input file, None to skip) along with
+    their line number and the reason. Appointments get their timestamps like
+    any other, but aren't checked for clashes: an import is taken as the
+    record of what was booked.
+
+    `progress` is called with the running stats after every batch, and the
+    import stops between batches once `should_stop()` returns true.
+    """
+    spec = TABLES[table_name]
+    if rejects_path == "":
+        rejects_path = path + ".rejected.jsonl"
+    rejects = _Rejects(rejects_path)
+    columns = ("id",) + spec["columns"]
+    insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    stats = {"table": table_name, "read": 0, "imported": 0, "rejected": 0, "cancelled": False}
+
+    try:
+        for batch in _batches(read_records(path), batch_size):
+            if should_stop is not None and should_stop():
+                stats["cancelled"] = True
+                break
+
+            pending = []  # (line number, record, row)
+            for line_number, record, error in batch:
+                stats["read"] += 1
+                if error is None:
+                    try:
+                        pending.append((line_number, record, convert_record(spec, record)))
+                        continue
+                    except ValueError as e:
+                        error = str(e)
+                rejects.add(line_number, record, error)
+
+            # Foreign keys, checked for the whole batch at once
+            for column, parent_table in spec["references"].items():
+                index = columns.index(column)
+                existing = _existing_ids(conn, parent_table, {row[index] for _, _, row in pending})
+                checked = []
+                for line_number, record, row in pending:
+                    if row[index] in existing:
+                        checked.append((line_number, record, row))
+                    else:
+                        rejects.add(line_number, record, f"{column} {row[index]} does not exist in {parent_table}")
+                pending = checked
+
+            stats["imported"] += _insert_batch(conn, insert_sql, pending, rejects)
+            stats["rejected"] = rejects.count
+            if progress is not None:
+                progress(dict(stats))
+    finally:
+        rejects.close()
+
+    stats["rejected"] = rejects.count
+    return stats
+
+
+def _insert_batch(conn, insert_sql, pending, rejects):
+    if not pending:
+        return 0
+    try:
+        conn.executemany(insert_sql, [row for _, _, row in pending])
+        conn.commit()
+        return len(pending)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+
+    # Something in the batch breaks a constraint (duplicate email, id...).
+    # Go row by row inside one transaction: a failed INSERT only undoes itself.
+    inserted = 0
+    for line_number, record, row in pending:
+        try:
+            conn.execute(insert_sql, row)
+            inserted += 1
+        except sqlite3.IntegrityError as e:
+            rejects.add(line_number, record, str(e))
+    conn.commit()
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Bulk import clinic records from CSV or JSONL files. "
+                    "Tables are imported in the order owners, services, pets, appointments."
+    )
+    for table_name in IMPORT_ORDER:
+        parser.add_argument(f"--{table_name}", metavar="FILE", help=f"CSV or JSONL file of {table_name}")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"rows per transaction (default {BATCH_SIZE})")
+    parser.add_argument("--no-rejects", action="store_true", help="don't write FILE.rejected.jsonl files")
+    database.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    files = [(table_name, getattr(args, table_name)) for table_name in IMPORT_ORDER if getattr(args, table_name)]
+    if not files:
+        parser.error("nothing to import, pass at least one of " + ", ".join(f"--{t}" for t in IMPORT_ORDER))
+    for _, path in files:
+        if not os.path.isfile(path):
+            parser.error(f"no such file: {path}")
+
+    try:
+        profile = database.profile_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    conn = database.connect(profile)
+    database.migrate(conn)
+
+    def report(stats):
+        print(f"\r{stats['table']}: {stats['read']} read, {stats['imported']} imported, "
+              f"{stats['rejected']} rejected", end="", file=sys.stderr)
+
+    rejected = 0
+    for table_name, path in files:
+        stats = import_file(
+            conn, table_name, path,
+            batch_size=args.batch_size,
+            rejects_path=None if args.no_rejects else "",
+            progress=report
+        )
+        report(stats)
+        print(file=sys.stderr)
+        if stats["rejected"] and not args.no_rejects:
+            print(f"  rejected records written to {path}.rejected.jsonl", file=sys.stderr)
+        rejected += stats["rejected"]
+
+    # The triggers logged every imported row, and no app may be running here
+    # to trim the log (db_worker.ChangeWatcher)
+    database.prune_change_log(conn)
+    conn.close()
+    return 1 if rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,263 @@
+import time
+STARTED = time.perf_counter()  # before the heavy imports, for --measure-startup
+
+import os
 import sys
-import sqlite3
+import json
+import argparse
+import threading
+from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, QLineEdit, 
                             QVBoxLayout, QHBoxLayout, QWidget, QStackedWidget, QToolBar, QAction, 
-                            QSizePolicy, QGraphicsDropShadowEffect, QMessageBox, QTableWidget,
-                            QTableWidgetItem, QHeaderView, QInputDialog)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QColor, QIcon
+                            QSizePolicy, QGraphicsDropShadowEffect, QMessageBox, QTableView,
+                            QHeaderView, QInputDialog, QFileDialog, QProgressDialog, QTableWidget,
+                            QTableWidgetItem, QDateEdit, QComboBox, QListWidget, QListWidgetItem,
+                            QPlainTextEdit, QTabWidget, QCheckBox, QCompleter, QAbstractItemView,
+                            QStyledItemDelegate)
+from PyQt5.QtCore import Qt, QTimer, QDate, QEvent, QRect, pyqtSignal
+from PyQt5.QtGui import QFont, QColor, QIcon, QStandardItemModel, QStandardItem, QPainter
+
+import database
+import importer
+import exporter
+import search
+import scheduling
+import repositories
+import profiling
+import reports
+import completion
+import backup
+import archive
+import reminders
+from db_worker import DatabaseThread, ChangeWatcher, JobProgress
+from table_model import SqlTableModel
+
+IMPORTED = time.perf_counter()
+
+PAGE_NAMES = (
+    "create_pet", "create_owner", "create_appointment", "create_service",
+    "view_pets", "view_owners", "view_appointments", "view_services",
+    "search", "availability", "reports", "diagnostics",
+)
+
+HISTOGRAM_BARS = " ▁▂▃▄▅▆▇█"
+
+# Set once on the main window before any page is built, so every widget is
+# styled as it's created instead of the whole window being polished again.
+# Widgets are picked out by object name, or by the page they are on.
+THEME = """
+    QToolBar#nav-menu{
+        background-color: #F8FAFC;
+        margin: 0;
+    }
+    QToolBar#nav-menu QToolButton{
+        background-color: transparent;
+        border: none;
+        padding: 8px 10px;
+        font-size: 20px;
+        border-radius: 8px;
+    }
+    QToolBar#nav-menu QToolButton:hover{
+        background-color: #CBDCEB;
+    }
+    QLineEdit#search-input{
+        font-size: 18px;
+        padding: 6px;
+        border: 1px solid #CBD5E0;
+        border-radius: 8px;
+    }
+    QWidget#container{
+        background-color: #F8FAFC;
+        border-radius: 10px;
+    }
+    QLabel#form-title{
+        font-size: 40px;
+        font-weight: 400;
+        letter-spacing: 1;
+    }
+    QLabel#form-description{
+        font-size: 19px;
+        font-weight: 200;
+        letter-spacing: 1;
+        color: grey;
+    }
+    QLabel#form-label{
+        font-size: 20px;
+        font-weight: light;
+        letter-spacing: 1;
+        margin-bottom: 10px;
+    }
+    QLineEdit#form-input{
+        font-size: 20px;
+        border: none;
+        padding: 10px;
+        border-radius: 8px;
+        border: 1px solid #664343;
+    }
+    QLineEdit#form-input:focus{
+        border: 2px solid #133E87;
+    }
+    QTableView#records-table{
+        background-color: #F8FAFC; /* Even rows */
+        alternate-background-color: #E2E8F0; /* Odd rows */
+        gridline-color: #CBD5E0;
+    }
+    QTableView#records-table QHeaderView::section{
+        background-color: #133E87;
+        font-size: 20px;
+        color: white;
+        padding: 4px;
+        border: none;
+        text-transform: uppercase;
+        font-weight: 500;
+    }
+    QPushButton#form-submit{
+        font-size: 20px;
+        padding: 15px 8px;
+        border: none;
+        border-radius: 8px;
+        background-color: #133E87;
+        color: #F8FAFC;
+    }
+    QWidget#records-page QLabel, QWidget#records-page QPushButton, QWidget#records-page QCheckBox{
+        font-size: 18px;
+    }
+    QWidget#records-page QPushButton#refresh-button{
+        font-size: 20px;
+    }
+    QWidget#records-page QLineEdit#filter-input{
+        font-size: 16px;
+        padding: 4px;
+    }
+    QWidget#tool-page QLabel, QWidget#tool-page QListWidget, QWidget#tool-page QTableWidget,
+    QWidget#tool-page QHeaderView{
+        font-size: 18px;
+    }
+    QWidget#tool-page QPushButton, QWidget#tool-page QLineEdit, QWidget#tool-page QDateEdit,
+    QWidget#tool-page QComboBox, QWidget#tool-page QCheckBox{
+        font-size: 18px;
+        padding: 6px;
+    }
+    QWidget#diagnostics-page QLabel{
+        font-size: 16px;
+    }
+    QWidget#diagnostics-page QPushButton{
+        font-size: 18px;
+        padding: 6px;
+    }
+    QWidget#diagnostics-page QTableWidget, QWidget#diagnostics-page QHeaderView,
+    QWidget#diagnostics-page QPlainTextEdit{
+        font-size: 14px;
+    }
+    QWidget#diagnostics-page QPlainTextEdit{
+        font-family: monospace;
+    }
+    QWidget#tool-page QLabel#page-header, QWidget#diagnostics-page QLabel#page-header{
+        font-size: 24px;
+    }
+"""
+
+BACKUP_STARTUP_DELAY = 60   # seconds before a due backup starts, leaving startup alone
+BACKUP_RETRY = 3600         # seconds before trying again after a failed backup
+REMINDER_MAX_WAIT = 3600    # seconds the reminder scheduler sleeps at most between runs
+
+# Suggestions for an id field, looked up in a completion.PrefixIndex as the
+# user types; picking one fills in just the id
+class IdCompleter(QCompleter):
+    def __init__(self, index, line_edit):
+        super().__init__(line_edit)
+        self.index = index
+        self.suggestions = QStandardItemModel(self)
+        self.setModel(self.suggestions)
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)  # already matched by the index
+        line_edit.setCompleter(self)
+        line_edit.textEdited.connect(self.suggest)
+
+    def suggest(self, text):
+        self.suggestions.clear()
+        for row_id, name, details in self.index.match(text):
+            item = QStandardItem(f"{row_id}  {name} ({details})")
+            item.setData(str(row_id), Qt.UserRole)
+            self.suggestions.appendRow(item)
+
+    def pathFromIndex(self, index):
+        return index.data(Qt.UserRole)
+
+
+# Update/Delete of every row of a table page, painted into its last column
+# and hit-tested on click: no widgets per row, whatever the page size
+class RowActionsDelegate(QStyledItemDelegate):
+    BUTTONS = (("Update", QColor("#133E87")), ("Delete", QColor("red")))
+    BUTTON_WIDTH = 100
+    BUTTON_HEIGHT = 44
+    SPACING = 10
+
+    clicked = pyqtSignal(int, str)  # row, button label
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont()
+        self.font.setPixelSize(20)
+        self.text_color = QColor("#F8FAFC")
+
+    def _is_actions(self, index):
+        return index.column() >= len(index.model().columns)
+
+    # Side by side in the middle of the cell, narrower when the column is
+    def _button_rects(self, rect):
+        count = len(self.BUTTONS)
+        button_width = max(1, min(self.BUTTON_WIDTH, (rect.width() - (count + 1) * self.SPACING) // count))
+        height = min(self.BUTTON_HEIGHT, rect.height() - self.SPACING)
+        left = rect.center().x() - (count * button_width + (count - 1) * self.SPACING) // 2
+        top = rect.center().y() - height // 2
+        return [
+            QRect(left + number * (button_width + self.SPACING), top, button_width, height)
+            for number in range(count)
+        ]
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        if not self._is_actions(index):
+            return
+        painter.save()
+        painter.setClipRect(option.rect)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setFont(self.font)
+        for (label, color), rect in zip(self.BUTTONS, self._button_rects(option.rect)):
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(color)
+            painter.drawRoundedRect(rect, 8, 8)
+            painter.setPen(self.text_color)
+            painter.drawText(rect, Qt.AlignCenter, label)
+        painter.restore()
+
+    # Presses on a button are kept from changing the selection, the release
+    # is the click (a quick second click arrives as a double click)
+    def editorEvent(self, event, model, option, index):
+        mouse_events = (QEvent.MouseButtonPress, QEvent.MouseButtonDblClick, QEvent.MouseButtonRelease)
+        if self._is_actions(index) and event.type() in mouse_events:
+            for (label, _), rect in zip(self.BUTTONS, self._button_rects(option.rect)):
+                if rect.contains(event.pos()):
+                    if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+                        self.clicked.emit(index.row(), label)
+                    return True
+        return super().editorEvent(event, model, option, index)
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, db_profile=None, start_page="create_owner", profiler=None, backup_settings=None, archive_settings=None,
+                 reminder_settings=None, scheduling_settings=None):
         super().__init__()
+        self.db_profile = db_profile
+        self.profiler = profiler
+        self.backup_settings = backup_settings or backup.load_settings(None)
+        self.archive_settings = archive_settings or archive.load_settings(None, db_path=(db_profile or database.DEFAULT_PROFILE)["path"])
+        self.reminder_settings = reminder_settings or reminders.load_settings(None)
+        self.scheduling_settings = scheduling_settings or scheduling.load_settings(None)
         self.setWindowIcon(QIcon("eul-logo.png"))
         self.setWindowTitle("Pet Clinic System")
+        if db_profile and db_profile.get("server"):
+            self.setWindowTitle(f"Pet Clinic System - {db_profile['server']}")
         self.setGeometry(100, 100, 1000, 800)
 
         self.central_widget = QWidget()
@@ -24,63 +269,101 @@ class MainWindow(QMainWindow):
         main_layout = QVBoxLayout(self.central_widget)
         main_layout.addWidget(self.stacked_widget)
 
+        self.table_views = {}
+        self.completion_indexes = {}    # table -> completion.PrefixIndex, built when a form needs it
+        self.search_number = 0
+        self.long_jobs = set()
+
+        self.setStyleSheet(THEME)
         self.init_db()
+        self.init_backups()
+        self.init_reminders()
         self.create_pages()
         self.create_navigation_menu()
 
-        self.stacked_widget.setCurrentIndex(1)
+        self.show_page(start_page)
         self.showMaximized()
 
 
     def init_db(self):
-        self.conn = sqlite3.connect("pet_clinic.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("PRAGMA foreign_keys = ON;")
-
-        # Create tables
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pets(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                species TEXT NOT NULL,
-                breed TEXT NOT NULL,
-                owner_id INTEGER NOT NULL,
-                FOREIGN KEY(owner_id) REFERENCES owners(id)
-                    ON UPDATE CASCADE
-                    ON DELETE CASCADE
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS owners(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                contact TEXT NOT NULL UNIQUE,
-                email TEXT NOT NULL UNIQUE,
-                address TEXT NOT NULL
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS appointments(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                time TEXT NOT NULL,
-                pet_id INTEGER NOT NULL,
-                service_id INTEGER NOT NULL,
-                FOREIGN KEY(pet_id) REFERENCES pets(id)
-                FOREIGN KEY(service_id) REFERENCES services(id)
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS services(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                service_name TEXT NOT NULL,
-                cost REAL NOT NULL
-            )
-        """)
+        # All SQL runs on the worker thread's own connection, never on the GUI thread
+        self.db = DatabaseThread(self.db_profile, self, self.profiler)
+        self.db.busy_changed.connect(lambda busy: self.statusBar().showMessage("Working..." if busy else ""))
+        # Jobs without an error handler of their own still get reported
+        self.db.job_failed.connect(lambda error: self.show_message("error", "Error", f"Database error: {str(error)}"))
+
+        # Read cache hit rate, for tuning MAX_CACHED_ROWS and friends
+        self.cache_label = QLabel()
+        self.statusBar().addPermanentWidget(self.cache_label)
+        self.db.busy_changed.connect(lambda busy: None if busy else self.update_cache_label())
+
+        # Create tables and bring older databases up to the current schema.
+        # Jobs run in order, so this finishes before any page queries a table.
+        self.db.submit(
+            database.migrate,
+            on_error=lambda e: self.show_message("error", "Error", f"Failed to open the database: {str(e)}")
+        )
+
+        # Open table views follow row changes from this window and from
+        # anything else writing to the database
+        self.changes = ChangeWatcher(self.db, self)
+        self.changes.changed.connect(self.on_database_changed)
+        self.changes.failed.connect(lambda message: self.show_message(
+            "warning", "Warning", f"Failed to check for changes: {message}\nTables may be out of date until this works again."
+        ))
+        self.changes.start()
+
+    def update_cache_label(self):
+        stats = self.db.cache.stats()
+        self.cache_label.setText(f"Cache: {stats['hit_rate']:.0%} hits ({stats['hits']} of {stats['hits'] + stats['misses']})")
+        self.cache_label.setToolTip(f"{stats['entries']} cached results, {stats['rows']} rows")
 
-        #commit changes 
-        self.conn.commit()
+    def on_database_changed(self, changes):
+        for table_name, table_view in self.table_views.items():
+            model = table_view.model()
+            if changes is None:
+                model.refresh()
+                continue
+            if table_name in changes:
+                model.apply_changes(changes[table_name])
+            # Renamed owners, pets and services show up in the joined columns
+            for lookup_table in model.lookups:
+                if lookup_table in changes:
+                    model.apply_lookup_changes(lookup_table, changes[lookup_table])
+        self.update_completions(changes)
+        if self.reminders is not None and (changes is None or "appointments" in changes):
+            appointments = None if changes is None else changes["appointments"]
+            self.submit_reminders(lambda conn: self.reminders.changes(conn, appointments))
+        # Reports read rollups, a refresh is a handful of small queries
+        if self.stacked_widget.currentWidget() is self.pages.get("reports"):
+            if changes is None or any(table_name in changes for table_name in reports.SOURCE_TABLES):
+                self.refresh_reports()
+
+    # Long jobs (imports and the like) get a worker and connection of their
+    # own, so the table views keep loading meanwhile (WAL lets them read while
+    # the job writes)
+    def run_long_job(self, job, on_result=None, on_error=None):
+        worker = DatabaseThread(self.db_profile, self, self.profiler)
+        self.long_jobs.add(worker)
+
+        def finish(callback, value):
+            self.long_jobs.discard(worker)
+            worker.close()
+            worker.deleteLater()
+            if callback is not None:
+                callback(value)
+
+        worker.submit(job, lambda result: finish(on_result, result), lambda error: finish(on_error, error))
+
+    def closeEvent(self, event):
+        self.changes.stop()
+        self.backup_cancelled.set()
+        for worker in list(self.long_jobs):
+            worker.close()
+        self.db.close()
+        if self.profiler is not None:
+            self.profiler.log_summary()
+        super().closeEvent(event)
 
     # Function to create a message
     def show_message(self, message_type, title, message):
@@ -104,12 +387,6 @@ class MainWindow(QMainWindow):
         container = QWidget()
         container.setFixedWidth(700)
         container.setObjectName("container")
-        container.setStyleSheet("""
-                                #container{
-                                    background-color: #F8FAFC;
-                                    border-radius: 10px;
-                                }
-                            """)
         
         shadow = QGraphicsDropShadowEffect()
         shadow.setBlurRadius(20)
@@ -122,21 +399,12 @@ class MainWindow(QMainWindow):
         outer_layout.setContentsMargins(30, 40, 30, 40)
         
         header = QLabel(title)
-        header.setStyleSheet("""
-                            font-size: 40px; 
-                            font-weight: 400; 
-                            letter-spacing: 1;
-                        """)
+        header.setObjectName("form-title")
         header.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)
         header.setFixedHeight(40)
         
         paragraph = QLabel(description)
-        paragraph.setStyleSheet("""
-                                font-size: 19px;
-                                font-weight: 200;
-                                letter-spacing: 1;
-                                color: grey;
-                            """)
+        paragraph.setObjectName("form-description")
         paragraph.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)
         paragraph.setFixedHeight(18)
         
@@ -155,6 +423,8 @@ class MainWindow(QMainWindow):
             line_edit = QLineEdit(self)
             line_edit.setObjectName("form-input")
             line_edit.setPlaceholderText(field["placeholder"])
+            if field["name"] in completion.FIELD_TABLES:
+                IdCompleter(self.completion_index(completion.FIELD_TABLES[field["name"]]), line_edit)
             form_group.addWidget(label)
             form_group.addWidget(line_edit)
             outer_layout.addLayout(form_group)
@@ -162,14 +432,7 @@ class MainWindow(QMainWindow):
             inputs[field["name"]] = line_edit
 
         submit_button = QPushButton("Submit")
-        submit_button.setStyleSheet("""
-                                    font-size: 20px;
-                                    padding: 15px 8px;
-                                    border: none;
-                                    border-radius: 8px;
-                                    background-color: #133E87;   
-                                    color: #F8FAFC;                 
-                                """)
+        submit_button.setObjectName("form-submit")
         submit_button.setFixedWidth(200)
         submit_button.clicked.connect(lambda: submit_callback(inputs))
         button_layout = QHBoxLayout()
@@ -184,29 +447,33 @@ class MainWindow(QMainWindow):
         page_layout.addWidget(container, alignment=Qt.AlignCenter)
         page_layout.addStretch()
 
-        self.setStyleSheet("""
-            QLabel#form-label{
-                font-size: 20px;
-                font-weight: light;
-                letter-spacing: 1;
-                margin-bottom: 10px;
-            }
-            QLineEdit#form-input{
-                font-size: 20px;
-                border: none;
-                padding: 10px;
-                border-radius: 8px;
-                border: 1px solid #664343;
-            }
-            QLineEdit#form-input:focus{
-                border: 2px solid #133E87;
-            }
-            """)
-        
         page.setLayout(page_layout)
+        page.inputs = inputs
         return page
             
 
+    ##### ID COMPLETION #########
+    # The index is read once on the worker and then patched with the records
+    # the change watcher reports, so typing never waits on the database
+    def completion_index(self, table):
+        index = self.completion_indexes.get(table)
+        if index is None:
+            index = self.completion_indexes[table] = completion.PrefixIndex(table)
+            self.db.submit(lambda conn: completion.read(conn, table), index.replace)
+        return index
+
+    def update_completions(self, changes):
+        for table, index in self.completion_indexes.items():
+            if changes is None:
+                self.db.submit(lambda conn, table=table: completion.read(conn, table), index.replace)
+            elif table in changes:
+                deleted = [row_id for row_id, op in changes[table].items() if op == "delete"]
+                changed = [row_id for row_id, op in changes[table].items() if op != "delete"]
+                self.db.submit(
+                    lambda conn, table=table, changed=changed: completion.read(conn, table, changed),
+                    lambda rows, index=index, deleted=deleted: index.update(rows, deleted)
+                )
+
     def create_pages(self): 
         pet_fields = [
             {"label": "Name*", "placeholder": "Enter the pet's name", "name": "name"},
@@ -224,365 +491,1130 @@ class MainWindow(QMainWindow):
         ]
 
         appointment_fields = [
-            {"label": "Date*", "placeholder": "Enter the appointment date", "name": "date"},
-            {"label": "Time*", "placeholder": "Enter the appointment time", "name": "time"},
+            {"label": "Date*", "placeholder": "Enter the appointment date (YYYY-MM-DD)", "name": "date"},
+            {"label": "Time*", "placeholder": "Enter the appointment time (HH:MM)", "name": "time"},
             {"label": "Pet ID*", "placeholder": "Enter the pet's ID", "name": "pet_id"},
             {"label": "Service ID*", "placeholder": "Enter the service ID", "name": "service_id"}
         ]
 
         service_fields = [
             {"label": "Service*", "placeholder": "Enter the service name", "name": "service_name"},
-            {"label": "Cost*", "placeholder": "Enter the service cost", "name": "cost"}
+            {"label": "Cost*", "placeholder": "Enter the service cost", "name": "cost"},
+            {"label": "Duration", "placeholder": f"Minutes per appointment (default {scheduling.DEFAULT_DURATION})", "name": "duration_minutes"}
         ]
         
-        self.create_pet_page = self.create_form_page(
-            "Add a New Pet", 
-            "Please fill out the form below to add a new pet to the system.", 
-            pet_fields,
-            self.submit_pet
-        )
-        self.create_owner_page = self.create_form_page(
-            "Add a New Owner", 
-            "Please fill out the form below to add a new owner to the system.", 
-            owner_fields,
-            self.submit_owner
-        )
-        self.create_appointment_page = self.create_form_page(
-            "Schedule an Appointment", 
-            "Please fill out the form below to schedule an appointment.", 
-            appointment_fields,
-            self.submit_appointment
-        )
-        self.create_service_page = self.create_form_page(
-            "Add a New Service", 
-            "Please fill out the form below to add a new service to the system.", 
-            service_fields,
-            self.submit_service
-        )
+        # Nothing is built here: each page is created the first time it is
+        # shown (see page()), so startup doesn't pay for pages never opened
+        self.pages = {}
+        self.page_builders = {
+            "create_pet": lambda: self.create_form_page(
+                "Add a New Pet", 
+                "Please fill out the form below to add a new pet to the system.", 
+                pet_fields,
+                self.submit_pet
+            ),
+            "create_owner": lambda: self.create_form_page(
+                "Add a New Owner", 
+                "Please fill out the form below to add a new owner to the system.", 
+                owner_fields,
+                self.submit_owner
+            ),
+            "create_appointment": lambda: self.create_form_page(
+                "Schedule an Appointment", 
+                "Please fill out the form below to schedule an appointment.", 
+                appointment_fields,
+                self.submit_appointment
+            ),
+            "create_service": lambda: self.create_form_page(
+                "Add a New Service", 
+                "Please fill out the form below to add a new service to the system.", 
+                service_fields,
+                self.submit_service
+            ),
+            "view_pets": lambda: self.create_table_page("pets"),
+            "view_owners": lambda: self.create_table_page("owners"),
+            "view_appointments": lambda: self.create_table_page("appointments"),
+            "view_services": lambda: self.create_table_page("services"),
+            "search": self.create_search_page,
+            "availability": self.create_availability_page,
+            "reports": self.create_reports_page,
+            "diagnostics": self.create_diagnostics_page,
+        }
 
-        self.view_pets_page = self.create_table_page("pets")
-        self.view_owners_page = self.create_table_page("owners")
-        self.view_appointments_page = self.create_table_page("appointments")
-        self.view_services_page = self.create_table_page("services")
-        
-        self.stacked_widget.addWidget(self.create_pet_page)
-        self.stacked_widget.addWidget(self.create_owner_page)
-        self.stacked_widget.addWidget(self.create_appointment_page)
-        self.stacked_widget.addWidget(self.create_service_page)
-        self.stacked_widget.addWidget(self.view_pets_page)
-        self.stacked_widget.addWidget(self.view_owners_page)
-        self.stacked_widget.addWidget(self.view_appointments_page)
-        self.stacked_widget.addWidget(self.view_services_page)
+    # The page called `name`, built and added to the stack on first use.
+    # Table pages start loading their rows on the worker as they are built.
+    def page(self, name):
+        if name not in self.pages:
+            page = self.page_builders[name]()
+            self.pages[name] = page
+            self.stacked_widget.addWidget(page)
+        return self.pages[name]
+
+    def show_page(self, name):
+        self.stacked_widget.setCurrentWidget(self.page(name))
+        if name == "diagnostics":
+            self.refresh_diagnostics()
+        elif name == "reports":
+            self.refresh_reports()
+
+    # Clear the form once the worker has committed the new record
+    def on_submitted(self, inputs, message):
+        self.changes.check()
+        self.show_message("success", "Success", message)
+
+        for field in inputs.values():
+            field.clear()
+
+    def on_submit_failed(self, error):
+        self.show_message("error", "Error", f"An error occurred: {str(error)}")
+
+    # Job running `action` on the repositories of the worker's connection.
+    # Writes through them also drop the cached reads of their table.
+    def repo_job(self, action):
+        return lambda conn: action(repositories.Repositories(conn, self.db.cache, self.scheduling_settings))
 
     def submit_pet(self, inputs):
-        try:
-            if not inputs["name"].text() or not inputs["age"].text() or not inputs["species"].text() or not inputs["breed"].text() or not inputs["owner_id"].text():
-                self.show_message("warning", "Warning", "Please fill out fields marked with *")
-                return
-            self.cursor.execute("""
-            INSERT INTO pets (name, age, species, breed, owner_id)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                inputs["name"].text(),
-                inputs["age"].text(),
-                inputs["species"].text(),
-                inputs["breed"].text(),
-                inputs["owner_id"].text()
-            )
+        if not inputs["name"].text() or not inputs["age"].text() or not inputs["species"].text() or not inputs["breed"].text() or not inputs["owner_id"].text():
+            self.show_message("warning", "Warning", "Please fill out fields marked with *")
+            return
+        values = {name: field.text() for name, field in inputs.items()}
+        self.db.submit(
+            self.repo_job(lambda repos: repos.pets.add(**values)),
+            lambda _: self.on_submitted(inputs, "Pet added successfully!"),
+            self.on_submit_failed
         )
-            self.conn.commit()
-            self.show_message("success", "Success", "Pet added successfully!")
-
-            for field in inputs.values():
-                field.clear()
-        except sqlite3.IntegrityError as e:
-            self.show_message("error", "Error", f"An error occured: {str(e)}")
-        except Exception as e:
-            self.show_message("error", "Error", f"An error occurred: {str(e)}") 
 
     def submit_owner(self, inputs):
         if not inputs["name"].text() or not inputs["contact"].text() or not inputs["email"].text() or not inputs["address"].text():
             self.show_message("warning", "Warning", "Please fill out fields marked with *")
             return
-        try:
-            self.cursor.execute("""
-            INSERT INTO owners (name, contact, email, address)
-            VALUES (?, ?, ?, ?)
-            """,
-            (
-                inputs["name"].text(),
-                inputs["contact"].text(),
-                inputs["email"].text(),
-                inputs["address"].text()
-            )
+        values = {name: field.text() for name, field in inputs.items()}
+        self.db.submit(
+            self.repo_job(lambda repos: repos.owners.add(**values)),
+            lambda _: self.on_submitted(inputs, "Owner added successfully!"),
+            self.on_submit_failed
         )
-            self.conn.commit()
-            self.show_message("success", "Success", "Owner added successfully!")
-
-            for field in inputs.values():
-                field.clear()
-        except sqlite3.IntegrityError as e:
-            self.show_message("error", "Error", f"An error occured: {str(e)}")
-        except Exception as e:
-            self.show_message("error", "Error", str(e))
 
     def submit_appointment(self, inputs):
         if not inputs["date"].text() or not inputs["time"].text() or not inputs["pet_id"].text() or not inputs["service_id"].text():
             self.show_message("warning", "Warning", "Please fill out fields marked with *")
             return
-        try:
-            self.cursor.execute("""
-            INSERT INTO appointments (date, time, pet_id, service_id)
-            VALUES (?, ?, ?, ?)
-            """,
-            (
-                inputs["date"].text(),
-                inputs["time"].text(),
-                inputs["pet_id"].text(),
-                inputs["service_id"].text()
-            )
-        )
-            self.conn.commit()
-            self.show_message("success", "Success", "Appointment scheduled successfully!")
+        values = {name: field.text() for name, field in inputs.items()}
 
-            for field in inputs.values():
-                field.clear()
-        except sqlite3.IntegrityError as e:
-            self.show_message("error", "Error", f"An error occured: {str(e)}")
-        except Exception as e:
-            self.show_message("error", "Error", f"An error occurred: {str(e)}")
+        def on_failed(error):
+            if isinstance(error, scheduling.BookingConflict):
+                self.show_message("warning", "Time Not Available", f"{error}\nUse Free Slots to find an open time.")
+            else:
+                self.on_submit_failed(error)
+
+        # Checked against the other appointments and booked in one go on the worker
+        self.db.submit(
+            self.repo_job(lambda repos: repos.appointments.add(**values)),
+            lambda _: self.on_submitted(inputs, "Appointment scheduled successfully!"),
+            on_failed
+        )
 
     def submit_service(self, inputs):
         if not inputs["service_name"].text() or not inputs["cost"].text():
             self.show_message("warning", "Warning", "Please fill fields marked with *")
             return
-        try:
-            self.cursor.execute("""
-            INSERT INTO services (service_name, cost)
-            VALUES (?, ?)
-            """,
-            (
-                inputs["service_name"].text(),
-                inputs["cost"].text()
-            )
+        values = {name: field.text() for name, field in inputs.items()}  # an empty duration gets the default
+        self.db.submit(
+            self.repo_job(lambda repos: repos.services.add(**values)),
+            lambda _: self.on_submitted(inputs, "Service added successfully!"),
+            self.on_submit_failed
         )
-            self.conn.commit()
-            self.show_message("success", "Success", "Service added successfully!")
-
-            for field in inputs.values():
-                field.clear()
-        except sqlite3.IntegrityError as e:
-            self.show_message("error", "Error", f"An error occured: {str(e)}")
-        except Exception as e:
-            self.show_message("error", "Error", f"An error occurred: {str(e)}")   
 
     ##### FOR VIEWING DATA #########
     def create_table_page(self, table_name):
         page = QWidget()
+        page.setObjectName("records-page")
         layout = QVBoxLayout(page)
 
-        table_widget = QTableWidget()
-        table_widget.setColumnCount(0)
-        table_widget.setRowCount(0)
+        table_view = QTableView()
+        table_view.setObjectName("records-table")
+        self.table_views[table_name] = table_view
+        model = SqlTableModel(self.db, table_name, table_view)
+        model.load_failed.connect(lambda message: self.show_message("error", "Error", f"Failed to load table: {message}"))
+        table_view.setModel(model)
+        table_view.setAlternatingRowColors(True)
+        table_view.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # ResizeToContents would measure every fetched row on each layout pass
+        table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table_view.verticalHeader().setDefaultSectionSize(60)
+
+        # Header clicks sort in sqlite through SqlTableModel.sort
+        table_view.horizontalHeader().setSortIndicator(0, Qt.AscendingOrder)
+        table_view.setSortingEnabled(True)
+
+        # One filter box per column, applied together shortly after typing stops.
+        # The columns are only known once the worker has read the table info.
+        filter_layout = QHBoxLayout()
+        filter_inputs = {}
+        filter_timer = QTimer(page)
+        filter_timer.setSingleShot(True)
+        filter_timer.setInterval(300)
+        filter_timer.timeout.connect(lambda: model.set_filters({column: line_edit.text() for column, line_edit in filter_inputs.items()}))
+
+        def add_filter_inputs(columns):
+            for column in columns:
+                if column in filter_inputs:
+                    continue
+                line_edit = QLineEdit()
+                line_edit.setPlaceholderText(f"Filter {column}")
+                line_edit.setObjectName("filter-input")
+                line_edit.textChanged.connect(filter_timer.start)
+                filter_layout.addWidget(line_edit)
+                filter_inputs[column] = line_edit
+
+        model.columns_loaded.connect(add_filter_inputs)
+
+        # Page controls
+        page_controls = QHBoxLayout()
+        first_button = QPushButton("<< First")
+        previous_button = QPushButton("< Previous")
+        next_button = QPushButton("Next >")
+        last_button = QPushButton("Last >>")
+        page_label = QLabel()
+        page_label.setAlignment(Qt.AlignCenter)
+        first_button.clicked.connect(model.first_page)
+        previous_button.clicked.connect(model.previous_page)
+        next_button.clicked.connect(model.next_page)
+        last_button.clicked.connect(model.last_page)
+        model.page_changed.connect(lambda number, count, total: page_label.setText(f"Page {number} of {count} ({total} rows)"))
+        for button in (first_button, previous_button):
+            page_controls.addWidget(button)
+        page_controls.addWidget(page_label)
+        for button in (next_button, last_button):
+            page_controls.addWidget(button)
+
+        # Update/Delete are drawn by the delegate, rows shifting around need no upkeep
+        actions = RowActionsDelegate(table_view)
+        actions.clicked.connect(
+            lambda row_idx, label: (self.update_record if label == "Update" else self.delete_record)(row_idx, table_name, table_view)
+        )
+        table_view.setItemDelegate(actions)
 
         refresh_button = QPushButton(f"Refresh {table_name} Table")
-        refresh_button.setStyleSheet("""
-                                     font-size: 20px;
-                                """)
-        refresh_button.clicked.connect(lambda: self.populate_table(table_widget, table_name))
+        refresh_button.setObjectName("refresh-button")
+        def refresh():
+            self.db.cache.bump(table_name)  # read it from the database, not the cache
+            self.populate_table(table_view, table_name)
+
+        refresh_button.clicked.connect(refresh)
+
+        # Several rows at once (shift/ctrl click, Ctrl+A for the whole page),
+        # then one batch for all of them
+        table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        batch_layout = QHBoxLayout()
+        selection_label = QLabel()
+        update_selected_button = QPushButton("Update Selected")
+        delete_selected_button = QPushButton("Delete Selected")
+        update_selected_button.clicked.connect(lambda: self.update_selected_records(table_name, table_view))
+        delete_selected_button.clicked.connect(lambda: self.delete_selected_records(table_name, table_view))
+
+        def show_selection(*_):
+            count = len(table_view.selectionModel().selectedRows())
+            selection_label.setText(f"{count} selected" if count else "Select rows to update or delete them together")
+            update_selected_button.setEnabled(bool(count))
+            delete_selected_button.setEnabled(bool(count))
+
+        table_view.selectionModel().selectionChanged.connect(show_selection)
+        model.modelReset.connect(show_selection)    # the selection is cleared without a signal
+        show_selection()
+        batch_layout.addWidget(selection_label)
+        batch_layout.addStretch()
+        if table_name == "appointments":
+            self.add_archive_controls(batch_layout, model)
+        for button in (update_selected_button, delete_selected_button):
+            batch_layout.addWidget(button)
 
         layout.addWidget(refresh_button)
-        layout.addWidget(table_widget)
+        layout.addLayout(filter_layout)
+        layout.addLayout(batch_layout)
+        layout.addWidget(table_view)
+        layout.addLayout(page_controls)
 
-        self.populate_table(table_widget, table_name)
+        self.populate_table(table_view, table_name)
 
         return page
-    
-    def populate_table(self, table_widget, table_name):
-        try:
-            self.cursor.execute(f"SELECT * FROM {table_name}")
-            rows = self.cursor.fetchall()
-            column_names = [description[0] for description in self.cursor.description] #self.cursor.description contains metadata about the columns
 
-            table_widget.setRowCount(len(rows))
-            table_widget.setColumnCount(len(column_names) + 1)
-            table_widget.setHorizontalHeaderLabels(column_names + ["Actions"])
+    def populate_table(self, table_view, table_name):
+        # The model queues the first chunk on the worker, the rest follow as the view scrolls
+        table_view.model().refresh()
 
-            for row_idx, row_data in enumerate(rows): #enumerate returns the index and the value
-                for col_idx, col_data in enumerate(row_data):
-                    table_widget.setItem(row_idx, col_idx, QTableWidgetItem(str(col_data)))
+    def update_record(self, row_idx, table_name, table_view):
+        model = table_view.model()
+        columns = model.columns
 
-                button_layout  = QHBoxLayout()
+        # Get the row data
+        record = model.row_data(row_idx)
+        if record is None:
+            return  # Row was deleted since it was loaded
+        row_data = [str(value) for value in record]
 
-                update_button = QPushButton("Update")
-                update_button.setObjectName("update-button")
-                update_button.setFixedWidth(100)
-                update_button.clicked.connect(lambda _, r=row_idx, t=table_name: self.update_record(r, t, table_widget))
+        # Prompt the user for updated values
+        inputs = {}
+        for col_name, col_value in zip(columns, row_data):
+            if col_name not in model.table_columns:
+                continue  # joined in from another table for display
+            if table_name == "appointments" and col_name in scheduling.DERIVED_COLUMNS:
+                continue  # worked out from date, time and service, or set when booked
+            new_value, ok = QInputDialog.getText(self, f"Update {col_name}", f"Enter new value for {col_name}:", text=col_value) 
+            if ok:
+                inputs[col_name] = new_value
+            else:
+                return  # Exit if user cancels
 
-                delete_button  = QPushButton("Delete")
-                delete_button.setObjectName("delete-button")
-                delete_button.setFixedWidth(100)
-                delete_button.clicked.connect(lambda _, r=row_idx, t=table_name: self.delete_record(r, t, table_widget))
+        def on_updated(_):
+            self.changes.check()  # Patches just the changed row into the views
+            self.show_message("success", "Success", "Record updated successfully!")
 
-                button_widget = QWidget()
-                button_layout.addWidget(update_button)
-                button_layout.addWidget(delete_button)
-                button_layout.setAlignment(Qt.AlignCenter)
-                button_widget.setLayout(button_layout)
+        # Appointments are checked for clashes again before they are moved
+        self.db.submit(
+            self.repo_job(lambda repos: repos.table(table_name).update(record[0], **inputs)),
+            on_updated,
+            lambda e: self.show_message("error", "Error", f"Failed to update record: {str(e)}")
+        )
+    
+    def delete_record(self, row_idx, table_name, table_view):
+        model = table_view.model()
 
-                table_widget.setCellWidget(row_idx, len(column_names), button_widget)
-            
-            table_widget.setAlternatingRowColors(True)
-            table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-            table_widget.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
-            table_widget.setStyleSheet("""
-                QTableWidget {
-                    background-color: #F8FAFC; /* Even rows */
-                    alternate-background-color: #E2E8F0; /* Odd rows */
-                    gridline-color: #CBD5E0;
-                }
-                QHeaderView::section {
-                    background-color: #133E87;
-                    font-size: 20px;
-                    color: white;
-                    padding: 4px;
-                    border: none;
-                    text-transform: uppercase;
-                    font-weight: 500;
-                }
-                QPushButton#update-button{
-                    font-size: 20px;
-                    padding: 8px;
-                    border: none;
-                    border-radius: 8px;
-                    background-color: #133E87;   
-                    color: #F8FAFC;
-                }
-                QPushButton#delete-button{
-                    font-size: 20px;
-                    padding: 8px;
-                    border: none;
-                    border-radius: 8px;
-                    background-color: red;   
-                    color: #F8FAFC;
-                }
-            """)                       
-            # self.show_message("success", "Success", f"Loaded {table_name} table successfully!")
-        except sqlite3.Error as e:
-            self.show_message("error", "Error", f"Failed to load table: {str(e)}")
-
-    def update_record(self, row_idx, table_name, table_widget):
-        try:
-            # Get the column names from a pragma query
-            self.cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = [info[1] for info in self.cursor.fetchall()]
-
-            # Get the row data
-            row_data = [table_widget.item(row_idx, col_idx).text() for col_idx in range(len(columns))]
-
-            # Prompt the user for updated values
-            inputs = {}
-            for col_name, col_value in zip(columns, row_data):
-                new_value, ok = QInputDialog.getText(self, f"Update {col_name}", f"Enter new value for {col_name}:", text=col_value) 
-                if ok:
-                    inputs[col_name] = new_value
+        # Get the primary key value for the row
+        record = model.row_data(row_idx)
+        if record is None:
+            return
+        primary_value = record[0]
+
+        # Confirm deletion
+        reply = QMessageBox.question(
+            self, "Delete Record",
+            f"Are you sure you want to delete this record?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply == QMessageBox.Yes:
+            def on_deleted(count):
+                self.changes.check()  # Also catches rows removed by ON DELETE CASCADE
+                if count:
+                    self.show_message("success", "Success", "Record deleted successfully!")
                 else:
-                    return  # Exit if user cancels
+                    self.show_message("warning", "Delete Record", "Nothing was deleted, the record is archived or already gone.")
 
-            # Build the update query
-            primary_key = columns[0]
-            primary_value = row_data[0]
-            update_query = f"UPDATE {table_name} SET {', '.join([f'{key} = ?' for key in inputs.keys()])} WHERE {primary_key} = ?" #constructs column name = ?
+            # Delete the record
+            self.db.submit(
+                self.repo_job(lambda repos: repos.table(table_name).delete(primary_value)),
+                on_deleted,
+                lambda e: self.show_message("error", "Error", f"Failed to delete record: {str(e)}")
+            )
 
-            self.cursor.execute(update_query, list(inputs.values()) + [primary_value])
-            self.conn.commit()
+    # Ids of the selected rows, all of them are on the current page
+    def selected_ids(self, table_view):
+        model = table_view.model()
+        return model.row_ids(index.row() for index in table_view.selectionModel().selectedRows())
 
-            self.show_message("success", "Success", "Record updated successfully!")
-            self.populate_table(table_widget, table_name)  # Refresh the table
+    def update_selected_records(self, table_name, table_view):
+        model = table_view.model()
+        record_ids = self.selected_ids(table_view)
+        if not record_ids:
+            return
+        columns = [
+            column for column in model.table_columns
+            if column != "id" and not (table_name == "appointments" and column in scheduling.DERIVED_COLUMNS)
+        ]
+        column, ok = QInputDialog.getItem(self, "Update Selected", f"Field to change on {len(record_ids)} records:", columns, 0, False)
+        if not ok:
+            return
+        value, ok = QInputDialog.getText(self, "Update Selected", f"New value for {column}:")
+        if not ok:
+            return
+        reply = QMessageBox.question(
+            self, "Update Records",
+            f"Set {column} to {value!r} on {len(record_ids)} records?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
 
-        except sqlite3.Error as e:
-            self.show_message("error", "Error", f"Failed to update record: {str(e)}")
-    
-    def delete_record(self, row_idx, table_name, table_widget):
+        def on_updated(count):
+            self.changes.check()  # one refresh for the whole batch
+            self.show_message("success", "Success", f"{count} records updated successfully!")
+
+        # All or nothing: a bad value or an appointment clash rolls back the batch
+        self.db.submit(
+            self.repo_job(lambda repos: repos.table(table_name).update_many([(record_id, {column: value}) for record_id in record_ids])),
+            on_updated,
+            lambda e: self.show_message("error", "Error", f"Failed to update records: {str(e)}")
+        )
+
+    def delete_selected_records(self, table_name, table_view):
+        record_ids = self.selected_ids(table_view)
+        if not record_ids:
+            return
+        reply = QMessageBox.question(
+            self, "Delete Records",
+            f"Are you sure you want to delete {len(record_ids)} records?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+
+        def on_deleted(count):
+            self.changes.check()  # one refresh, cascaded deletes included
+            self.show_message("success", "Success", f"{count} records deleted successfully!")
+
+        self.db.submit(
+            self.repo_job(lambda repos: repos.table(table_name).delete_many(record_ids)),
+            on_deleted,
+            lambda e: self.show_message("error", "Error", f"Failed to delete records: {str(e)}")
+        )
+
+    ##### ARCHIVE #########
+    # Old appointments move to an attached archive database (archive.py);
+    # the appointments page shows them again on request
+    def add_archive_controls(self, layout, model):
+        include_archive = QCheckBox("Include archive")
+        include_archive.toggled.connect(lambda checked: self.show_archived(model, include_archive, checked))
+        archive_button = QPushButton("Archive Old...")
+        archive_button.clicked.connect(self.archive_old_appointments)
+        if self.db_profile and self.db_profile.get("server"):
+            for widget in (include_archive, archive_button):
+                widget.setEnabled(False)
+                widget.setToolTip("The archive is on the clinic server, run archive.py on that machine")
+        layout.addWidget(include_archive)
+        layout.addWidget(archive_button)
+
+    def show_archived(self, model, checkbox, include):
+        if not include:
+            model.set_source()
+            return
+        path = self.archive_settings["path"]
+
+        def on_failed(error):
+            checkbox.setChecked(False)
+            self.show_message("error", "Error", f"Failed to open the archive: {str(error)}")
+
+        # Attached once to the worker's connection, it stays for later reads
+        self.db.submit(
+            lambda conn: archive.attach(conn, path),
+            lambda _: model.set_source(archive.ALL_VIEW, archive.ALL_TABLE),
+            on_failed
+        )
+
+    def archive_old_appointments(self):
+        days, ok = QInputDialog.getInt(
+            self, "Archive Appointments", "Archive appointments older than (days):",
+            self.archive_settings["older_than_days"], 1, 36500
+        )
+        if not ok:
+            return
+        path = self.archive_settings["path"]
+        before = archive.cutoff(days)
+        reply = QMessageBox.question(
+            self, "Archive Appointments",
+            f"Move all appointments dated before {before} to {path}?\n"
+            "They still show with 'Include archive' and in the reports.",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+
+        progress_dialog = QProgressDialog("Archiving appointments...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Archive Appointments")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress = JobProgress(progress_dialog)
+        progress.changed.connect(lambda stats: progress_dialog.setLabelText(
+            f"Archiving appointments...\n{stats['archived']} of {stats['total']} moved"
+        ))
+        # Checked between batches, the ones moved so far stay archived
+        cancelled = threading.Event()
+        progress_dialog.canceled.connect(cancelled.set)
+
+        def on_archived(stats):
+            progress_dialog.close()
+            message = f"{stats['archived']} appointments dated before {before} archived in {stats['seconds']:.1f}s."
+            if stats["cancelled"]:
+                message = "Archiving cancelled. " + message
+            self.show_message("warning" if stats["cancelled"] else "success", "Archive Appointments", message)
+            self.changes.check()
+
+        def on_failed(error):
+            progress_dialog.close()
+            self.show_message("error", "Error", f"Archiving failed: {str(error)}")
+            self.changes.check()    # batches before the failure did move
+
+        self.run_long_job(
+            lambda conn: archive.archive_appointments(conn, path, before, progress=progress.report, should_stop=cancelled.is_set),
+            on_archived,
+            on_failed
+        )
+        progress_dialog.show()
+
+    ##### SEARCH #########
+    def create_search_page(self):
+        page = QWidget()
+        page.setObjectName("tool-page")
+        layout = QVBoxLayout(page)
+
+        self.search_header = QLabel("Search")
+        self.search_header.setObjectName("page-header")
+
+        # At most search.RESULT_LIMIT rows, so a plain QTableWidget is fine here
+        self.search_results = QTableWidget(0, 4)
+        self.search_results.setHorizontalHeaderLabels(["Type", "ID", "Name", "Details"])
+        self.search_results.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.search_results.setAlternatingRowColors(True)
+        self.search_results.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.search_results.horizontalHeader().setStretchLastSection(True)
+
+        layout.addWidget(self.search_header)
+        layout.addWidget(self.search_results)
+        return page
+
+    def run_search(self, text):
+        text = text.strip()
+        if not text:
+            return
+        # Only the newest search gets to fill the results
+        self.search_number += 1
+        search_number = self.search_number
+
+        def on_results(results):
+            if search_number != self.search_number:
+                return
+            self.show_page("search")
+            self.search_header.setText(f"{len(results)} results for \"{text}\"")
+            self.search_results.setRowCount(len(results))
+            for row_idx, (kind, record_id, name, details, _) in enumerate(results):
+                for col_idx, value in enumerate((kind.title(), record_id, name, details)):
+                    self.search_results.setItem(row_idx, col_idx, QTableWidgetItem(str(value)))
+
+        self.db.submit(
+            lambda conn: self.db.cache.get(("search", text), ("owners", "pets"), lambda: search.search(conn, text)),
+            on_results,
+            lambda e: self.show_message("error", "Error", f"Search failed: {str(e)}")
+        )
+
+    ##### AVAILABILITY #########
+    def create_availability_page(self):
+        page = QWidget()
+        page.setObjectName("tool-page")
+        layout = QVBoxLayout(page)
+
+        header = QLabel("Free Slots")
+        header.setObjectName("page-header")
+
+        controls = QHBoxLayout()
+        self.availability_date = QDateEdit(QDate.currentDate())
+        self.availability_date.setCalendarPopup(True)
+        self.availability_date.setDisplayFormat("yyyy-MM-dd")
+        self.availability_range = QComboBox()
+        self.availability_range.addItems(["Day", "Week"])
+        self.availability_service = QLineEdit()
+        self.availability_service.setPlaceholderText(f"Service ID (default {scheduling.DEFAULT_DURATION} minutes)")
+        self.availability_pet = QLineEdit()
+        self.availability_pet.setPlaceholderText("Pet ID (optional)")
+        show_button = QPushButton("Show Free Slots")
+        show_button.clicked.connect(self.show_free_slots)
+        for widget in (self.availability_date, self.availability_range, self.availability_service, self.availability_pet, show_button):
+            controls.addWidget(widget)
+
+        # Double click a slot to book it
+        self.availability_slots = QListWidget()
+        self.availability_slots.itemDoubleClicked.connect(self.book_free_slot)
+
+        layout.addWidget(header)
+        layout.addLayout(controls)
+        layout.addWidget(self.availability_slots)
+        return page
+
+    def show_free_slots(self):
+        day = self.availability_date.date().toPyDate()
+        days = 7 if self.availability_range.currentText() == "Week" else 1
+        service_id = self.availability_service.text().strip()
+        pet_id = self.availability_pet.text().strip()
         try:
-            # Get the primary key column
-            self.cursor.execute(f"PRAGMA table_info({table_name})")
-            primary_key = self.cursor.fetchone()[1]  # First column is assumed to be the primary key
-
-            # Get the primary key value for the row
-            primary_value = table_widget.item(row_idx, 0).text()
-
-            # Confirm deletion
-            reply = QMessageBox.question(
-                self, "Delete Record",
-                f"Are you sure you want to delete this record?",
-                QMessageBox.Yes | QMessageBox.No
+            service_id = int(service_id) if service_id else None
+            pet_id = int(pet_id) if pet_id else None
+        except ValueError:
+            self.show_message("warning", "Warning", "Service and pet IDs must be numbers")
+            return
+
+        # Slots of today that have gone by drop out, so the time is part of the key
+        now = datetime.now()
+        started = scheduling.to_minutes(now) // scheduling.SLOT_MINUTES if day <= now.date() else None
+
+        def free_slots(conn):
+            duration = scheduling.service_duration(conn, service_id) if service_id else scheduling.DEFAULT_DURATION
+            return scheduling.free_slots(conn, day, days, duration, pet_id, service_id, now, self.scheduling_settings)
+
+        key = ("free_slots", day, days, service_id, pet_id, started)
+        job = lambda conn: self.db.cache.get(key, ("appointments", "services"), lambda: free_slots(conn))
+
+        def on_slots(slots):
+            self.availability_slots.clear()
+            for start, end in slots:
+                item = QListWidgetItem(f"{start:%a %Y-%m-%d}   {start:%H:%M} - {end:%H:%M}")
+                item.setData(Qt.UserRole, start)
+                self.availability_slots.addItem(item)
+            if not slots:
+                self.availability_slots.addItem("No free slots")
+
+        self.db.submit(job, on_slots, lambda e: self.show_message("error", "Error", f"Failed to load free slots: {str(e)}"))
+
+    # Fill the appointment form with the chosen slot
+    def book_free_slot(self, item):
+        start = item.data(Qt.UserRole)
+        if start is None:
+            return
+        inputs = self.page("create_appointment").inputs
+        inputs["date"].setText(f"{start:%Y-%m-%d}")
+        inputs["time"].setText(f"{start:%H:%M}")
+        if self.availability_pet.text().strip():
+            inputs["pet_id"].setText(self.availability_pet.text().strip())
+        if self.availability_service.text().strip():
+            inputs["service_id"].setText(self.availability_service.text().strip())
+        self.show_page("create_appointment")
+
+    ##### REPORTS #########
+    def create_reports_page(self):
+        page = QWidget()
+        page.setObjectName("tool-page")
+        layout = QVBoxLayout(page)
+
+        header = QLabel("Reports")
+        header.setObjectName("page-header")
+
+        # A range of whole months, the last 12 to start with
+        first_month, last_month = reports.recent_months(12)
+        controls = QHBoxLayout()
+        self.report_from = QDateEdit(QDate.fromString(first_month, "yyyy-MM"))
+        self.report_to = QDateEdit(QDate.fromString(last_month, "yyyy-MM"))
+        self.report_all_time = QCheckBox("All time")
+        self.report_all_time.toggled.connect(lambda checked: (
+            self.report_from.setEnabled(not checked), self.report_to.setEnabled(not checked), self.refresh_reports()
+        ))
+        for date_edit in (self.report_from, self.report_to):
+            date_edit.setDisplayFormat("yyyy-MM")
+            date_edit.setCalendarPopup(True)
+            date_edit.dateChanged.connect(self.refresh_reports)
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh_reports)
+        for label, widget in (("From", self.report_from), ("To", self.report_to), (None, self.report_all_time), (None, refresh_button)):
+            if label:
+                controls.addWidget(QLabel(label))
+            controls.addWidget(widget)
+        controls.addStretch()
+
+        self.report_totals = QLabel()
+
+        self.report_tables = {}
+        tabs = QTabWidget()
+        for key, title, columns in (
+            ("months", "Revenue by Month", ["Month", "Visits", "Revenue"]),
+            ("services", "Revenue by Service", ["Month", "Service", "Visits", "Revenue"]),
+            ("species", "Visits by Species", ["Species", "Visits", "Share"]),
+            ("busiest_days", "Busiest Days", ["Date", "Day", "Visits"]),
+            ("weekdays", "Weekdays", ["Day", "Visits", "Days Open", "Visits per Day"]),
+        ):
+            table = QTableWidget(0, len(columns))
+            table.setHorizontalHeaderLabels(columns)
+            table.setEditTriggers(QTableWidget.NoEditTriggers)
+            table.setAlternatingRowColors(True)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+            self.report_tables[key] = table
+            tabs.addTab(table, title)
+
+        layout.addWidget(header)
+        layout.addLayout(controls)
+        layout.addWidget(self.report_totals)
+        layout.addWidget(tabs)
+        return page
+
+    def refresh_reports(self):
+        if self.report_all_time.isChecked():
+            first_month = last_month = None
+        else:
+            first_month = self.report_from.date().toString("yyyy-MM")
+            last_month = self.report_to.date().toString("yyyy-MM")
+
+        def fill(table_key, rows):
+            table = self.report_tables[table_key]
+            table.setRowCount(len(rows))
+            for row_idx, row in enumerate(rows):
+                for col_idx, value in enumerate(row):
+                    table.setItem(row_idx, col_idx, QTableWidgetItem(value if isinstance(value, str) else f"{value:,}"))
+
+        def on_report(report):
+            self.report_totals.setText(f"{report['visits']:,} visits, {report['revenue']:,.2f} revenue")
+            fill("months", [(month, visits, f"{revenue:,.2f}") for month, visits, revenue in report["months"]])
+            fill("services", [(month, service, visits, f"{revenue:,.2f}") for month, service, visits, revenue in report["services"]])
+            fill("species", [
+                (species, visits, f"{visits / report['visits']:.1%}") for species, visits in report["species"]
+            ])
+            fill("busiest_days", [
+                (date, QDate.fromString(date, "yyyy-MM-dd").toString("dddd"), visits) for date, visits in report["busiest_days"]
+            ])
+            fill("weekdays", [
+                (day, visits, days, f"{visits / days:.1f}" if days else "-") for day, visits, days in report["weekdays"]
+            ])
+
+        key = ("reports", first_month, last_month)
+        self.db.submit(
+            lambda conn: self.db.cache.get(key, reports.SOURCE_TABLES, lambda: reports.summary(conn, first_month, last_month)),
+            on_report,
+            lambda e: self.show_message("error", "Error", f"Failed to load reports: {str(e)}")
+        )
+
+    ##### DIAGNOSTICS #########
+    def create_diagnostics_page(self):
+        page = QWidget()
+        page.setObjectName("diagnostics-page")
+        layout = QVBoxLayout(page)
+
+        header = QLabel("Diagnostics")
+        header.setObjectName("page-header")
+        self.diagnostics_info = QLabel()
+        self.diagnostics_info.setWordWrap(True)
+
+        controls = QHBoxLayout()
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh_diagnostics)
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(lambda: (self.profiler.reset(), self.refresh_diagnostics()))
+        for button in (refresh_button, reset_button):
+            button.setEnabled(self.profiler is not None)
+            controls.addWidget(button)
+        controls.addStretch()
+
+        # Slowest in total first, with a latency histogram per statement
+        self.diagnostics_statements = QTableWidget(0, 9)
+        self.diagnostics_statements.setHorizontalHeaderLabels(
+            ["Statement", "Count", "Total ms", "Mean ms", "p50 ms", "p95 ms", "Max ms", "Steps", "Latency"]
+        )
+        self.diagnostics_statements.horizontalHeaderItem(7).setToolTip("Statements sqlite ran, trigger bodies included")
+        self.diagnostics_statements.horizontalHeaderItem(8).setToolTip(
+            "Runs per bucket, up to " + ", ".join(f"{bound:g}" for bound in profiling.BUCKETS_MS[:-1]) + " ms and over"
+        )
+        self.diagnostics_slow = QTableWidget(0, 3)
+        self.diagnostics_slow.setHorizontalHeaderLabels(["Time", "ms", "Slow statement"])
+        for table in (self.diagnostics_statements, self.diagnostics_slow):
+            table.setEditTriggers(QTableWidget.NoEditTriggers)
+            table.setSelectionBehavior(QTableWidget.SelectRows)
+            table.setAlternatingRowColors(True)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.diagnostics_statements.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.diagnostics_slow.horizontalHeader().setStretchLastSection(True)
+
+        # Query plan of the selected slow statement
+        self.slow_statements = []
+        self.diagnostics_plan = QPlainTextEdit()
+        self.diagnostics_plan.setReadOnly(True)
+        self.diagnostics_slow.currentCellChanged.connect(lambda row, *_: self.show_slow_statement(row))
+
+        layout.addWidget(header)
+        layout.addWidget(self.diagnostics_info)
+        layout.addLayout(controls)
+        layout.addWidget(self.diagnostics_statements, 3)
+        layout.addWidget(self.diagnostics_slow, 2)
+        layout.addWidget(self.diagnostics_plan, 1)
+        return page
+
+    def refresh_diagnostics(self):
+        if self.profiler is None:
+            self.diagnostics_info.setText(
+                "Query profiling is off. Start the app with --profile-queries to time every statement "
+                "and log the slow ones."
+            )
+            return
+        statements = self.profiler.statements()
+        self.slow_statements = self.profiler.slow_statements()
+        log = f", logged to {self.profiler.log_path}" if self.profiler.log_path else ""
+        self.diagnostics_info.setText(
+            f"{sum(stats['count'] for stats in statements)} statements run, {len(self.slow_statements)} "
+            f"slow ones (over {self.profiler.slow_ms:g} ms{log})."
+        )
+        self.diagnostics_statements.setRowCount(len(statements))
+        for row_idx, stats in enumerate(statements):
+            peak = max(stats["histogram"]) or 1
+            bars = "".join(
+                HISTOGRAM_BARS[-(-count * (len(HISTOGRAM_BARS) - 1) // peak)] for count in stats["histogram"]
             )
-            if reply == QMessageBox.Yes:
-                # Delete the record
-                self.cursor.execute(f"DELETE FROM {table_name} WHERE {primary_key} = ?", (primary_value,))
-                self.conn.commit()
+            values = (
+                stats["sql"], stats["count"], f"{stats['total_ms']:.1f}", f"{stats['mean_ms']:.2f}",
+                f"{stats['p50_ms']:g}", f"{stats['p95_ms']:g}", f"{stats['max_ms']:.1f}", stats["steps"], bars,
+            )
+            for col_idx, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if col_idx == 0:
+                    item.setToolTip(stats["sql"])
+                self.diagnostics_statements.setItem(row_idx, col_idx, item)
+
+        self.diagnostics_slow.setRowCount(len(self.slow_statements))
+        for row_idx, entry in enumerate(self.slow_statements):
+            for col_idx, value in enumerate((entry["time"], f"{entry['ms']:.1f}", entry["sql"])):
+                self.diagnostics_slow.setItem(row_idx, col_idx, QTableWidgetItem(value))
+        self.show_slow_statement(self.diagnostics_slow.currentRow())
+
+    def show_slow_statement(self, row):
+        if not 0 <= row < len(self.slow_statements):
+            self.diagnostics_plan.clear()
+            return
+        entry = self.slow_statements[row]
+        self.diagnostics_plan.setPlainText(
+            entry["sql"] + "\n\n" + ("\n".join(entry["plan"]) or "(no query plan for this statement)")
+        )
+
+    ##### IMPORT / EXPORT #########
+    def import_data(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Records", "", "Data files (*.csv *.jsonl *.ndjson)")
+        if not path:
+            return
+        table_name, ok = QInputDialog.getItem(self, "Import Records", "Import into table:", importer.IMPORT_ORDER, 0, False)
+        if not ok:
+            return
+
+        progress_dialog = QProgressDialog(f"Importing {table_name}...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Import Records")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress = JobProgress(progress_dialog)
+        progress.changed.connect(lambda stats: progress_dialog.setLabelText(
+            f"Importing {table_name}...\n{stats['read']} read, {stats['imported']} imported, {stats['rejected']} rejected"
+        ))
+        # Checked by the importer between batches
+        cancelled = threading.Event()
+        progress_dialog.canceled.connect(cancelled.set)
+
+        def on_imported(stats):
+            progress_dialog.close()
+            message = f"{stats['imported']} of {stats['read']} {table_name} records imported."
+            if stats["cancelled"]:
+                message = "Import cancelled. " + message
+            if stats["rejected"]:
+                message += f"\n{stats['rejected']} rejected records were written to {path}.rejected.jsonl"
+            self.show_message("warning" if stats["rejected"] or stats["cancelled"] else "success", "Import Records", message)
+            self.changes.check()
+
+        def on_failed(error):
+            progress_dialog.close()
+            self.show_message("error", "Error", f"Import failed: {str(error)}")
+
+        self.run_long_job(
+            lambda conn: importer.import_file(conn, table_name, path, progress=progress.report, should_stop=cancelled.is_set),
+            on_imported,
+            on_failed
+        )
+        progress_dialog.show()
 
-                self.show_message("success", "Success", "Record deleted successfully!")
-                self.populate_table(table_widget, table_name)  # Refresh the table
+    def export_data(self):
+        custom_query = "Custom query..."
+        source, ok = QInputDialog.getItem(self, "Export Data", "Export:", list(exporter.EXPORT_TABLES) + [custom_query], 0, False)
+        if not ok:
+            return
+        if source == custom_query:
+            sql, ok = QInputDialog.getMultiLineText(self, "Export Data", "SELECT query to export:")
+            if not ok or not sql.strip():
+                return
+        else:
+            sql = f"SELECT * FROM {source} ORDER BY id"
+
+        filters = {"CSV (*.csv)": "csv", "JSON Lines (*.jsonl)": "jsonl", "Columnar (*.pcol)": "columnar"}
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Export Data", "", ";;".join(filters))
+        if not path:
+            return
+        fmt = exporter.format_for_path(path) or filters.get(selected_filter, "csv")
 
-        except sqlite3.Error as e:
-            self.show_message("error", "Error", f"Failed to delete record: {str(e)}")
+        progress_dialog = QProgressDialog("Exporting...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Export Data")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress = JobProgress(progress_dialog)
+        progress.changed.connect(lambda stats: progress_dialog.setLabelText(f"Exporting...\n{stats['rows']} rows written"))
+        cancelled = threading.Event()
+        progress_dialog.canceled.connect(cancelled.set)
+
+        def on_exported(stats):
+            progress_dialog.close()
+            if stats["cancelled"]:
+                self.show_message("warning", "Export Data", "Export cancelled, no file was written.")
+            else:
+                self.show_message("success", "Export Data", f"{stats['rows']} rows exported to {path}")
+
+        def on_failed(error):
+            progress_dialog.close()
+            self.show_message("error", "Error", f"Export failed: {str(error)}")
+
+        self.run_long_job(
+            lambda conn: exporter.export_query(conn, sql, path, fmt, progress=progress.report, should_stop=cancelled.is_set),
+            on_exported,
+            on_failed
+        )
+        progress_dialog.show()
+
+    ##### BACKUPS #########
+    # Snapshots are taken on a worker of their own, a few pages at a time, so
+    # the app stays usable meanwhile; progress shows in the status bar
+    def init_backups(self):
+        self.backup_running = False
+        self.backup_cancelled = threading.Event()
+        self.backup_name = backup.stem((self.db_profile or database.DEFAULT_PROFILE)["path"])
+        self.backup_label = QLabel()
+        self.statusBar().addPermanentWidget(self.backup_label)
+        self.backup_timer = QTimer(self)
+        self.backup_timer.setSingleShot(True)
+        self.backup_timer.timeout.connect(self.run_scheduled_backup)
+        # A server's database is backed up on the server's machine (backup.py)
+        if self.db_profile and self.db_profile.get("server"):
+            self.backup_label.hide()
+            return
+        self.update_backup_label()
+        self.schedule_backup()
+
+    def update_backup_label(self):
+        last = backup.last_backup(self.backup_settings["dir"], self.backup_name)
+        self.backup_label.setText(f"Last backup: {last:%Y-%m-%d %H:%M}" if last else "No backups yet")
+        self.backup_label.setToolTip(os.path.abspath(self.backup_settings["dir"]))
+
+    def schedule_backup(self, delay=None):
+        every = self.backup_settings["every_hours"] * 3600
+        if not every:
+            return
+        if delay is None:
+            last = backup.last_backup(self.backup_settings["dir"], self.backup_name)
+            due = every - (datetime.now() - last).total_seconds() if last else 0
+            delay = max(due, BACKUP_STARTUP_DELAY)
+        # Long waits are checked again on the way, QTimer can't count that far
+        self.backup_timer.start(int(min(delay, BACKUP_RETRY) * 1000))
+
+    def run_scheduled_backup(self):
+        last = backup.last_backup(self.backup_settings["dir"], self.backup_name)
+        if last and (datetime.now() - last).total_seconds() < self.backup_settings["every_hours"] * 3600:
+            self.schedule_backup()
+        else:
+            self.run_backup(scheduled=True)
+
+    def run_backup(self, scheduled=False):
+        if self.db_profile and self.db_profile.get("server"):
+            self.show_message("warning", "Back Up", "The database is on the clinic server, run backup.py on that machine to back it up.")
+            return
+        if self.backup_running:
+            if not scheduled:
+                self.show_message("warning", "Back Up", "A backup is already running.")
+            return
+        self.backup_running = True
+        self.backup_cancelled.clear()
+        progress = JobProgress(self)
+        progress.changed.connect(lambda stats: self.backup_label.setText(
+            f"Backing up... {stats['done'] / max(stats['pages'], 1):.0%}"
+        ))
+
+        def on_done(stats):
+            self.backup_running = False
+            self.update_backup_label()
+            if stats["cancelled"]:
+                return
+            self.schedule_backup()
+            if not scheduled:
+                message = f"Database backed up to {stats['path']} in {stats['seconds']:.1f}s and checked."
+                if stats["removed"]:
+                    message += f"\n{len(stats['removed'])} older backups were removed."
+                self.show_message("success", "Back Up", message)
+
+        def on_failed(error):
+            self.backup_running = False
+            self.update_backup_label()
+            self.backup_label.setText("Backup failed")
+            self.schedule_backup(BACKUP_RETRY)
+            self.show_message("error", "Error", f"Backup failed: {str(error)}")
+
+        settings = self.backup_settings
+        self.run_long_job(
+            lambda conn: backup.backup(conn, settings["dir"], settings["keep"], progress=progress.report,
+                                       should_stop=self.backup_cancelled.is_set),
+            on_done,
+            on_failed
+        )
+        self.backup_label.setText("Backing up...")
+
+    ##### REMINDERS #########
+    # Upcoming appointments are read once into the scheduler's queue, which
+    # change notifications keep up to date; the scheduler only runs in jobs on
+    # the worker, and a timer wakes it when the next reminder is due
+    def init_reminders(self):
+        self.reminders = None
+        self.reminder_timer = QTimer(self)
+        self.reminder_timer.setSingleShot(True)
+        self.reminder_timer.timeout.connect(lambda: self.submit_reminders(self.reminders.run))
+        # With a server, reminders.py runs next to it on the server's machine
+        if not self.reminder_settings["lead_hours"] or (self.db_profile and self.db_profile.get("server")):
+            return
+        backend = reminders.LocalBackend(self.reminder_settings["delivery_file"])
+        self.reminders = reminders.ReminderScheduler(backend, self.reminder_settings["lead_hours"])
+        # Queued after the migrations, like every job
+        self.submit_reminders(self.reminders.start)
+
+    def submit_reminders(self, job):
+        self.db.submit(job, self.on_reminders_run, self.on_reminders_failed, background=True)
+
+    def on_reminders_run(self, stats):
+        delay = (stats["wake_at"] - reminders.now()) * 60
+        self.reminder_timer.start(int(max(1, min(delay, REMINDER_MAX_WAIT)) * 1000))
+        if stats["sent"]:
+            self.statusBar().showMessage(f"{stats['sent']} appointment reminders sent", 10000)
+        if stats["failed"]:
+            self.statusBar().showMessage(f"{stats['failed']} appointment reminders could not be sent", 10000)
+
+    def on_reminders_failed(self, error):
+        self.statusBar().showMessage(f"Reminders: {str(error)}", 10000)
+        self.reminder_timer.start(REMINDER_MAX_WAIT * 1000)
 
     def create_navigation_menu(self):
         self.nav_menu = self.addToolBar("Navigation Menu")
+        self.nav_menu.setObjectName("nav-menu")
         
         create_pet_action = QAction("Create Pet", self)
         create_owner_action = QAction("Create Owner", self)
         create_appointment_action = QAction("Schedule Appointment", self)
         create_service_action = QAction("Add Service", self)
         
-        create_pet_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.create_pet_page))
-        create_owner_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.create_owner_page))
-        create_appointment_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.create_appointment_page))
-        create_service_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.create_service_page))
+        create_pet_action.triggered.connect(lambda: self.show_page("create_pet"))
+        create_owner_action.triggered.connect(lambda: self.show_page("create_owner"))
+        create_appointment_action.triggered.connect(lambda: self.show_page("create_appointment"))
+        create_service_action.triggered.connect(lambda: self.show_page("create_service"))
+        free_slots_action = QAction("Free Slots", self)
+        free_slots_action.triggered.connect(lambda: self.show_page("availability"))
 
         view_pet_action = QAction("View Pets", self)
         view_owner_action = QAction("View Owners", self)
         view_appointment_action = QAction("View Appointments", self)
         view_service_action = QAction("View Services", self)
 
-        view_pet_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.view_pets_page))
-        view_owner_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.view_owners_page))
-        view_appointment_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.view_appointments_page))
-        view_service_action.triggered.connect(lambda: self.stacked_widget.setCurrentWidget(self.view_services_page))
+        view_pet_action.triggered.connect(lambda: self.show_page("view_pets"))
+        view_owner_action.triggered.connect(lambda: self.show_page("view_owners"))
+        view_appointment_action.triggered.connect(lambda: self.show_page("view_appointments"))
+        view_service_action.triggered.connect(lambda: self.show_page("view_services"))
         
         self.nav_menu.addAction(create_pet_action)
         self.nav_menu.addAction(create_owner_action)
         self.nav_menu.addAction(create_appointment_action)
         self.nav_menu.addAction(create_service_action)
+        self.nav_menu.addAction(free_slots_action)
         self.nav_menu.addSeparator()
         self.nav_menu.addAction(view_pet_action)
         self.nav_menu.addAction(view_owner_action)
         self.nav_menu.addAction(view_appointment_action)
         self.nav_menu.addAction(view_service_action)
-        
-        self.nav_menu.setStyleSheet("""
-            QToolBar{
-                background-color: #F8FAFC;
-                margin: 0;
-            }
-            QToolButton{
-                background-color: transparent;
-                border: none;
-                padding: 8px 10px;
-                font-size: 20px;
-                border-radius: 8px;
-            }
-            QToolButton:hover{
-                background-color: #CBDCEB;
-            }
-        """)
+
+        # Search as you type, once typing pauses
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search owners and pets...")
+        self.search_input.setFixedWidth(300)
+        self.search_input.setObjectName("search-input")
+        search_timer = QTimer(self)
+        search_timer.setSingleShot(True)
+        search_timer.setInterval(200)
+        search_timer.timeout.connect(lambda: self.run_search(self.search_input.text()))
+        self.search_input.textChanged.connect(search_timer.start)
+        self.search_input.returnPressed.connect(lambda: self.run_search(self.search_input.text()))
+
+        import_action = QAction("Import Data", self)
+        import_action.triggered.connect(self.import_data)
+        export_action = QAction("Export Data", self)
+        export_action.triggered.connect(self.export_data)
+        self.nav_menu.addSeparator()
+        self.nav_menu.addAction(import_action)
+        self.nav_menu.addAction(export_action)
+        backup_action = QAction("Back Up Now", self)
+        backup_action.triggered.connect(lambda: self.run_backup())
+        self.nav_menu.addAction(backup_action)
+        reports_action = QAction("Reports", self)
+        reports_action.triggered.connect(lambda: self.show_page("reports"))
+        self.nav_menu.addAction(reports_action)
+        diagnostics_action = QAction("Diagnostics", self)
+        diagnostics_action.triggered.connect(lambda: self.show_page("diagnostics"))
+        self.nav_menu.addAction(diagnostics_action)
+        self.nav_menu.addSeparator()
+        self.nav_menu.addWidget(self.search_input)
+
 
         
+def measure_startup(app, window, page_name):
+    """Print how long startup took as one line of JSON, then quit.
+
+    All times are seconds since pet-clinic.py started running: `imports`
+    (Qt and the app modules loaded), `window` (main window built),
+    `first_paint` (first pass of the event loop), `database_ready`
+    (migrations done) and, for table pages, `first_rows` (first rows on screen).
+    """
+    timings = {"imports": IMPORTED - STARTED, "window": time.perf_counter() - STARTED}
+
+    def mark(name):
+        timings.setdefault(name, time.perf_counter() - STARTED)
+
+    finished = []
+
+    def finish(*_):
+        if finished:
+            return
+        finished.append(True)
+        print(json.dumps({"page": page_name, **{name: round(value, 4) for name, value in timings.items()}}))
+        app.quit()
+
+    def on_database_ready(_):
+        mark("database_ready")
+        if page_name.startswith("view_"):
+            model = window.table_views[page_name[len("view_"):]].model()
+            def on_rows(*_):
+                mark("first_rows")
+                finish()
+
+            if model.rowCount() > 0:
+                on_rows()
+            model.rowsInserted.connect(on_rows)
+            model.page_changed.connect(lambda number, count, total: total == 0 and finish())
+            model.load_failed.connect(finish)
+        else:
+            finish()
+
+    QTimer.singleShot(0, lambda: mark("first_paint"))
+    # Jobs run in order, so this one finishes right after the migrations
+    window.db.submit(lambda conn: None, on_database_ready, finish)
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Pet Clinic System")
+    parser.add_argument("--page", choices=PAGE_NAMES, default="create_owner", help="page to open on startup")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="print startup timings as JSON and exit, e.g. with --page view_appointments")
+    diagnostics = parser.add_argument_group("diagnostics")
+    diagnostics.add_argument("--profile-queries", action="store_true",
+                             help="time every statement, see the Diagnostics page")
+    diagnostics.add_argument("--slow-query-ms", type=float, default=profiling.SLOW_MS,
+                             help=f"log statements slower than this with their query plan (default {profiling.SLOW_MS})")
+    diagnostics.add_argument("--query-log", default=profiling.LOG_PATH,
+                             help=f"rotating slow query log (default {profiling.LOG_PATH})")
+    database.add_profile_arguments(parser)
+    backup.add_arguments(parser)
+    archive.add_arguments(parser)
+    reminders.add_arguments(parser)
+    scheduling.add_arguments(parser)
+    args, qt_args = parser.parse_known_args()
+    try:
+        db_profile = database.profile_from_args(args)
+        backup_settings = backup.settings_from_args(args)
+        archive_settings = archive.settings_from_args(args, db_profile)
+        reminder_settings = reminders.settings_from_args(args)
+        scheduling_settings = scheduling.settings_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    profiler = profiling.QueryProfiler(args.slow_query_ms, args.query_log) if args.profile_queries else None
+    window = MainWindow(db_profile, args.page, profiler, backup_settings, archive_settings, reminder_settings,
+                        scheduling_settings)
     window.show()
+    if args.measure_startup:
+        measure_startup(app, window, args.page)
     sys.exit(app.exec_())
\ No newline at end of file
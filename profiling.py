@@ -0,0 +1,339 @@
+import re
+import time
+import logging
+import sqlite3
+import datetime
+import threading
+import weakref
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+
+LOG_PATH = "pet_clinic_queries.log"
+LOG_MAX_BYTES = 1024 * 1024     # the log rolls over to .1, .2, ... past this
+LOG_BACKUPS = 3
+SLOW_MS = 100                   # statements slower than this get their plan logged
+SLOW_KEPT = 200                 # slow statements kept in memory for the diagnostics page
+
+# Upper bounds (ms) of the latency histogram buckets, the last one is open
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+# Statements EXPLAIN QUERY PLAN works on
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_PLACEHOLDER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+
+
+# One key for every run of the same statement, so "id IN (?, ?, ?)" with
+# any number of ids and differently wrapped SQL count together
+def normalize(sql):
+    return _PLACEHOLDER_LIST.sub("?, ...", _SPACE.sub(" ", sql).strip())
+
+
+def _first_word(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+# EXPLAIN QUERY PLAN rows -> indented lines, like the sqlite3 shell prints them
+def format_plan(rows):
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+    return lines
+
+
+class StatementStats:
+    """Counts and a latency histogram for one normalized statement."""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0        # seconds
+        self.max = 0.0
+        self.steps = 0          # statements sqlite ran for it, trigger bodies included
+        self.histogram = [0] * len(BUCKETS_MS)
+
+    def add(self, seconds, steps):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.steps += steps
+        milliseconds = seconds * 1000
+        for bucket, bound in enumerate(BUCKETS_MS):
+            if milliseconds < bound:
+                self.histogram[bucket] += 1
+                break
+
+    # Upper bound of the bucket holding the given fraction of runs, in ms
+    def percentile(self, fraction):
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.histogram):
+            seen += count
+            if seen >= wanted and count:
+                return min(bound, self.max * 1000)
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "sql": self.sql,
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max * 1000,
+            "steps": self.steps,
+            "histogram": list(self.histogram),
+        }
+
+
+class QueryProfiler:
+    """Per-statement timing of every statement run on the connections it is
+    attached to, with a slow query log.
+
+    Off unless a connection is opened with it (database.connect(profile,
+    profiler)). Times are wall clock from execute() until the last row has
+    been fetched, so a SELECT read row by row counts its fetching too.
+    Statements taking `slow_ms` or longer are written with their bound
+    values and EXPLAIN QUERY PLAN to a rotating log at `log_path` (None for
+    no log) and kept for the diagnostics page.
+    """
+
+    def __init__(self, slow_ms=SLOW_MS, log_path=LOG_PATH):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.started = time.time()
+        self._stats = {}        # normalized sql -> StatementStats
+        self._slow = deque(maxlen=SLOW_KEPT)
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(f"{__name__}.{id(self)}")
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+        if log_path:
+            handler = RotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.log.addHandler(handler)
+
+    # Called by database.connect on a connection made with factory=ProfiledConnection
+    def attach(self, conn):
+        conn.profiler = self
+        conn.set_trace_callback(conn.traced)
+
+    def record(self, conn, sql, parameters, seconds, expanded, steps):
+        key = normalize(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = StatementStats(key)
+            stats.add(seconds, steps)
+        if seconds * 1000 >= self.slow_ms:
+            self._slow_statement(conn, sql, parameters, seconds, expanded)
+
+    def _slow_statement(self, conn, sql, parameters, seconds, expanded):
+        plan = []
+        if _first_word(sql) in EXPLAINABLE and parameters is not None:
+            try:
+                # A plain cursor, so the EXPLAIN isn't profiled itself
+                plan = format_plan(sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall())
+            except sqlite3.Error as e:
+                plan = [f"(no plan: {e})"]
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "ms": seconds * 1000,
+            # Batches and scripts would only show their first statement expanded
+            "sql": expanded if expanded and parameters is not None else _SPACE.sub(" ", sql).strip(),
+            "plan": plan,
+        }
+        with self._lock:
+            self._slow.append(entry)
+        self.log.info("slow %.1f ms: %s%s", entry["ms"], entry["sql"], "".join(f"\n    {line}" for line in plan))
+
+    def statements(self):
+        """Stats of every statement seen, slowest in total first."""
+        with self._lock:
+            stats = [stats.as_dict() for stats in self._stats.values()]
+        return sorted(stats, key=lambda stats: stats["total_ms"], reverse=True)
+
+    def slow_statements(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self.started = time.time()
+
+    # Per-statement totals to the log, e.g. on shutdown
+    def log_summary(self, limit=20):
+        statements = self.statements()
+        if not statements:
+            return
+        self.log.info("summary of %d statements since %s:%s", len(statements),
+                      datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                      "".join(
+                          f"\n    {s['count']:>8} x {s['mean_ms']:8.2f} ms mean {s['p95_ms']:8.2f} ms p95 "
+                          f"{s['max_ms']:8.2f} ms max  {s['sql']}"
+                          for s in statements[:limit]
+                      ))
+
+
+class _Run:
+    """One statement being timed, from execute() until its cursor has read
+    it to the end or is gone."""
+
+    def __init__(self, cursor, sql, parameters):
+        self.cursor = weakref.ref(cursor)
+        self.sql, self.parameters = sql, parameters
+        self.kind = _first_word(sql)
+        self.spent = 0.0
+        self.expanded = None    # the statement with its values, from the trace callback
+        self.steps = 0
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor timing its statement from execute() until it has been read."""
+
+    _run = None
+
+    def _start(self, sql, parameters):
+        self._finish()
+        self._run = self.connection.start_run(self, sql, parameters)
+
+    def _timed(self, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            if self._run is not None:
+                self._run.spent += time.perf_counter() - started
+
+    def _finish(self):
+        if self._run is None:
+            return
+        run, self._run = self._run, None
+        self.connection.finish_run(run)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        try:
+            self._timed(super().execute, sql, parameters)
+        except BaseException:
+            self._finish()
+            raise
+        if self.description is None:
+            self._finish()  # nothing to fetch
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None)   # one entry for the whole batch, not explained
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def executescript(self, script):
+        self._start(script, None)
+        try:
+            self._timed(super().executescript, script)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose statements are timed by its profiler (see
+    QueryProfiler.attach). Statements of the trace callback are counted
+    against the newest one still being read, so trigger bodies show up in
+    its steps.
+
+    A cursor dropped before it was read to the end, e.g. after fetchone(),
+    still counts: its statement is recorded when the connection starts the
+    next one, or closes.
+    """
+
+    profiler = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._runs = []     # statements whose cursors haven't finished them
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def start_run(self, cursor, sql, parameters):
+        for run in [run for run in self._runs if run.cursor() is None]:
+            self.finish_run(run)
+        run = _Run(cursor, sql, parameters)
+        self._runs.append(run)
+        return run
+
+    def finish_run(self, run):
+        if run not in self._runs:
+            return  # counted when the connection closed
+        self._runs.remove(run)
+        if self.profiler is None:
+            return
+        # The EXPLAIN of a slow statement isn't counted against another one
+        runs, self._runs = self._runs, []
+        try:
+            self.profiler.record(self, run.sql, run.parameters, run.spent, run.expanded, run.steps)
+        finally:
+            self._runs = runs
+
+    def close(self):
+        for run in list(self._runs):
+            self.finish_run(run)
+        super().close()
+
+    def traced(self, statement):
+        if not self._runs:
+            return
+        run = self._runs[-1]
+        run.steps += 1
+        # The first statement of the right kind, not an implicit BEGIN before it
+        if run.expanded is None and _first_word(statement) == run.kind:
+            run.expanded = statement
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+
+MAX_CACHED_ROWS = 20000     # rows kept over all cached results before the oldest go
+
+# Writes to a table that change rows of another through ON DELETE/UPDATE CASCADE
+CASCADES = {"owners": ("pets",)}
+
+
+class QueryCache:
+    """LRU cache of read results, invalidated by per-table write generations.
+
+    Every table has a generation number that goes up on each write to it
+    (bump()). A result is stored together with the generations of the
+    tables it was read from, and is only served while all of them are
+    unchanged, so a write to `pets` drops cached pet queries but leaves
+    cached service lists alone.
+
+    Results count towards `max_rows` by their length (1 for anything that
+    isn't a list); the least recently used ones are dropped past that.
+    Lists are handed out as copies, so callers are free to change them.
+    """
+
+    def __init__(self, max_rows=MAX_CACHED_ROWS):
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (generations, result, size)
+        self._generations = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def _stamp(self, tables):
+        return tuple(self._generations.get(table, 0) for table in tables)
+
+    def get(self, key, tables, compute):
+        """Cached result for `key`, or compute() when missing or stale."""
+        with self._lock:
+            stamp = self._stamp(tables)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[1])
+            self.misses += 1
+
+        result = compute()
+        size = len(result) if isinstance(result, list) else 1
+        with self._lock:
+            if size > self.max_rows or stamp != self._stamp(tables):
+                return result   # too big to keep, or written to while computing
+            result, stored = _copy(result), result
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._rows -= old[2]
+            self._entries[key] = (stamp, stored, size)
+            self._rows += size
+            while self._rows > self.max_rows:
+                _, (_, _, dropped) = self._entries.popitem(last=False)
+                self._rows -= dropped
+        return result
+
+    def fetch_all(self, conn, sql, params=(), tables=()):
+        return self.get((sql, tuple(params)), tables, lambda: conn.execute(sql, params).fetchall())
+
+    # Call after committing a write to these tables
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                for changed in (table,) + CASCADES.get(table, ()):
+                    self._generations[changed] = self._generations.get(changed, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "rows": self._rows,
+            }
+
+
+def _copy(result):
+    return list(result) if isinstance(result, list) else result
@@ -0,0 +1,323 @@
+import sys
+import json
+import time
+import heapq
+import sqlite3
+import argparse
+import datetime
+import configparser
+from collections import namedtuple
+
+import database
+import importer
+import scheduling
+
+
+ID_CHUNK_SIZE = importer.ID_CHUNK_SIZE   # ids per "WHERE id IN (...)"
+LEAD_HOURS = 24             # how long before an appointment its reminder goes out
+WINDOW_MINUTES = 7 * 24 * 60    # appointments read into the queue at a time, past the lead
+DELIVERY_FILE = "reminders_delivered.jsonl"
+DELIVERY_BATCH = 100        # outbox rows handed to the backend per run
+MAX_ATTEMPTS = 5            # failed deliveries before a reminder is left alone
+POLL_INTERVAL = 5           # seconds between change log reads of the command line scheduler
+MAX_ROW_CHANGES = 5000      # more changed appointments than this and the queue is read again
+
+SETTINGS = {"lead_hours": LEAD_HOURS, "delivery_file": DELIVERY_FILE}
+
+Reminder = namedtuple("Reminder", "id appointment_id starts_at email contact message")
+
+
+# Settings from the [reminders] section of the config file, with `overrides`
+# (e.g. command line flags) on top
+def load_settings(config_path=database.CONFIG_PATH, overrides=None):
+    settings = dict(SETTINGS)
+    config = configparser.ConfigParser()
+    if config_path and config.read(config_path) and config.has_section("reminders"):
+        settings.update((key, value) for key, value in config["reminders"].items() if key in SETTINGS)
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    try:
+        settings["lead_hours"] = float(settings["lead_hours"])
+    except ValueError as e:
+        raise ValueError(f"Invalid reminder setting: {e}")
+    if settings["lead_hours"] < 0:
+        raise ValueError("Reminder lead time can't be negative")
+    return settings
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("reminders")
+    group.add_argument("--reminder-lead", type=float, dest="reminder_lead_hours",
+                       help=f"hours before an appointment its reminder goes out, 0 for none (default {LEAD_HOURS})")
+    group.add_argument("--reminder-file", help=f"where the local delivery backend writes reminders (default {DELIVERY_FILE})")
+    return group
+
+
+def settings_from_args(args):
+    overrides = {"lead_hours": args.reminder_lead_hours, "delivery_file": args.reminder_file}
+    return load_settings(args.config, overrides)
+
+
+# The current minute in the clinic's wall clock time, like starts_at
+def now():
+    return scheduling.to_minutes(datetime.datetime.now())
+
+
+##### Reading #########
+def read_window(conn, start, end):
+    """(id, starts_at) of the appointments starting in [start, end), off the R*Tree."""
+    return conn.execute(
+        "SELECT id, starts_at FROM appointment_intervals WHERE starts_at >= ? AND starts_at < ?", (start, end)
+    ).fetchall()
+
+
+def read_appointments(conn, ids):
+    """(id, starts_at) of those of `ids` that still exist."""
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        rows += conn.execute(
+            f"SELECT id, starts_at FROM appointments WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+        ).fetchall()
+    return rows
+
+
+class ReminderQueue:
+    """Upcoming appointments in a heap ordered by when their reminder is due.
+
+    Holds the appointments starting before `loaded_until`, read a window at
+    a time with extend(). Edits go through update(): the new time is pushed
+    and the old heap entry is skipped when it comes up (it no longer matches
+    `starts`), so a change costs O(log n) and the table is never re-read.
+    """
+
+    def __init__(self, lead):
+        self.lead = lead
+        self.starts = {}        # appointment id -> starts_at
+        self.loaded_until = None
+        self._heap = []         # (due, id, starts_at), stale ones included
+
+    def __len__(self):
+        return len(self.starts)
+
+    def replace(self, rows, until):
+        self.starts = {row_id: starts_at for row_id, starts_at in rows if starts_at is not None}
+        self._heap = [(starts_at - self.lead, row_id, starts_at) for row_id, starts_at in self.starts.items()]
+        heapq.heapify(self._heap)
+        self.loaded_until = until
+
+    def extend(self, rows, until):
+        """Add the appointments of the next window, up to `until`."""
+        self.loaded_until = until
+        self.update(rows)
+
+    def update(self, rows, deleted=()):
+        """Take in new or changed (id, starts_at) rows and drop `deleted` ids.
+        Appointments past loaded_until are left for their window."""
+        for row_id in deleted:
+            self.starts.pop(row_id, None)
+        for row_id, starts_at in rows:
+            if starts_at is None or (self.loaded_until is not None and starts_at >= self.loaded_until):
+                self.starts.pop(row_id, None)
+            elif self.starts.get(row_id) != starts_at:
+                self.starts[row_id] = starts_at
+                heapq.heappush(self._heap, (starts_at - self.lead, row_id, starts_at))
+        # Drop the stale entries once they outnumber the live ones
+        if len(self._heap) > 2 * len(self.starts) + 64:
+            self._heap = [(starts_at - self.lead, row_id, starts_at) for row_id, starts_at in self.starts.items()]
+            heapq.heapify(self._heap)
+
+    def _discard_stale(self):
+        while self._heap and self.starts.get(self._heap[0][1]) != self._heap[0][2]:
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """When the next reminder is due, in minutes, or None."""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """(id, starts_at) of the appointments whose reminder is due by `now`.
+        Ones that already started (e.g. an old appointment was edited) are
+        dropped without a reminder."""
+        due = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, row_id, starts_at = heapq.heappop(self._heap)
+            del self.starts[row_id]
+            if starts_at > now:
+                due.append((row_id, starts_at))
+        return due
+
+
+##### Outbox #########
+def queue(conn, due, now):
+    """Write reminders for the (appointment id, starts_at) pairs in `due` to
+    reminder_outbox, one primary key lookup each. Appointments that moved,
+    are gone or have started are skipped, and so are ones already in the
+    outbox for that time. Returns how many were added."""
+    if not due:
+        return 0
+    cursor = conn.executemany("""
+        INSERT OR IGNORE INTO reminder_outbox(appointment_id, starts_at, email, contact, message, queued_at)
+        SELECT a.id, a.starts_at, o.email, o.contact,
+               printf('Reminder: %s has %s at the clinic on %s at %s.',
+                      COALESCE(p.name, 'your pet'), COALESCE(s.service_name, 'an appointment'), a.date, a.time),
+               datetime('now')
+        FROM appointments a
+        LEFT JOIN pets p ON p.id = a.pet_id
+        LEFT JOIN owners o ON o.id = p.owner_id
+        LEFT JOIN services s ON s.id = a.service_id
+        WHERE a.id = ? AND a.starts_at = ? AND a.starts_at > ?
+    """, [(row_id, starts_at, now) for row_id, starts_at in due])
+    conn.commit()
+    return cursor.rowcount
+
+
+def deliver(conn, backend, limit=DELIVERY_BATCH):
+    """Hand unsent outbox reminders to `backend`, returns (sent, failed).
+
+    Rows are claimed (sent_at set) in one IMMEDIATE transaction before they
+    go out, so two schedulers on the same database never send one twice; a
+    crash between claiming and sending loses that reminder rather than
+    repeating it. A failed send is put back with the error, up to
+    MAX_ATTEMPTS times.
+    """
+    unsent = "FROM reminder_outbox WHERE sent_at IS NULL AND attempts < ?"
+    if conn.execute(f"SELECT 1 {unsent} LIMIT 1", (MAX_ATTEMPTS,)).fetchone() is None:
+        return 0, 0     # the common case, without taking the write lock
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            f"SELECT id, appointment_id, starts_at, email, contact, message {unsent} ORDER BY id LIMIT ?",
+            (MAX_ATTEMPTS, limit)
+        ).fetchall()
+        conn.executemany("UPDATE reminder_outbox SET sent_at = datetime('now') WHERE id = ?", [(row[0],) for row in rows])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    failures = []
+    for row in rows:
+        try:
+            backend.send(Reminder._make(row))
+        except Exception as e:
+            failures.append((str(e), row[0]))
+    if failures:
+        conn.executemany(
+            "UPDATE reminder_outbox SET sent_at = NULL, attempts = attempts + 1, error = ? WHERE id = ?", failures
+        )
+        conn.commit()
+    return len(rows) - len(failures), len(failures)
+
+
+class LocalBackend:
+    """Stand-in for a mail or SMS gateway: every reminder is appended to a
+    JSON lines file. Anything with a send(reminder) method can replace it;
+    raising marks the reminder failed for another try."""
+
+    def __init__(self, path=DELIVERY_FILE):
+        self.path = path
+
+    def send(self, reminder):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(reminder._asdict()) + "\n")
+
+
+##### Scheduler #########
+class ReminderScheduler:
+    """Keeps a ReminderQueue of upcoming appointments, moves the due ones
+    into the outbox and delivers them.
+
+    start() reads the appointments of the first window; after that
+    changes() takes the appointment changes from the change log and run()
+    does what is due, reading the next window only when the lead time
+    reaches it. Every method takes the connection to use, so the scheduler
+    can live on a database worker: call it only from that worker's jobs.
+    """
+
+    def __init__(self, backend, lead_hours=LEAD_HOURS, window=WINDOW_MINUTES):
+        self.backend = backend
+        self.lead = int(lead_hours * 60)
+        self.window = window
+        self.queue = ReminderQueue(self.lead)
+
+    def start(self, conn, current=None):
+        current = now() if current is None else current
+        until = current + self.lead + self.window
+        self.queue.replace(read_window(conn, current, until), until)
+        return self.run(conn, current)
+
+    def changes(self, conn, changes, current=None):
+        """Apply {appointment id: op} from the change log, or start over
+        with None (too many changes to go through)."""
+        if changes is None:
+            return self.start(conn, current)
+        deleted = [row_id for row_id, op in changes.items() if op == "delete"]
+        changed = [row_id for row_id, op in changes.items() if op != "delete"]
+        self.queue.update(read_appointments(conn, changed), deleted)
+        return self.run(conn, current)
+
+    def run(self, conn, current=None):
+        """Queue and deliver what is due. Returns {"queued", "sent", "failed",
+        "wake_at"}, wake_at being the minute to run again."""
+        current = now() if current is None else current
+        if self.queue.loaded_until is None:
+            return self.start(conn, current)
+        if current + self.lead >= self.queue.loaded_until:
+            until = current + self.lead + self.window
+            self.queue.extend(read_window(conn, self.queue.loaded_until, until), until)
+        queued = queue(conn, self.queue.pop_due(current), current)
+        sent, failed = deliver(conn, self.backend)
+        wake_at = self.queue.loaded_until - self.lead
+        next_due = self.queue.next_due()
+        if next_due is not None:
+            wake_at = min(wake_at, next_due)
+        return {"queued": queued, "sent": sent, "failed": failed, "wake_at": wake_at}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Send appointment reminders, e.g. next to the clinic server. Runs until interrupted."
+    )
+    database.add_profile_arguments(parser)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        profile = database.profile_from_args(args)
+        settings = settings_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if profile["server"]:
+        parser.error("reminders are sent on the machine holding the database, not through --server")
+    if not settings["lead_hours"]:
+        parser.error("reminders are turned off (lead time 0)")
+
+    conn = database.connect(profile)
+    database.migrate(conn)
+    scheduler = ReminderScheduler(LocalBackend(settings["delivery_file"]), settings["lead_hours"])
+    last_seq = database.last_change(conn)
+    stats = scheduler.start(conn)
+    try:
+        while True:
+            if stats["sent"] or stats["failed"]:
+                print(f"{stats['sent']} reminders sent, {stats['failed']} failed", flush=True)
+            # Sleep until the next reminder is due, checking the change log meanwhile
+            time.sleep(max(1, min(POLL_INTERVAL, (stats["wake_at"] - now()) * 60)))
+            changes, last_seq = database.changes_since(conn, last_seq, MAX_ROW_CHANGES)
+            if changes is None or "appointments" in changes:
+                stats = scheduler.changes(conn, None if changes is None else changes["appointments"])
+            else:
+                stats = scheduler.run(conn)
+    except KeyboardInterrupt:
+        pass
+    except sqlite3.Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
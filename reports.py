@@ -0,0 +1,109 @@
+import datetime
+
+
+# Tables a report is read from, directly or through the rollups their
+# triggers keep; writes to these invalidate cached reports
+SOURCE_TABLES = ("appointments", "pets", "services")
+
+WEEKDAYS = ("Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday")
+BUSIEST_DAYS = 10
+
+
+# Months are "YYYY-MM" strings, either end can be None for open ended
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def _months(first_month, last_month, column="month"):
+    clauses, params = [], []
+    if first_month:
+        clauses.append(f"{column} >= ?")
+        params.append(first_month)
+    if last_month:
+        clauses.append(f"{column} <= ?")
+        params.append(last_month)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _days(first_month, last_month):
+    clauses, params = [], []
+    if first_month:
+        clauses.append("date >= ?")
+        params.append(first_month)      # '2024-05' sorts before '2024-05-01'
+    if last_month:
+        clauses.append("date < ?")
+        params.append(_next_month(last_month))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def revenue_by_service(conn, first_month=None, last_month=None):
+    """(month, service, visits, revenue) rows, newest month first."""
+    where, params = _months(first_month, last_month, "r.month")
+    return conn.execute(f"""
+        SELECT r.month, COALESCE(s.service_name, 'Service ' || r.service_id), r.visits, r.revenue
+        FROM report_service_month r LEFT JOIN services s ON s.id = r.service_id
+        {where}
+        ORDER BY r.month DESC, 4 DESC
+    """, params).fetchall()
+
+
+def monthly_totals(conn, first_month=None, last_month=None):
+    """(month, visits, revenue) rows, newest month first."""
+    where, params = _months(first_month, last_month, "r.month")
+    return conn.execute(f"""
+        SELECT r.month, SUM(r.visits), SUM(r.revenue)
+        FROM report_service_month r
+        {where}
+        GROUP BY r.month
+        ORDER BY r.month DESC
+    """, params).fetchall()
+
+
+def visits_by_species(conn, first_month=None, last_month=None):
+    """(species, visits) rows, most visits first."""
+    where, params = _months(first_month, last_month)
+    return conn.execute(f"""
+        SELECT species, SUM(visits) FROM report_species_month{where}
+        GROUP BY species ORDER BY 2 DESC
+    """, params).fetchall()
+
+
+def busiest_days(conn, first_month=None, last_month=None, limit=BUSIEST_DAYS):
+    """(date, visits) of the days with the most appointments."""
+    where, params = _days(first_month, last_month)
+    return conn.execute(
+        f"SELECT date, visits FROM report_day{where} ORDER BY visits DESC, date DESC LIMIT ?", params + [limit]
+    ).fetchall()
+
+
+def visits_by_weekday(conn, first_month=None, last_month=None):
+    """(weekday, visits, days open) rows, Monday first."""
+    where, params = _days(first_month, last_month)
+    rows = conn.execute(f"""
+        SELECT CAST(strftime('%w', date) AS INTEGER), SUM(visits), COUNT(*) FROM report_day{where}
+        GROUP BY 1
+    """, params).fetchall()
+    by_day = {weekday: (visits, days) for weekday, visits, days in rows if weekday is not None}
+    return [(WEEKDAYS[weekday], *by_day.get(weekday, (0, 0))) for weekday in (1, 2, 3, 4, 5, 6, 0)]
+
+
+def summary(conn, first_month=None, last_month=None):
+    """Everything the Reports page shows, in one read."""
+    months = monthly_totals(conn, first_month, last_month)
+    return {
+        "visits": sum(row[1] for row in months),
+        "revenue": sum(row[2] for row in months),
+        "months": months,
+        "services": revenue_by_service(conn, first_month, last_month),
+        "species": visits_by_species(conn, first_month, last_month),
+        "busiest_days": busiest_days(conn, first_month, last_month),
+        "weekdays": visits_by_weekday(conn, first_month, last_month),
+    }
+
+
+# The last `count` months up to and including this one
+def recent_months(count=12, today=None):
+    today = today or datetime.date.today()
+    first = today.year * 12 + today.month - count
+    return f"{first // 12:04d}-{first % 12 + 1:02d}", f"{today:%Y-%m}"
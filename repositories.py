@@ -0,0 +1,318 @@
+import contextlib
+from collections import namedtuple
+
+import database
+import importer
+import scheduling
+
+
+ID_CHUNK_SIZE = importer.ID_CHUNK_SIZE   # ids per "WHERE id IN (...)"
+
+Owner = namedtuple("Owner", "id name contact email address")
+Pet = namedtuple("Pet", "id name age species breed owner_id")
+Service = namedtuple("Service", "id service_name cost duration_minutes")
+Appointment = namedtuple("Appointment", "id date time pet_id service_id starts_at ends_at price")
+
+
+class Repository:
+    """Create, read, update and delete records of one table.
+
+    Works on an open connection and never touches Qt, so it can be used
+    from a worker job, a script or a benchmark alike. Values are checked
+    and converted the same way as on import (whole numbers, dates, ...),
+    and a ValueError names the field that's wrong.
+
+    Every SQL string is built once per column set and reused, so sqlite3's
+    statement cache hands back the already prepared statement. Writes commit
+    on their own unless the caller already has a transaction open (see
+    Repositories.transaction()). With a QueryCache, writes bump the table so
+    cached reads of it are dropped.
+    """
+
+    table = None
+    record = None   # namedtuple type of the rows
+
+    def __init__(self, conn, cache=None):
+        self.conn = conn
+        self.cache = cache
+        self.spec = importer.TABLES[self.table]
+        self.columns = self.spec["columns"]
+        self._select = f"SELECT {', '.join(self.record._fields)} FROM {self.table}"
+        self._get_sql = f"{self._select} WHERE id = ?"
+        self._insert_sql = (
+            f"INSERT INTO {self.table} (id, {', '.join(self.columns)}) "
+            f"VALUES ({', '.join('?' for _ in range(len(self.columns) + 1))})"
+        )
+        self._delete_sql = f"DELETE FROM {self.table} WHERE id = ?"
+        self._update_sql = {}   # column tuple -> UPDATE statement
+
+    ##### Reading #########
+    def get(self, record_id):
+        row = self.conn.execute(self._get_sql, (record_id,)).fetchone()
+        return None if row is None else self.record._make(row)
+
+    def get_many(self, ids):
+        """{id: record} for those of `ids` that exist."""
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), ID_CHUNK_SIZE):
+            chunk = ids[start:start + ID_CHUNK_SIZE]
+            sql = f"{self._select} WHERE id IN ({', '.join('?' for _ in chunk)})"
+            for row in self.conn.execute(sql, chunk):
+                found[row[0]] = self.record._make(row)
+        return found
+
+    def list(self, limit=None, after_id=None):
+        """Records in id order, `limit` at a time after `after_id` (keyset paging)."""
+        if after_id is None:
+            sql, params = f"{self._select} ORDER BY id LIMIT ?", (-1 if limit is None else limit,)
+        else:
+            sql, params = f"{self._select} WHERE id > ? ORDER BY id LIMIT ?", (after_id, -1 if limit is None else limit)
+        if self.cache is None:
+            rows = self.conn.execute(sql, params).fetchall()
+        else:
+            rows = self.cache.fetch_all(self.conn, sql, params, (self.table,))
+        return [self.record._make(row) for row in rows]
+
+    def count(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    ##### Writing #########
+    def _write(self, work, immediate=False):
+        try:
+            if self.conn.in_transaction:
+                return work()   # part of the caller's transaction
+            self.conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                result = work()
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            return result
+        finally:
+            self._bump()   # also on failure, an enclosing transaction may commit what came before
+
+    def _bump(self):
+        if self.cache is not None:
+            self.cache.bump(self.table)
+
+    # Record dict -> (id, *columns), filling in defaults
+    def _row(self, values):
+        unknown = set(values) - set(self.columns) - {"id"}
+        if unknown:
+            raise ValueError(f"{self.table} has no column {sorted(unknown)[0]}")
+        return importer.convert_record(self.spec, values)
+
+    # Converted {column: value} for an update, only the columns given
+    def _changes(self, values):
+        changes = {}
+        for column, value in values.items():
+            if column == "id":
+                try:
+                    changes[column] = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"id must be a whole number, got {value!r}")
+            elif column in self.columns:
+                if value is None or str(value).strip() == "":
+                    raise ValueError(f"missing {column}")
+                changes[column] = importer.convert_value(self.spec, column, value)
+            else:
+                raise ValueError(f"{self.table} has no column {column}")
+        return changes
+
+    def _update_statement(self, columns):
+        sql = self._update_sql.get(columns)
+        if sql is None:
+            sql = self._update_sql[columns] = (
+                f"UPDATE {self.table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?"
+            )
+        return sql
+
+    def add(self, **values):
+        """Insert one record, returns its id."""
+        row = self._row(values)
+        return self._write(lambda: self.conn.execute(self._insert_sql, row).lastrowid)
+
+    def add_many(self, records):
+        """Insert record dicts in one transaction, returns how many."""
+        rows = [self._row(record) for record in records]
+        return self._write(lambda: self.conn.executemany(self._insert_sql, rows).rowcount)
+
+    def update(self, record_id, **values):
+        """Change the given columns of one record."""
+        return self.update_many([(record_id, values)])
+
+    def update_many(self, updates):
+        """Apply (id, {column: value}) pairs in one transaction, returns how
+        many records changed. Pairs changing the same columns go through one
+        executemany."""
+        groups = {}
+        for record_id, values in updates:
+            changes = self._changes(values)
+            if changes:
+                groups.setdefault(tuple(changes), []).append(list(changes.values()) + [record_id])
+
+        def work():
+            return sum(
+                self.conn.executemany(self._update_statement(columns), params).rowcount
+                for columns, params in groups.items()
+            )
+        return self._write(work)
+
+    def delete(self, record_id):
+        return self.delete_many([record_id])
+
+    def delete_many(self, ids):
+        """Delete records by id in one transaction, returns how many."""
+        params = [(record_id,) for record_id in ids]
+        return self._write(lambda: self.conn.executemany(self._delete_sql, params).rowcount)
+
+
+class OwnerRepo(Repository):
+    table = "owners"
+    record = Owner
+
+
+class PetRepo(Repository):
+    table = "pets"
+    record = Pet
+
+    def for_owner(self, owner_id):
+        rows = self.conn.execute(f"{self._select} WHERE owner_id = ? ORDER BY id", (owner_id,))
+        return [self.record._make(row) for row in rows]
+
+
+class ServiceRepo(Repository):
+    table = "services"
+    record = Service
+
+
+class AppointmentRepo(Repository):
+    """Appointments are checked against the ones already booked before they
+    are written (see scheduling.check_booking), inside the same IMMEDIATE
+    transaction, so two clients can't both grab the last free slot. A clash
+    raises scheduling.BookingConflict and nothing of the batch is written.
+    `limits` are the scheduling settings bookings are checked against
+    (scheduling.load_settings), the defaults when not given.
+    """
+
+    table = "appointments"
+    record = Appointment
+
+    def __init__(self, conn, cache=None, limits=None):
+        super().__init__(conn, cache)
+        self.limits = limits
+
+    def for_pet(self, pet_id):
+        rows = self.conn.execute(f"{self._select} WHERE pet_id = ? ORDER BY starts_at", (pet_id,))
+        return [self.record._make(row) for row in rows]
+
+    def _book(self, row):
+        _, date, time, pet_id, service_id = row
+        scheduling.check_booking(self.conn, date, time, pet_id, service_id, limits=self.limits)
+        return self.conn.execute(self._insert_sql, row).lastrowid
+
+    def add(self, **values):
+        row = self._row(values)
+        return self._write(lambda: self._book(row), immediate=True)
+
+    # One at a time, so each appointment is also checked against the ones
+    # before it in the batch
+    def add_many(self, records):
+        rows = [self._row(record) for record in records]
+        return self._write(lambda: len([self._book(row) for row in rows]), immediate=True)
+
+    def update_many(self, updates):
+        updates = [
+            (record_id, {column: value for column, value in values.items() if column not in scheduling.DERIVED_COLUMNS})
+            for record_id, values in updates
+        ]
+        checked = [(record_id, self._changes(values)) for record_id, values in updates]
+
+        def work():
+            count = 0
+            for record_id, changes in checked:
+                current = self.get(record_id)
+                if current is None:
+                    raise ValueError(f"Appointment {record_id} does not exist")
+                booking = current._replace(**changes)
+                scheduling.check_booking(
+                    self.conn, booking.date, booking.time, booking.pet_id, booking.service_id, exclude_id=record_id,
+                    limits=self.limits
+                )
+                # Another service is charged at its current cost; a new date keeps the price
+                if booking.service_id != current.service_id:
+                    changes = dict(changes, price=self.conn.execute(
+                        "SELECT cost FROM services WHERE id = ?", (booking.service_id,)
+                    ).fetchone()[0])
+                if changes:
+                    count += self.conn.execute(
+                        self._update_statement(tuple(changes)), list(changes.values()) + [record_id]
+                    ).rowcount
+            return count
+        return self._write(work, immediate=True)
+
+
+REPOSITORIES = {
+    "owners": OwnerRepo,
+    "pets": PetRepo,
+    "services": ServiceRepo,
+    "appointments": AppointmentRepo,
+}
+
+
+class Repositories:
+    """The repositories of every table over one connection.
+
+        repos = Repositories.open()
+        owner_id = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+        repos.pets.add(name="Rex", age=3, species="dog", breed="collie", owner_id=owner_id)
+        repos.close()
+
+    open() makes and migrates a connection of its own; the constructor
+    wraps one that already exists, such as the worker thread's. Over a
+    clinic server's connection (see client.py) there is no transaction(),
+    and bookings are checked against the server's `limits` instead.
+    """
+
+    def __init__(self, conn, cache=None, limits=None):
+        self.conn = conn
+        if hasattr(conn, "repository"):
+            # client.RemoteConnection: records are written through the server
+            self.by_table = {table: conn.repository(table, cache) for table in REPOSITORIES}
+        else:
+            self.by_table = {
+                table: repo(conn, cache, limits) if repo is AppointmentRepo else repo(conn, cache)
+                for table, repo in REPOSITORIES.items()
+            }
+        self.owners = self.by_table["owners"]
+        self.pets = self.by_table["pets"]
+        self.services = self.by_table["services"]
+        self.appointments = self.by_table["appointments"]
+
+    @classmethod
+    def open(cls, profile=None, cache=None, limits=None):
+        conn = database.connect(profile)
+        database.migrate(conn)
+        return cls(conn, cache, limits)
+
+    def table(self, table_name):
+        repo = self.by_table.get(table_name)
+        if repo is None:
+            raise ValueError(f"No repository for table {table_name!r}")
+        return repo
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group writes to several tables into one commit."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,234 @@
+import calendar
+import datetime
+import configparser
+
+import database
+
+
+DEFAULT_DURATION = 30   # minutes, for services that don't set their own
+SLOT_MINUTES = 15       # free slots start on the quarter hour
+OPENING_TIME = datetime.time(8, 0)
+CLOSING_TIME = datetime.time(18, 0)
+OPEN_WEEKDAYS = (0, 1, 2, 3, 4, 5)   # Monday to Saturday
+CAPACITY = 3            # appointments the clinic can see at the same time
+SERVICE_CAPACITY = 1    # of those, appointments for one service (0 for no limit of its own)
+
+SETTINGS = {"capacity": CAPACITY, "service_capacity": SERVICE_CAPACITY}
+
+# Accepted spellings of what is typed into the appointment form. Everything
+# is stored as YYYY-MM-DD and HH:MM, which sqlite's date functions can read.
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y")
+TIME_FORMATS = ("%H:%M", "%H.%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p")
+
+# Filled in by the database from date, time and the service duration, and
+# the price from the service's cost when the appointment is booked
+DERIVED_COLUMNS = ("starts_at", "ends_at", "price")
+
+
+# Settings from the [scheduling] section of the config file, with `overrides`
+# (e.g. command line flags) on top
+def load_settings(config_path=database.CONFIG_PATH, overrides=None):
+    settings = dict(SETTINGS)
+    config = configparser.ConfigParser()
+    if config_path and config.read(config_path) and config.has_section("scheduling"):
+        settings.update((key, value) for key, value in config["scheduling"].items() if key in SETTINGS)
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    try:
+        settings["capacity"] = int(settings["capacity"])
+        settings["service_capacity"] = int(settings["service_capacity"])
+    except ValueError as e:
+        raise ValueError(f"Invalid scheduling setting: {e}")
+    if settings["capacity"] < 1:
+        raise ValueError("The clinic has to fit at least one appointment at a time")
+    if settings["service_capacity"] < 0:
+        raise ValueError("Service capacity can't be negative, use 0 for no limit")
+    return settings
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("scheduling")
+    group.add_argument("--capacity", type=int, help=f"appointments the clinic runs at once (default {CAPACITY})")
+    group.add_argument("--service-capacity", type=int,
+                       help=f"appointments for the same service at once, 0 for no limit (default {SERVICE_CAPACITY})")
+    return group
+
+
+def settings_from_args(args):
+    overrides = {"capacity": args.capacity, "service_capacity": args.service_capacity}
+    return load_settings(args.config, overrides)
+
+
+class BookingConflict(ValueError):
+    """The requested time overlaps appointments that are already booked."""
+
+    def __init__(self, message, conflicts):
+        super().__init__(message)
+        self.conflicts = conflicts
+
+
+def _parse(text, formats, what, example):
+    text = str(text).strip()
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(text.upper(), fmt)   # %p only matches AM/PM
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised {what} {text!r}, use {example}")
+
+
+def parse_date(text):
+    try:
+        return datetime.date.fromisoformat(str(text).strip())   # the stored form, and much faster than strptime
+    except ValueError:
+        pass
+    return _parse(text, DATE_FORMATS, "date", "YYYY-MM-DD").date()
+
+
+def parse_time(text):
+    text = str(text).strip()
+    # Only the colon form: fromisoformat reads "10.15" as 10:00 and 0.15 seconds
+    if ":" in text:
+        try:
+            return datetime.time.fromisoformat(text).replace(second=0, microsecond=0, tzinfo=None)
+        except ValueError:
+            pass
+    return _parse(text, TIME_FORMATS, "time", "HH:MM").time().replace(second=0)
+
+
+def normalize(date_text, time_text):
+    """The stored ("YYYY-MM-DD", "HH:MM") form of a typed date and time."""
+    return parse_date(date_text).isoformat(), parse_time(time_text).strftime("%H:%M")
+
+
+# Timestamps are whole minutes since 1970-01-01 in clinic wall clock time, the
+# same value sqlite gives for strftime('%s', date || ' ' || time) / 60. Wall
+# clock rather than UTC, so a 9:00 appointment stays at 9:00 across DST changes.
+def to_minutes(moment):
+    return calendar.timegm(moment.timetuple()) // 60
+
+
+def from_minutes(minutes):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(minutes=minutes)
+
+
+def service_duration(conn, service_id):
+    row = conn.execute("SELECT duration_minutes FROM services WHERE id = ?", (service_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Service {service_id} does not exist")
+    return row[0]
+
+
+##### Conflicts #########
+# (id, pet_id, starts_at, ends_at, service_id) of the appointments overlapping
+# [starts_at, ends_at), straight from the R*Tree, so the cost depends on how
+# many appointments are nearby and not on the size of the calendar
+def _overlapping(conn, starts_at, ends_at, exclude_id=None):
+    return conn.execute("""
+        SELECT a.id, a.pet_id, a.starts_at, a.ends_at, a.service_id
+        FROM appointment_intervals i
+        JOIN appointments a ON a.id = i.id
+        WHERE i.starts_at < ? AND i.ends_at > ? AND i.id IS NOT ?
+    """, (ends_at, starts_at, exclude_id)).fetchall()
+
+
+# Most appointments running at once anywhere in [starts_at, ends_at)
+def _peak(appointments, starts_at, ends_at):
+    changes = []
+    for appointment in appointments:
+        start, end = appointment[2], appointment[3]
+        if start < ends_at and end > starts_at:
+            changes.append((max(start, starts_at), 1))
+            changes.append((min(end, ends_at), -1))
+    peak = running = 0
+    for _, change in sorted(changes):   # ends sort before starts at the same minute
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def find_conflicts(conn, pet_id, starts_at, ends_at, exclude_id=None, service_id=None, limits=None):
+    """Appointments that stop this one from being booked, empty if it fits.
+
+    A pet can't be in two appointments at once, the clinic can't run more
+    than limits["capacity"] at the same time, and one service no more than
+    limits["service_capacity"]. `limits` are scheduling settings (see
+    load_settings), SETTINGS when not given.
+    """
+    limits = limits or SETTINGS
+    overlapping = _overlapping(conn, starts_at, ends_at, exclude_id)
+    same_pet = [appointment for appointment in overlapping if appointment[1] == pet_id]
+    if same_pet:
+        return same_pet
+    if _peak(overlapping, starts_at, ends_at) >= limits["capacity"]:
+        return overlapping
+    if service_id is not None and limits["service_capacity"]:
+        same_service = [appointment for appointment in overlapping if appointment[4] == service_id]
+        if _peak(same_service, starts_at, ends_at) >= limits["service_capacity"]:
+            return same_service
+    return []
+
+
+def _conflict_message(pet_id, service_id, conflicts, limits):
+    booked = ", ".join(
+        f"{from_minutes(appointment[2]):%Y-%m-%d %H:%M}-{from_minutes(appointment[3]):%H:%M}"
+        for appointment in conflicts[:3]
+    )
+    if any(appointment[1] == pet_id for appointment in conflicts):
+        return f"Pet {pet_id} already has an appointment at that time ({booked})"
+    # find_conflicts only returns fewer than the clinic can take for a full service
+    if _peak(conflicts, min(appointment[2] for appointment in conflicts),
+             max(appointment[3] for appointment in conflicts)) < limits["capacity"]:
+        return f"Service {service_id} is fully booked at that time ({booked})"
+    return f"The clinic is fully booked at that time ({booked})"
+
+
+def check_booking(conn, date, time, pet_id, service_id, exclude_id=None, limits=None):
+    """Raise BookingConflict if the appointment can't be booked. Run it in the
+    same IMMEDIATE transaction as the write, see repositories.AppointmentRepo."""
+    limits = limits or SETTINGS
+    starts_at = to_minutes(datetime.datetime.combine(parse_date(date), parse_time(time)))
+    ends_at = starts_at + service_duration(conn, service_id)
+    conflicts = find_conflicts(conn, pet_id, starts_at, ends_at, exclude_id, service_id, limits)
+    if conflicts:
+        raise BookingConflict(_conflict_message(pet_id, service_id, conflicts, limits), conflicts)
+
+
+##### Availability #########
+def free_slots(conn, first_day, days=1, duration=DEFAULT_DURATION, pet_id=None, service_id=None, now=None,
+               limits=None):
+    """(start, end) datetimes of every free `duration` minute slot within
+    opening hours, for `days` days from `first_day`.
+
+    Slots start every SLOT_MINUTES, and none before `now` (default: the
+    current time). With a `pet_id`, times that pet is already booked are
+    left out too, and with a `service_id` times the service is full.
+    `limits` as for find_conflicts.
+    """
+    limits = limits or SETTINGS
+    earliest = to_minutes(now or datetime.datetime.now())
+    slots = []
+    for offset in range(days):
+        day = first_day + datetime.timedelta(days=offset)
+        if day.weekday() not in OPEN_WEEKDAYS:
+            continue
+        opens = to_minutes(datetime.datetime.combine(day, OPENING_TIME))
+        closes = to_minutes(datetime.datetime.combine(day, CLOSING_TIME))
+        if closes - duration < earliest:
+            continue
+        booked = _overlapping(conn, opens, closes)
+
+        for start in range(opens, closes - duration + 1, SLOT_MINUTES):
+            if start < earliest:
+                continue
+            end = start + duration
+            clashing = [appointment for appointment in booked if appointment[2] < end and appointment[3] > start]
+            if pet_id is not None and any(appointment[1] == pet_id for appointment in clashing):
+                continue
+            if _peak(clashing, start, end) >= limits["capacity"]:
+                continue
+            if service_id is not None and limits["service_capacity"]:
+                same_service = [appointment for appointment in clashing if appointment[4] == service_id]
+                if _peak(same_service, start, end) >= limits["service_capacity"]:
+                    continue
+            slots.append((from_minutes(start), from_minutes(end)))
+    return slots
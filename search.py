@@ -0,0 +1,51 @@
+import re
+
+
+RESULT_LIMIT = 50
+
+# bm25 column weights: a hit on a name counts for more than one on an address
+OWNER_WEIGHTS = "10.0, 5.0, 5.0, 1.0"    # name, contact, email, address
+PET_WEIGHTS = "10.0, 2.0, 2.0"           # name, species, breed
+
+
+# Turn what was typed into an FTS5 query: every word must match, and the
+# words are prefixes, so "jo smi" finds "John Smith". The exact word is OR-ed
+# in so a whole-word hit outranks longer words sharing the prefix. Words are
+# quoted so FTS5 syntax (AND, NEAR, column:, ...) in the input is taken literally.
+def match_query(text):
+    terms = re.findall(r"\w+", text, re.UNICODE)
+    return " AND ".join(f'("{term}" OR "{term}"*)' for term in terms)
+
+
+def search(conn, text, limit=RESULT_LIMIT):
+    """Ranked owners and pets matching `text`.
+
+    Returns (kind, id, name, details, rank) tuples, best match first.
+    Lower rank is better, as with FTS5's bm25().
+    """
+    query = match_query(text)
+    if not query:
+        return []
+
+    owners = conn.execute(f"""
+        SELECT 'owner', o.id, o.name, o.contact || '  ' || o.email || '  ' || o.address,
+               bm25(owners_fts, {OWNER_WEIGHTS}) AS rank
+        FROM owners_fts
+        JOIN owners o ON o.id = owners_fts.rowid
+        WHERE owners_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (query, limit)).fetchall()
+
+    pets = conn.execute(f"""
+        SELECT 'pet', p.id, p.name, p.species || ', ' || p.breed || '  (owner: ' || o.name || ')',
+               bm25(pets_fts, {PET_WEIGHTS}) AS rank
+        FROM pets_fts
+        JOIN pets p ON p.id = pets_fts.rowid
+        JOIN owners o ON o.id = p.owner_id
+        WHERE pets_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (query, limit)).fetchall()
+
+    return sorted(owners + pets, key=lambda result: result[4])[:limit]
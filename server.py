@@ -0,0 +1,515 @@
+import re
+import sys
+import hmac
+import json
+import http
+import sqlite3
+import asyncio
+import argparse
+import contextlib
+import traceback
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import repositories
+import scheduling
+import search
+
+
+HOST = "127.0.0.1"      # localhost only unless --host says otherwise
+PORT = 8765
+READERS = 4             # read connections, so this many reads run at once
+MAX_BODY = 16 * 1024 * 1024
+MAX_HEADERS = 100
+KEEP_ALIVE = 300        # seconds an idle client connection is kept open
+LIST_LIMIT = 1000       # records per GET /api/<table> unless ?limit= says fewer
+QUERY_BATCH = 1000      # rows per line of a streamed /api/query result
+PRUNE_INTERVAL = 60     # seconds between change log prunes
+
+# Pragmas with an argument that only read, e.g. PRAGMA table_info(pets)
+READ_PRAGMAS = ("table_info", "table_xinfo", "index_list", "index_info", "index_xinfo", "foreign_key_list")
+
+BODY_KINDS = {dict: "a JSON object", list: "a JSON array", (dict, list): "a JSON object or array"}
+
+Request = namedtuple("Request", "method path query headers body")
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class NotFound(LookupError):
+    pass
+
+
+##### Connections #########
+# Authorizer of the read connections: anything that could change the
+# database, attach another one or change a setting is refused by sqlite
+# itself, whatever SQL a client sends
+def _authorize_read(action, arg1, arg2, db_name, trigger):
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE):
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and (arg2 is None or arg1.lower() in READ_PRAGMAS):
+        return sqlite3.SQLITE_OK
+    # FTS5 declaring its columns the first time a search touches it. It isn't
+    # a write, and query_only (which can't be switched off) stops real ones.
+    if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master":
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+class PooledConnection:
+    """A sqlite connection and the one thread allowed to use it.
+
+    Work runs on that thread through run(), so a request can execute a
+    statement and fetch its rows over several awaits without ever touching
+    the connection from another thread.
+    """
+
+    def __init__(self, profile, read_only, limits=None):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reader" if read_only else "writer")
+        self.repos = self.executor.submit(self._open, profile, read_only, limits).result()
+        self.conn = self.repos.conn
+
+    @staticmethod
+    def _open(profile, read_only, limits):
+        conn = database.connect(profile)
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+            conn.set_authorizer(_authorize_read)
+        else:
+            database.migrate(conn)
+        return repositories.Repositories(conn, limits=limits)
+
+    # work(repos, *args) on the connection's thread
+    def run(self, work, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, work, self.repos, *args)
+
+    def close(self):
+        self.executor.submit(self.conn.close).result()
+        self.executor.shutdown()
+
+
+class ConnectionPool:
+    """Read connections handed out one request at a time, and a single write
+    connection every write queues on in arrival order. Only the server ever
+    writes, so clients never wait on each other's locks, and WAL lets the
+    readers carry on while a write commits."""
+
+    def __init__(self, profile, readers=READERS, limits=None):
+        self.writer = PooledConnection(profile, False, limits)     # migrates the database first
+        self.readers = [PooledConnection(profile, True) for _ in range(readers)]
+        self._idle = asyncio.Queue()
+        for reader in self.readers:
+            self._idle.put_nowait(reader)
+
+    async def acquire(self):
+        return await self._idle.get()
+
+    def release(self, reader):
+        self._idle.put_nowait(reader)
+
+    async def read(self, work, *args):
+        reader = await self.acquire()
+        try:
+            return await reader.run(work, *args)
+        finally:
+            self.release(reader)
+
+    def write(self, work, *args):
+        return self.writer.run(work, *args)
+
+    def close(self):
+        for connection in [self.writer] + self.readers:
+            connection.close()
+
+
+##### HTTP #########
+async def _read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(431, "too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "bad Content-Length")
+    if length > MAX_BODY:
+        raise HttpError(413, f"request body over {MAX_BODY} bytes")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    return Request(method.upper(), urllib.parse.unquote(url.path), query, headers, body)
+
+
+def _head(status, content_type, keep_alive, extra=""):
+    return (
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"{extra}\r\n"
+    ).encode("latin-1")
+
+
+def _json(value):
+    return json.dumps(value, default=str, separators=(",", ":")).encode("utf-8")
+
+
+# Status and body for an exception out of a handler
+def _error_response(error):
+    if isinstance(error, HttpError):
+        status = error.status
+    elif isinstance(error, (scheduling.BookingConflict, sqlite3.IntegrityError)):
+        status = 409
+    elif isinstance(error, NotFound):
+        status = 404
+    elif isinstance(error, ValueError):
+        status = 400
+    elif isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        status = 503
+    elif isinstance(error, sqlite3.DatabaseError) and "authoriz" in str(error):
+        status = 403    # a write or setting sent to /api/query
+    elif isinstance(error, sqlite3.Error):
+        status = 400    # the statement a client sent
+    else:
+        status = 500
+        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+    body = {"error": str(error), "type": type(error).__name__}
+    if isinstance(error, scheduling.BookingConflict):
+        body["conflicts"] = error.conflicts
+    return status, body
+
+
+def _body(request, kind):
+    try:
+        value = json.loads(request.body or b"null")
+    except ValueError as e:
+        raise HttpError(400, f"invalid JSON: {e}")
+    if not isinstance(value, kind):
+        raise HttpError(400, f"expected {BODY_KINDS[kind]}")
+    return value
+
+
+def _int(query, name, default=None):
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(400, f"{name} must be a whole number")
+
+
+class ClinicServer:
+    """HTTP/JSON API over the clinic database, for several front desk PCs
+    sharing one database through one process.
+
+        GET    /api/status
+        GET    /api/search?q=smith&limit=20
+        POST   /api/query                {"sql": "SELECT ...", "params": [...]}
+        GET    /api/<table>?limit=&after_id=   (also ?ids=1,2,3, pets ?owner_id=, appointments ?pet_id=)
+        GET    /api/<table>/count
+        GET    /api/<table>/<id>
+        POST   /api/<table>              one record object, or an array of them
+        PATCH  /api/<table>/<id>         {"column": value, ...}
+        PATCH  /api/<table>              [{"id": 1, "column": value, ...}, ...]
+        DELETE /api/<table>/<id>
+        DELETE /api/<table>              {"ids": [1, 2, 3]}
+
+    Tables are owners, pets, services and appointments; writes go through
+    repositories.py, so they are checked the same way as in the app. Errors
+    come back as {"error": ..., "type": ...} with a 4xx/5xx status.
+    /api/query runs one read-only statement (see _authorize_read) and
+    streams the result as JSON lines: {"columns": [...]}, then {"rows":
+    [...]} batches, then {"done": true, "count": n}. client.py speaks this.
+
+    With a `token`, every request needs "Authorization: Bearer <token>".
+    Bookings from every client are checked against `limits`, the scheduling
+    settings (scheduling.load_settings).
+    """
+
+    def __init__(self, profile=None, readers=READERS, token=None, limits=None):
+        self.profile = profile
+        self.readers = readers
+        self.token = token
+        self.limits = limits
+        self.pool = None
+        self.server = None
+        self.port = None
+        self._pruning = None
+        self.routes = [
+            ("GET", r"/api/status", self.status),
+            ("GET", r"/api/search", self.search),
+            ("POST", r"/api/query", self.query),
+            ("GET", r"/api/(?P<table>\w+)/count", self.count),
+            ("GET", r"/api/(?P<table>\w+)", self.list),
+            ("POST", r"/api/(?P<table>\w+)", self.create),
+            ("PATCH", r"/api/(?P<table>\w+)", self.update_many),
+            ("DELETE", r"/api/(?P<table>\w+)", self.delete_many),
+            ("GET", r"/api/(?P<table>\w+)/(?P<record_id>\d+)", self.get),
+            ("PATCH", r"/api/(?P<table>\w+)/(?P<record_id>\d+)", self.update),
+            ("DELETE", r"/api/(?P<table>\w+)/(?P<record_id>\d+)", self.delete),
+        ]
+        self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in self.routes]
+
+    async def start(self, host=HOST, port=PORT):
+        self.pool = ConnectionPool(self.profile, self.readers, self.limits)
+        self.server = await asyncio.start_server(self._serve_client, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]     # the one picked for port 0
+        self._pruning = asyncio.create_task(self._prune_change_log())
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self._pruning.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.close()
+
+    # Clients only read the change log, keeping it short is up to us
+    async def _prune_change_log(self):
+        while True:
+            await asyncio.sleep(PRUNE_INTERVAL)
+            await self.pool.write(lambda repos: database.prune_change_log(repos.conn))
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEP_ALIVE)
+                except HttpError as e:
+                    await self._send(writer, *_error_response(e), keep_alive=False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                status, payload = await self._handle(request)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass    # the client went away mid response
+        finally:
+            writer.close()
+
+    async def _handle(self, request):
+        try:
+            if self.token is not None:
+                sent = request.headers.get("authorization", "")
+                if not hmac.compare_digest(sent.encode(), f"Bearer {self.token}".encode()):
+                    raise HttpError(401, "missing or wrong token")
+            allowed = []
+            for method, pattern, handler in self.routes:
+                match = pattern.fullmatch(request.path)
+                if match is None:
+                    continue
+                if method == request.method:
+                    return await handler(request, **match.groupdict())
+                allowed.append(method)
+            if allowed:
+                raise HttpError(405, f"{request.method} not allowed, use {', '.join(allowed)}")
+            raise HttpError(404, f"no such endpoint {request.path}")
+        except Exception as e:
+            return _error_response(e)
+
+    async def _send(self, writer, status, payload, keep_alive):
+        if hasattr(payload, "__aiter__"):
+            # Streamed as JSON lines in chunked encoding, one line per batch
+            writer.write(_head(status, "application/x-ndjson", keep_alive, "Transfer-Encoding: chunked\r\n"))
+            try:
+                async for line in payload:
+                    data = _json(line) + b"\n"
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    await writer.drain()
+            finally:
+                await payload.aclose()  # a client gone mid stream gives back its reader now
+            writer.write(b"0\r\n\r\n")
+        else:
+            data = _json(payload)
+            writer.write(_head(status, "application/json", keep_alive, f"Content-Length: {len(data)}\r\n") + data)
+        await writer.drain()
+
+    ##### Endpoints #########
+    def _repo(self, repos, table):
+        try:
+            return repos.table(table)
+        except ValueError as e:
+            raise NotFound(str(e))
+
+    async def status(self, request):
+        def work(repos):
+            return {
+                "schema_version": database.schema_version(repos.conn),
+                "last_change": database.last_change(repos.conn),
+                "sqlite": sqlite3.sqlite_version,
+                "readers": len(self.pool.readers),
+                "tables": list(repositories.REPOSITORIES),
+            }
+        return 200, await self.pool.read(work)
+
+    async def search(self, request):
+        text = request.query.get("q", "")
+        limit = _int(request.query, "limit", search.RESULT_LIMIT)
+        rows = await self.pool.read(lambda repos: search.search(repos.conn, text, limit))
+        fields = ("kind", "id", "name", "details", "rank")
+        return 200, {"results": [dict(zip(fields, row)) for row in rows]}
+
+    async def count(self, request, table):
+        return 200, {"count": await self.pool.read(lambda repos: self._repo(repos, table).count())}
+
+    async def list(self, request, table):
+        query = request.query
+
+        def work(repos):
+            repo = self._repo(repos, table)
+            if "ids" in query:
+                try:
+                    ids = [int(part) for part in query["ids"].split(",") if part]
+                except ValueError:
+                    raise HttpError(400, "ids must be whole numbers")
+                records = list(repo.get_many(ids).values())
+            elif table == "pets" and "owner_id" in query:
+                records = repo.for_owner(_int(query, "owner_id"))
+            elif table == "appointments" and "pet_id" in query:
+                records = repo.for_pet(_int(query, "pet_id"))
+            else:
+                limit = min(_int(query, "limit", LIST_LIMIT), LIST_LIMIT)
+                records = repo.list(limit, _int(query, "after_id"))
+            return [record._asdict() for record in records]
+        records = await self.pool.read(work)
+        return 200, {"records": records, "last_id": records[-1]["id"] if records else None}
+
+    async def get(self, request, table, record_id):
+        record = await self.pool.read(lambda repos: self._repo(repos, table).get(int(record_id)))
+        if record is None:
+            raise NotFound(f"no {table} record {record_id}")
+        return 200, record._asdict()
+
+    async def create(self, request, table):
+        body = _body(request, (dict, list))
+        if isinstance(body, list):
+            count = await self.pool.write(lambda repos: self._repo(repos, table).add_many(body))
+            return 201, {"count": count}
+        record_id = await self.pool.write(lambda repos: self._repo(repos, table).add(**body))
+        return 201, {"id": record_id}
+
+    async def update(self, request, table, record_id):
+        body = _body(request, dict)
+        count = await self.pool.write(lambda repos: self._repo(repos, table).update(int(record_id), **body))
+        if not count:
+            raise NotFound(f"no {table} record {record_id}")
+        return 200, {"count": count}
+
+    async def update_many(self, request, table):
+        body = _body(request, list)
+        try:
+            updates = [(values["id"], {column: value for column, value in values.items() if column != "id"}) for values in body]
+        except (TypeError, KeyError):
+            raise HttpError(400, "expected an array of objects with an id")
+        return 200, {"count": await self.pool.write(lambda repos: self._repo(repos, table).update_many(updates))}
+
+    async def delete(self, request, table, record_id):
+        count = await self.pool.write(lambda repos: self._repo(repos, table).delete(int(record_id)))
+        if not count:
+            raise NotFound(f"no {table} record {record_id}")
+        return 200, {"count": count}
+
+    async def delete_many(self, request, table):
+        ids = _body(request, dict).get("ids")
+        if not isinstance(ids, list):
+            raise HttpError(400, 'expected {"ids": [...]}')
+        return 200, {"count": await self.pool.write(lambda repos: self._repo(repos, table).delete_many(ids))}
+
+    async def query(self, request):
+        body = _body(request, dict)
+        sql, params = body.get("sql"), body.get("params") or []
+        if not isinstance(sql, str) or not isinstance(params, (list, dict)):
+            raise HttpError(400, 'expected {"sql": "...", "params": [...]}')
+
+        # The reader stays ours until the last row is sent
+        reader = await self.pool.acquire()
+        def execute(repos):
+            cursor = repos.conn.execute(sql, params)
+            return cursor, [column[0] for column in cursor.description or ()]
+        try:
+            cursor, columns = await reader.run(execute)
+        except BaseException:
+            self.pool.release(reader)
+            raise
+
+        async def lines():
+            try:
+                yield {"columns": columns}
+                count = 0
+                while True:
+                    try:
+                        rows = await reader.run(lambda repos: cursor.fetchmany(QUERY_BATCH))
+                    except sqlite3.Error as e:
+                        yield _error_response(e)[1]
+                        return
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield {"rows": rows}
+                yield {"done": True, "count": count}
+            finally:
+                await reader.run(lambda repos: cursor.close())
+                self.pool.release(reader)
+        return 200, lines()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the clinic database to several front desk PCs over HTTP/JSON.")
+    parser.add_argument("--host", default=HOST, help=f"address to listen on (default {HOST}, this machine only)")
+    parser.add_argument("--port", type=int, default=PORT, help=f"(default {PORT})")
+    parser.add_argument("--readers", type=int, default=READERS, help=f"read connections (default {READERS})")
+    parser.add_argument("--token", help="shared secret clients have to send (their server_token setting)")
+    database.add_profile_arguments(parser)
+    scheduling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        profile = database.profile_from_args(args)
+        limits = scheduling.settings_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if profile["server"]:
+        parser.error("the server opens the database file itself, --server is for clients")
+
+    async def serve():
+        server = await ClinicServer(profile, args.readers, args.token, limits).start(args.host, args.port)
+        print(f"Serving {profile['path']} on http://{args.host}:{server.port}", file=sys.stderr)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
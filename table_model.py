@@ -0,0 +1,576 @@
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+
+import database
+from db_worker import fetch_all
+
+
+CHUNK_SIZE = 256        # rows pulled from sqlite per fetchMore call
+MAX_CACHED_CHUNKS = 8   # chunks kept in memory, the rest are re-read on demand
+PAGE_SIZE = 1000        # rows per page of the page controls
+MAX_PATCHED_ROWS = 100  # more changed rows than this and the page is read again in one go
+
+NUMERIC_TYPES = ("INTEGER", "REAL")
+
+
+class SqlTableModel(QAbstractTableModel):
+    """Read-only model over one clinic table that loads rows lazily.
+
+    The table is shown one page at a time, sorted and filtered by sqlite.
+    Pages are addressed by keyset: a page starts at the (sort column, id)
+    key of its first row, so every page query is an indexed
+    `WHERE (sort_col, id) >= (?, ?) ORDER BY ... LIMIT ?` and page 500
+    costs the same as page 1. Rows with a NULL sort value come first, as
+    sqlite sorts them (_key_clauses).
+
+    Within a page rows are fetched in chunks of CHUNK_SIZE as the view
+    scrolls (canFetchMore/fetchMore). Only the first key of every chunk
+    is kept for good; the rows themselves live in a small LRU and chunks
+    that fall out of it are read back from their key when needed again.
+
+    Every query runs on the database worker thread. Results land back on
+    the GUI thread and are dropped if the model was reset in the meantime.
+
+    apply_changes() patches single rows in place after an edit, so one
+    changed record costs one `WHERE id IN (...)` query instead of a reload.
+
+    Tables with a display view (database.DISPLAY_VIEWS) are read through it,
+    so every row comes with the names behind its ids in the same query. A
+    write to a joined table patches the loaded rows showing it
+    (apply_lookup_changes).
+
+    set_source() switches to another view with the same columns, such as
+    one that also reads archived rows (archive.ALL_VIEW).
+    """
+
+    load_failed = pyqtSignal(str)
+    # page number, page count, total rows matching the filters
+    page_changed = pyqtSignal(int, int, int)
+    columns_loaded = pyqtSignal(list)
+
+    def __init__(self, db, table_name, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table_name = table_name
+        # The view rows are read from, and joined table -> column holding its id
+        self.source, self.lookups = database.DISPLAY_VIEWS.get(table_name, (table_name, {}))
+        self.count_source = table_name  # what unjoined counts read, see set_source
+        self.columns = []
+        self.table_columns = []         # the columns of the table itself, the rest come from joins
+        self.column_types = {}
+        self.sort_column = "id"
+        self.sort_order = Qt.AscendingOrder
+        self.filters = {}               # column -> filter text
+        self.page_number = 1
+        self.total_rows = 0
+        self._page_start = None         # key of the first row on the page, None for page 1
+        self._chunk_keys = []           # first key of every fetched chunk
+        self._chunk_sizes = []          # rows in every fetched chunk
+        self._chunks = OrderedDict()    # chunk index -> list of rows (LRU order)
+        self._loading_chunks = set()
+        self._row_count = 0
+        self._last_key = None
+        self._exhausted = True
+        self._at_end = False            # the page runs to the end of the table
+        self._fetch_pending = False
+        self._generation = 0            # bumped on every reset to drop stale results
+
+    # (Re)load the current page, also used for the first load
+    def refresh(self):
+        source_info = self._fetch(f"PRAGMA table_info({self.source})")
+        table_info = self._fetch(f"PRAGMA table_info({self.table_name})")
+        self.db.submit(
+            lambda conn: (source_info(conn), table_info(conn)),
+            self._on_table_info,
+            self._on_error
+        )
+
+    def _on_table_info(self, info):
+        source_info, table_info = info
+        self.table_columns = [column[1] for column in table_info]
+        columns = [column[1] for column in source_info]
+        self.column_types = {column[1]: column[2].upper() for column in source_info}
+        if self.sort_column not in columns:
+            self.sort_column = "id"
+        if columns != self.columns:
+            self.columns = columns
+            self.columns_loaded.emit(columns)
+        self._reload(recount=True)
+
+    def _on_error(self, error):
+        self.load_failed.emit(str(error))
+
+    def page_count(self):
+        return max(1, -(-self.total_rows // PAGE_SIZE))
+
+    ##### Query building #########
+    # Reads of this table go through the worker's cache; it is invalidated
+    # whenever the table, or one joined into its view, is written
+    def _fetch(self, sql, params=()):
+        return fetch_all(sql, params, self.db.cache, (self.table_name, *self.lookups))
+
+    # Counts skip the joins unless a filter is on a joined column
+    def _count(self):
+        where, params = self._where()
+        joined = any(column not in self.table_columns for column in self.filters)
+        return self._fetch(f"SELECT COUNT(*) FROM {self.source if joined else self.count_source}{where}", params)
+
+    def _key_columns(self):
+        return ["id"] if self.sort_column == "id" else [self.sort_column, "id"]
+
+    def _row_key(self, row):
+        return tuple(row[self.columns.index(column)] for column in self._key_columns())
+
+    # Keys that compare in Python the way sqlite orders them
+    def _sort_key(self, key):
+        return tuple(_order_value(value) for value in key)
+
+    def _sorts_before(self, key, other):
+        if self.sort_order == Qt.DescendingOrder:
+            return self._sort_key(key) > self._sort_key(other)
+        return self._sort_key(key) < self._sort_key(other)
+
+    def _where(self, clause=None, clause_params=()):
+        clauses, params = [], []
+        for column, text in self.filters.items():
+            if self.column_types.get(column) in NUMERIC_TYPES and _is_number(text):
+                clauses.append(f"{column} = ?")
+                params.append(float(text))
+            else:
+                escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                params.append(f"%{escaped}%")
+        if clause is not None:
+            clauses.append(clause)
+            params.extend(clause_params)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    # Where the rows after (>, >=) or before (<, <=) `key` are, as
+    # (clause, params) in the order the query reads them. A row value
+    # comparison is NULL when either side holds NULL, so rows with a NULL
+    # sort value, which sqlite orders first, get a clause of their own;
+    # every clause is still an index range.
+    def _key_clauses(self, operator, key):
+        if key is None:
+            return [(None, ())]
+        # Operators are written for ascending order, flip them when sorting descending
+        if self.sort_order == Qt.DescendingOrder:
+            operator = {">": "<", ">=": "<=", "<": ">", "<=": ">="}[operator]
+        if self.sort_column == "id":
+            return [(f"id {operator} ?", key)]
+        column = self.sort_column
+        value, row_id = key
+        nulls = (f"{column} IS NULL AND id {operator} ?", (row_id,))
+        if operator in (">", ">="):
+            # Ascending reads: NULLs first, then everything else
+            if value is None:
+                return [nulls, (f"{column} IS NOT NULL", ())]
+            return [(f"({column}, id) {operator} (?, ?)", key)]
+        # Descending reads: NULLs last
+        if value is None:
+            return [nulls]
+        return [(f"({column}, id) {operator} (?, ?)", key), (f"{column} IS NULL", ())]
+
+    def _select(self, columns, operator, key, limit, reverse=False):
+        descending = (self.sort_order == Qt.DescendingOrder) != reverse
+        direction = "DESC" if descending else "ASC"
+        order_by = ", ".join(f"{column} {direction}" for column in self._key_columns())
+        fetches = []
+        for clause, clause_params in self._key_clauses(operator, key):
+            where, params = self._where(clause, clause_params)
+            fetches.append(self._fetch(
+                f"SELECT {columns} FROM {self.source}{where} ORDER BY {order_by} LIMIT ?",
+                params + [limit]
+            ))
+
+        def job(conn):
+            rows = []
+            for fetch in fetches:
+                rows.extend(fetch(conn)[:limit - len(rows)])
+                if len(rows) >= limit:
+                    break
+            return rows
+        return job
+
+    def _select_keys(self, operator, key, limit, reverse=False):
+        return self._select(", ".join(self._key_columns()), operator, key, limit, reverse)
+
+    # Queue a query whose result only matters if the model wasn't reset meanwhile
+    def _submit(self, job, handler, error_handler=None):
+        generation = self._generation
+
+        def on_result(result):
+            if generation == self._generation:
+                handler(result)
+
+        def on_error(error):
+            if generation == self._generation:
+                if error_handler is not None:
+                    error_handler()
+                self.load_failed.emit(str(error))
+
+        self.db.submit(job, on_result, on_error)
+
+    ##### Pages #########
+    def _reload(self, recount=False):
+        self._generation += 1
+        self.beginResetModel()
+        self._chunk_keys = []
+        self._chunk_sizes = []
+        self._chunks.clear()
+        self._loading_chunks.clear()
+        self._row_count = 0
+        self._last_key = None
+        self._exhausted = False
+        self._at_end = False
+        self._fetch_pending = False
+        self.endResetModel()
+
+        if recount:
+            self._submit(self._count(), self._on_count)
+        else:
+            self.page_changed.emit(self.page_number, self.page_count(), self.total_rows)
+        self.fetchMore(QModelIndex())
+
+    def _on_count(self, rows):
+        self.total_rows = rows[0][0]
+        if self.page_number > self.page_count():
+            # Rows went away under the current page, start over
+            self.page_number = 1
+            self._page_start = None
+            self._reload()
+        else:
+            self.page_changed.emit(self.page_number, self.page_count(), self.total_rows)
+
+    def _go_to_page(self, page_number, page_start):
+        self.page_number = page_number
+        self._page_start = page_start
+        self._reload()
+
+    def first_page(self):
+        self._go_to_page(1, None)
+
+    def next_page(self):
+        if self.page_number >= self.page_count():
+            return
+
+        def on_keys(keys):
+            if len(keys) > PAGE_SIZE:
+                self._go_to_page(self.page_number + 1, tuple(keys[-1]))
+
+        # Walk this page's keys (key columns only, straight off the index)
+        # to find the first key of the next one
+        self._submit(self._select_keys(">=", self._page_start, PAGE_SIZE + 1), on_keys)
+
+    def previous_page(self):
+        if self.page_number <= 2:
+            self.first_page()
+            return
+
+        def on_keys(keys):
+            if len(keys) < PAGE_SIZE:
+                self.first_page()
+            else:
+                self._go_to_page(self.page_number - 1, tuple(keys[-1]))
+
+        self._submit(self._select_keys("<", self._page_start, PAGE_SIZE, reverse=True), on_keys)
+
+    def last_page(self):
+        if self.page_count() == 1:
+            self.first_page()
+            return
+
+        def on_keys(keys):
+            if keys:
+                self._go_to_page(self.page_count(), tuple(keys[-1]))
+
+        # Read the last page backwards from the end of the index
+        on_last_page = (self.total_rows - 1) % PAGE_SIZE + 1
+        self._submit(self._select_keys(None, None, on_last_page, reverse=True), on_keys)
+
+    # Read from `source` and count from `count_source` from now on, both
+    # default to the table's own (display view and table)
+    def set_source(self, source=None, count_source=None):
+        self.source = source or database.DISPLAY_VIEWS.get(self.table_name, (self.table_name, {}))[0]
+        self.count_source = count_source or self.table_name
+        self.page_number = 1
+        self._page_start = None
+        self.refresh()
+
+    def set_filters(self, filters):
+        self.filters = {column: text.strip() for column, text in filters.items() if text.strip()}
+        self.page_number = 1
+        self._page_start = None
+        self._reload(recount=True)
+
+    ##### Chunks #########
+    def _store_chunk(self, chunk_idx, rows):
+        self._chunks[chunk_idx] = rows
+        self._chunks.move_to_end(chunk_idx)
+        while len(self._chunks) > MAX_CACHED_CHUNKS:
+            self._chunks.popitem(last=False)
+
+    def _chunk(self, chunk_idx):
+        rows = self._chunks.get(chunk_idx)
+        if rows is not None:
+            self._chunks.move_to_end(chunk_idx)
+            return rows
+
+        # Evicted earlier, read it back from its first key and repaint when it's here
+        if chunk_idx not in self._loading_chunks:
+            self._loading_chunks.add(chunk_idx)
+            self._submit(
+                self._select("*", ">=", self._chunk_keys[chunk_idx], self._chunk_sizes[chunk_idx]),
+                lambda rows: self._on_chunk_reloaded(chunk_idx, rows),
+                lambda: self._loading_chunks.discard(chunk_idx)
+            )
+        return None
+
+    def _on_chunk_reloaded(self, chunk_idx, rows):
+        self._loading_chunks.discard(chunk_idx)
+        self._store_chunk(chunk_idx, rows)
+        first = self._chunk_start(chunk_idx)
+        last = first + self._chunk_sizes[chunk_idx] - 1
+        self.dataChanged.emit(self.index(first, 0), self.index(last, len(self.columns) - 1))
+
+    # Chunks start out CHUNK_SIZE rows long but shrink and grow with
+    # apply_changes, so rows are found by walking the (few) chunk sizes
+    def _chunk_start(self, chunk_idx):
+        return sum(self._chunk_sizes[:chunk_idx])
+
+    def _locate(self, row):
+        for chunk_idx, size in enumerate(self._chunk_sizes):
+            if row < size:
+                return chunk_idx, row
+            row -= size
+        return None, None
+
+    # Row tuple, or None while its chunk is still being read back
+    def row_data(self, row):
+        chunk_idx, offset = self._locate(row)
+        if chunk_idx is None:
+            return None
+        rows = self._chunk(chunk_idx)
+        if rows is None or offset >= len(rows):
+            return None  # not loaded yet, or deleted since the chunk was first read
+        return rows[offset]
+
+    def row_ids(self, rows):
+        """Ids of the given rows, skipping any that aren't loaded."""
+        id_index = self.columns.index("id")
+        found = (self.row_data(row) for row in sorted(set(rows)))
+        return [row[id_index] for row in found if row is not None]
+
+    ##### Row changes #########
+    def apply_changes(self, changes):
+        """Bring changed rows up to date without reloading the page.
+
+        `changes` maps row ids to "insert", "update" or "delete". Changed rows
+        on the page are refreshed, or removed when they are gone or no longer
+        match the filters; new rows (and rows whose sort key moved) are slotted
+        in when they fall inside the page. Batches of more than
+        MAX_PATCHED_ROWS changes reload the page instead.
+        """
+        if not self.columns or not changes:
+            return
+        if len(changes) > MAX_PATCHED_ROWS:
+            # One reset beats hundreds of row removals, each relaying out the view
+            self._reload(recount=True)
+            return
+        row_ids = list(changes)
+        where, params = self._where()
+        where = f"{where} AND" if where else " WHERE"
+        placeholders = ", ".join("?" for _ in row_ids)
+        self._submit(
+            fetch_all(f"SELECT * FROM {self.source}{where} id IN ({placeholders})", params + row_ids),
+            lambda rows: self._on_changed_rows(changes, rows)
+        )
+
+    def apply_lookup_changes(self, table_name, changes):
+        """Re-read the loaded rows that show a changed record of a joined
+        table, e.g. the appointments of a pet that was renamed. Chunks that
+        aren't in memory are read fresh anyway when they're needed again."""
+        column = self.lookups.get(table_name)
+        if column is None or column not in self.columns or not changes:
+            return
+        id_index, lookup_index = self.columns.index("id"), self.columns.index(column)
+        affected = {
+            row[id_index]: "update"
+            for chunk in self._chunks.values() for row in chunk
+            if row[lookup_index] in changes
+        }
+        self.apply_changes(affected)
+
+    def _on_changed_rows(self, changes, rows):
+        if len(self._chunks) < len(self._chunk_keys):
+            # Part of the page was evicted and can't be patched, read it again
+            self._reload(recount=True)
+            return
+
+        id_index = self.columns.index("id")
+        fresh = {row[id_index]: row for row in rows}
+        placed = set()
+
+        row_idx = 0
+        for chunk_idx in range(len(self._chunk_keys)):
+            chunk = self._chunks[chunk_idx]
+            offset = 0
+            while offset < len(chunk):
+                row_id = chunk[offset][id_index]
+                if row_id in changes:
+                    row = fresh.get(row_id)
+                    if row is not None and self._row_key(row) == self._row_key(chunk[offset]):
+                        chunk[offset] = row
+                        placed.add(row_id)
+                        self.dataChanged.emit(self.index(row_idx, 0), self.index(row_idx, len(self.columns) - 1))
+                    else:
+                        # Gone, filtered out, or moved: take it out here
+                        self.beginRemoveRows(QModelIndex(), row_idx, row_idx)
+                        del chunk[offset]
+                        self._chunk_sizes[chunk_idx] -= 1
+                        self._row_count -= 1
+                        self.endRemoveRows()
+                        continue
+                offset += 1
+                row_idx += 1
+
+        for row_id, row in fresh.items():
+            if row_id not in placed and self._belongs_on_page(self._row_key(row)):
+                self._insert_row(row)
+
+        if any(op != "update" for op in changes.values()):
+            self._submit(self._count(), self._on_count)
+
+    # Between the first key of the page and the last row read so far, or
+    # anywhere past the start when the page runs to the end of the table
+    def _belongs_on_page(self, key):
+        if self._page_start is not None and self._sorts_before(key, self._page_start):
+            return False
+        if self._at_end:
+            return True
+        return self._last_key is not None and not self._sorts_before(self._last_key, key)
+
+    def _insert_row(self, row):
+        key = self._row_key(row)
+        if not self._chunk_keys:
+            self._chunk_keys.append(key)
+            self._chunk_sizes.append(0)
+            self._store_chunk(0, [])
+
+        # Before the first row that sorts after it, or at the very end
+        row_idx = 0
+        position = None
+        for chunk_idx in range(len(self._chunk_keys)):
+            for offset, other in enumerate(self._chunks[chunk_idx]):
+                if self._sorts_before(key, self._row_key(other)):
+                    position = chunk_idx, offset
+                    break
+                row_idx += 1
+            if position is not None:
+                break
+        if position is None:
+            position = len(self._chunk_keys) - 1, self._chunk_sizes[-1]
+            self._last_key = key
+
+        chunk_idx, offset = position
+        self.beginInsertRows(QModelIndex(), row_idx, row_idx)
+        self._chunks[chunk_idx].insert(offset, row)
+        self._chunk_sizes[chunk_idx] += 1
+        self._row_count += 1
+        if offset == 0:
+            self._chunk_keys[chunk_idx] = key
+        self.endInsertRows()
+
+    ##### QAbstractTableModel interface #########
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        # Extra trailing column holds the Update/Delete buttons
+        if parent.isValid() or not self.columns:
+            return 0
+        return len(self.columns) + 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        if index.column() >= len(self.columns):
+            return None
+        row = self.row_data(index.row())
+        if row is None:
+            return None
+        return str(row[index.column()])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section] if section < len(self.columns) else "Actions"
+        return (self.page_number - 1) * PAGE_SIZE + section + 1
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column >= len(self.columns):
+            return
+        self.sort_column = self.columns[column]
+        self.sort_order = order
+        self.first_page()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted or self._fetch_pending or not self.columns:
+            return
+        limit = min(CHUNK_SIZE, PAGE_SIZE - self._row_count)
+        if limit <= 0:
+            self._exhausted = True  # filled up by apply_changes
+            return
+        if self._last_key is None:
+            job = self._select("*", ">=", self._page_start, limit)
+        else:
+            job = self._select("*", ">", self._last_key, limit)
+
+        def on_error():
+            self._exhausted = True
+            self._fetch_pending = False
+
+        self._fetch_pending = True
+        self._submit(job, lambda rows: self._on_rows_fetched(rows, limit), on_error)
+
+    def _on_rows_fetched(self, rows, limit):
+        self._fetch_pending = False
+        if len(rows) < limit:
+            self._exhausted = self._at_end = True
+        elif self._row_count + len(rows) >= PAGE_SIZE:
+            self._exhausted = True
+        if not rows:
+            return
+
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + len(rows) - 1)
+        self._chunk_keys.append(self._row_key(rows[0]))
+        self._chunk_sizes.append(len(rows))
+        self._store_chunk(len(self._chunk_keys) - 1, rows)
+        self._row_count += len(rows)
+        self._last_key = self._row_key(rows[-1])
+        self.endInsertRows()
+
+
+# sqlite sorts NULLs first, then numbers, then text, then blobs
+def _order_value(value):
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,73 @@
+import pytest
+
+import archive
+import database
+import reports
+from repositories import Repositories
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    profile = dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db"))
+    repos = Repositories.open(profile)
+    owner = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+    dog = repos.pets.add(name="Rex", age=3, species="dog", breed="collie", owner_id=owner)
+    cat = repos.pets.add(name="Tom", age=5, species="cat", breed="tabby", owner_id=owner)
+    service = repos.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    for day in range(1, 29):
+        for pet, time in ((dog, "09:00"), (cat, "10:00")):
+            repos.appointments.add(date=f"2023-{day % 12 + 1:02}-{day:02}", time=time, pet_id=pet, service_id=service)
+    repos.appointments.add(date="2024-06-01", time="09:00", pet_id=dog, service_id=service)
+    yield profile, repos
+    repos.close()
+
+
+def test_archive_moves_rows_and_keeps_reports(clinic, tmp_path):
+    profile, repos = clinic
+    conn = repos.conn
+    before = reports.summary(conn, None, None)
+    everything = conn.execute("SELECT * FROM appointments_view ORDER BY id").fetchall()
+    path = str(tmp_path / "clinic_archive.db")
+    batches = []
+
+    stats = archive.archive_appointments(conn, path, "2024-01-01", batch_size=10, progress=batches.append)
+
+    assert (stats["total"], stats["archived"], stats["cancelled"]) == (56, 56, False)
+    assert [batch["archived"] for batch in batches] == [10, 20, 30, 40, 50, 56]
+    assert conn.execute("SELECT date FROM main.appointments").fetchall() == [("2024-06-01",)]
+    assert conn.execute(f"SELECT COUNT(*) FROM {archive.SCHEMA}.appointments").fetchone() == (56,)
+    assert conn.execute(f"SELECT * FROM {archive.ALL_VIEW} ORDER BY id").fetchall() == everything
+    assert reports.summary(conn, None, None) == before
+
+    # Another connection sees them again once it attaches the archive
+    other = database.connect(profile)
+    assert other.execute("SELECT COUNT(*) FROM appointments").fetchone() == (1,)
+    archive.attach(other, path)
+    archive.attach(other, path)   # already attached, nothing to do
+    assert other.execute(f"SELECT COUNT(*) FROM {archive.ALL_TABLE}").fetchone() == (57,)
+    cursor = other.execute(f"SELECT * FROM {archive.ALL_VIEW} WHERE pet_name = 'Tom' ORDER BY id")
+    pet_name = [column[0] for column in cursor.description].index("pet_name")
+    assert cursor.fetchall() == [row for row in everything if row[pet_name] == "Tom"]
+    other.close()
+
+
+def test_archive_again_and_stop(clinic, tmp_path):
+    profile, repos = clinic
+    conn = repos.conn
+    path = str(tmp_path / "clinic_archive.db")
+    stats = archive.archive_appointments(conn, path, "2023-07-01", should_stop=lambda: False)
+    assert stats["archived"] == conn.execute(f"SELECT COUNT(*) FROM {archive.SCHEMA}.appointments").fetchone()[0]
+
+    calls = []
+    stats = archive.archive_appointments(conn, path, "2024-01-01", batch_size=5,
+                                         should_stop=lambda: calls.append(1) or len(calls) > 2)
+    assert stats["cancelled"] and stats["archived"] == 10
+    archive.archive_appointments(conn, path, "2024-01-01")
+    assert conn.execute(f"SELECT COUNT(*) FROM {archive.ALL_TABLE}").fetchone() == (57,)
+    assert conn.execute("SELECT COUNT(*) FROM main.appointments").fetchone() == (1,)
+
+    expected = {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in database.REPORT_TABLES}
+    conn.execute("BEGIN")
+    database.rebuild_reports(conn)
+    assert {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in database.REPORT_TABLES} == expected
+    conn.rollback()
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+import pytest
+
+import backup
+import database
+from repositories import Repositories
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    profile = dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db"))
+    repos = Repositories.open(profile)
+    owner = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+    service = repos.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    for number in range(200):
+        pet = repos.pets.add(name=f"Pet {number}", age=3, species="dog", breed="collie " * 20, owner_id=owner)
+        repos.appointments.add(date=f"2024-{number // 28 + 1:02}-{number % 28 + 1:02}", time="09:00",
+                               pet_id=pet, service_id=service)
+    yield repos.conn, tmp_path / "backups"
+    repos.close()
+
+
+def test_backup_is_a_sound_copy(clinic):
+    conn, directory = clinic
+    steps = []
+    stats = backup.backup(conn, str(directory), pages=4, sleep=0, progress=steps.append)
+
+    assert not stats["cancelled"] and stats["done"] == stats["pages"] > 4
+    assert len(steps) > 1 and steps[-1]["done"] == stats["pages"]
+    assert backup.snapshots(str(directory), "clinic") == [stats["path"]]
+    assert os.listdir(directory) == [os.path.basename(stats["path"])]   # no -wal or .partial left behind
+    assert backup.verify(stats["path"]) == ["ok"]
+
+    copy = sqlite3.connect(f"file:{stats['path']}?mode=ro", uri=True)
+    for table in ("owners", "pets", "services", "appointments"):
+        query = f"SELECT * FROM {table} ORDER BY id"
+        assert copy.execute(query).fetchall() == conn.execute(query).fetchall()
+    assert copy.execute("PRAGMA user_version").fetchone() == conn.execute("PRAGMA user_version").fetchone()
+    copy.close()
+
+
+def test_backup_keeps_the_newest(clinic):
+    conn, directory = clinic
+    directory.mkdir()
+    old = [str(directory / f"clinic-2024010{day}-120000.db") for day in range(1, 6)]
+    for path in old:
+        open(path, "w").close()
+    (directory / "other-20240101-120000.db").touch()   # another database's snapshot
+
+    stats = backup.backup(conn, str(directory), keep=3)
+
+    assert stats["removed"] == old[:3]
+    assert backup.snapshots(str(directory), "clinic") == old[3:] + [stats["path"]]
+    assert (directory / "other-20240101-120000.db").exists()
+    assert backup.prune(str(directory), "clinic", keep=1) == old[3:]
+    assert backup.last_backup(str(directory), "clinic") is not None
+
+
+def test_backup_cancelled(clinic):
+    conn, directory = clinic
+    stats = backup.backup(conn, str(directory), pages=4, sleep=0, should_stop=lambda: True)
+    assert stats["cancelled"]
+    assert os.listdir(directory) == []
@@ -0,0 +1,81 @@
+import pytest
+
+import database
+from repositories import Repositories
+
+
+@pytest.fixture
+def repos(tmp_path):
+    repos = Repositories.open(dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db")))
+    yield repos
+    repos.close()
+
+
+def add_owner(repos, number):
+    return repos.owners.add(name=f"Owner {number}", contact=f"555-{number:04}", email=f"o{number}@example.com",
+                            address="1 Elm St")
+
+
+def test_changes_since_keeps_the_last_op_per_row(repos):
+    conn = repos.conn
+    seq = database.last_change(conn)
+    assert database.changes_since(conn, seq, 10) == ({}, seq)
+
+    owner = add_owner(repos, 1)
+    other = add_owner(repos, 2)
+    pet = repos.pets.add(name="Rex", age=3, species="dog", breed="collie", owner_id=other)
+    service = repos.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    appointment = repos.appointments.add(date="2024-03-04", time="09:00", pet_id=pet, service_id=service)
+    repos.owners.update(owner, address="2 Oak St")
+    repos.appointments.delete(appointment)
+    repos.owners.delete(other)      # takes the pet with it
+
+    changes, last = database.changes_since(conn, seq, 10)
+    assert last == database.last_change(conn)
+    assert changes == {
+        "owners": {owner: "update", other: "delete"},
+        "pets": {pet: "delete"},
+        "services": {service: "insert"},
+        "appointments": {appointment: "delete"},
+    }
+    assert database.changes_since(conn, last, 10) == ({}, last)
+
+    # A new id reads as the old row gone and the new one there
+    conn.execute("UPDATE owners SET id = 100 WHERE id = ?", (owner,))
+    conn.commit()
+    assert database.changes_since(conn, last, 10)[0] == {"owners": {owner: "delete", 100: "update"}}
+
+
+def test_changes_since_overflow(repos):
+    conn = repos.conn
+    seq = database.last_change(conn)
+    for number in range(3):
+        add_owner(repos, number)
+    last = database.last_change(conn)
+
+    assert database.changes_since(conn, seq, 3)[0] == {"owners": {1: "insert", 2: "insert", 3: "insert"}}
+    # One more than the limit, reload everything
+    assert database.changes_since(conn, seq, 2) == (None, last)
+    # Part of it pruned away, likewise
+    conn.execute("DELETE FROM change_log WHERE seq <= ?", (seq + 1,))
+    conn.commit()
+    assert database.changes_since(conn, seq, 10) == (None, last)
+    assert database.changes_since(conn, seq + 1, 10)[0] == {"owners": {2: "insert", 3: "insert"}}
+
+
+def test_prune_change_log(repos):
+    conn = repos.conn
+    first = database.last_change(conn) + 1
+    for number in range(9):
+        add_owner(repos, number)
+
+    database.prune_change_log(conn, keep=5)     # under twice what is kept, left alone
+    assert conn.execute("SELECT MIN(seq), COUNT(*) FROM change_log").fetchone() == (first, 9)
+
+    add_owner(repos, 9)
+    add_owner(repos, 10)
+    last = database.last_change(conn)
+    database.prune_change_log(conn, keep=5)
+    assert conn.execute("SELECT MIN(seq), MAX(seq), COUNT(*) FROM change_log").fetchone() == (last - 4, last, 5)
+    assert database.changes_since(conn, last - 5, 10)[0] == {"owners": {owner: "insert" for owner in range(7, 12)}}
+    assert database.changes_since(conn, first, 10) == (None, last)
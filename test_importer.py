@@ -0,0 +1,97 @@
+import csv
+import json
+
+import pytest
+
+import database
+import importer
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = database.connect(dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db")))
+    database.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write((record if isinstance(record, str) else json.dumps(record)) + "\n")
+    return str(path)
+
+
+def read_rejects(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def owner(number, **values):
+    return dict({"id": number, "name": f"Owner {number}", "contact": f"555-{number:04}",
+                 "email": f"owner{number}@example.com", "address": f"{number} Elm St"}, **values)
+
+
+def test_batches(conn, tmp_path):
+    path = write_csv(tmp_path / "owners.csv", [owner(number) for number in range(1, 6)])
+    progress = []
+    stats = importer.import_file(conn, "owners", path, batch_size=2, progress=progress.append)
+
+    assert stats == {"table": "owners", "read": 5, "imported": 5, "rejected": 0, "cancelled": False}
+    assert [entry["imported"] for entry in progress] == [2, 4, 5]
+    assert conn.execute("SELECT id, contact FROM owners ORDER BY id").fetchall() == [
+        (number, f"555-{number:04}") for number in range(1, 6)
+    ]
+    assert not (tmp_path / "owners.csv.rejected.jsonl").exists()
+
+
+def test_missing_parents_are_rejected(conn, tmp_path):
+    importer.import_file(conn, "owners", write_csv(tmp_path / "owners.csv", [owner(1)]))
+    pets = [
+        {"name": "Rex", "age": 3, "species": "dog", "breed": "collie", "owner_id": 1},
+        {"name": "Tom", "age": 5, "species": "cat", "breed": "tabby", "owner_id": 2},
+        "{not json",
+        {"name": "Kit", "age": "young", "species": "cat", "breed": "tabby", "owner_id": 1},
+        {"name": "Bo", "age": 1, "species": "dog", "breed": "pug", "owner_id": 1},
+    ]
+    path = write_jsonl(tmp_path / "pets.jsonl", pets)
+    stats = importer.import_file(conn, "pets", path, batch_size=10)
+
+    assert (stats["imported"], stats["rejected"]) == (2, 3)
+    assert [row[0] for row in conn.execute("SELECT name FROM pets ORDER BY id")] == ["Rex", "Bo"]
+    rejects = sorted(read_rejects(path + ".rejected.jsonl"), key=lambda reject: reject["line"])
+    assert [reject["line"] for reject in rejects] == [2, 3, 4]
+    assert rejects[0]["error"] == "owner_id 2 does not exist in owners"
+    assert rejects[0]["record"]["name"] == "Tom"
+    assert rejects[1]["error"].startswith("invalid JSON")
+    assert rejects[2]["error"] == "age must be a whole number, got 'young'"
+
+
+def test_constraint_failure_goes_row_by_row(conn, tmp_path):
+    importer.import_file(conn, "owners", write_csv(tmp_path / "first.csv", [owner(1)]))
+    rows = [owner(2), owner(3, contact="555-0001"), owner(4), owner(5, email="owner4@example.com"), owner(6)]
+    path = write_csv(tmp_path / "owners.csv", rows)
+    stats = importer.import_file(conn, "owners", path, batch_size=10)
+
+    # The good rows of the failing batch still go in
+    assert (stats["imported"], stats["rejected"]) == (3, 2)
+    assert [row[0] for row in conn.execute("SELECT id FROM owners ORDER BY id")] == [1, 2, 4, 6]
+    rejects = read_rejects(path + ".rejected.jsonl")
+    assert [(reject["line"], reject["record"]["id"]) for reject in rejects] == [(3, "3"), (5, "5")]
+    assert all("UNIQUE constraint failed" in reject["error"] for reject in rejects)
+    assert not conn.in_transaction
+
+
+def test_no_rejects_file(conn, tmp_path):
+    path = write_jsonl(tmp_path / "services.jsonl", [{"service_name": "Checkup", "cost": "free"}])
+    stats = importer.import_file(conn, "services", path, rejects_path=None)
+    assert (stats["imported"], stats["rejected"]) == (0, 1)
+    assert not (tmp_path / "services.jsonl.rejected.jsonl").exists()
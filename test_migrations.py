@@ -0,0 +1,127 @@
+import sqlite3
+
+import pytest
+
+import database
+import search
+
+# The tables as the app created them before there were migrations
+BASELINE = """
+    CREATE TABLE pets(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        age INTEGER NOT NULL,
+        species TEXT NOT NULL,
+        breed TEXT NOT NULL,
+        owner_id INTEGER NOT NULL,
+        FOREIGN KEY(owner_id) REFERENCES owners(id)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+    );
+    CREATE TABLE owners(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        contact TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        address TEXT NOT NULL
+    );
+    CREATE TABLE appointments(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        time TEXT NOT NULL,
+        pet_id INTEGER NOT NULL,
+        service_id INTEGER NOT NULL,
+        FOREIGN KEY(pet_id) REFERENCES pets(id)
+        FOREIGN KEY(service_id) REFERENCES services(id)
+    );
+    CREATE TABLE services(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        service_name TEXT NOT NULL,
+        cost REAL NOT NULL
+    );
+"""
+
+OWNERS = [(1, "Ann Lee", "555-0100", "ann@example.com", "1 Elm St"), (2, "Bob Ray", "555-0101", "bob@example.com", "2 Oak St")]
+PETS = [(1, "Rex", 3, "dog", "collie", 1), (2, "Tom", 5, "cat", "tabby", 1), (3, "Kiwi", 1, "bird", "parrot", 2)]
+SERVICES = [(1, "Checkup", 20.0), (2, "Surgery", 150.0)]
+# As they were typed into the old form
+APPOINTMENTS = [
+    (1, "2024-03-04", "09:00", 1, 1),
+    (2, "04/03/2024", "2:30 PM", 2, 2),
+    (3, "2024/04/01", "10.15", 3, 1),
+    (4, "next tuesday", "noon", 1, 2),
+]
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = str(tmp_path / "clinic.db")
+    old = sqlite3.connect(path)
+    old.executescript(BASELINE)
+    old.executemany("INSERT INTO owners VALUES (?, ?, ?, ?, ?)", OWNERS)
+    old.executemany("INSERT INTO pets VALUES (?, ?, ?, ?, ?, ?)", PETS)
+    old.executemany("INSERT INTO services VALUES (?, ?, ?)", SERVICES)
+    old.executemany("INSERT INTO appointments VALUES (?, ?, ?, ?, ?)", APPOINTMENTS)
+    old.commit()
+    old.close()
+    conn = database.connect(dict(database.DEFAULT_PROFILE, path=path))
+    yield conn
+    conn.close()
+
+
+def dump(conn):
+    schema = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    tables = [row[1] for row in schema if row[0] == "table" and not row[1].startswith("sqlite_")]
+    return schema, {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall() for table in tables}
+
+
+def test_baseline_migrates_with_its_data(baseline):
+    conn = baseline
+    assert database.schema_version(conn) == 0
+    assert database.migrate(conn) == database.SCHEMA_VERSION
+    assert database.schema_version(conn) == database.SCHEMA_VERSION
+
+    assert conn.execute("SELECT * FROM owners ORDER BY id").fetchall() == OWNERS
+    assert conn.execute("SELECT * FROM pets ORDER BY id").fetchall() == PETS
+    assert conn.execute("SELECT id, service_name, cost, duration_minutes FROM services ORDER BY id").fetchall() == [
+        service + (30,) for service in SERVICES
+    ]
+    # Dates and times in the stored form, the unreadable one as it was
+    assert conn.execute("SELECT id, date, time, pet_id, service_id, price FROM appointments ORDER BY id").fetchall() == [
+        (1, "2024-03-04", "09:00", 1, 1, 20.0),
+        (2, "2024-03-04", "14:30", 2, 2, 150.0),
+        (3, "2024-04-01", "10:15", 3, 1, 20.0),
+        (4, "next tuesday", "noon", 1, 2, 150.0),
+    ]
+    assert conn.execute("SELECT id FROM appointments WHERE starts_at IS NULL").fetchall() == [(4,)]
+    assert conn.execute("SELECT id FROM appointment_intervals ORDER BY id").fetchall() == [(1,), (2,), (3,)]
+
+    # Indexes and rollups cover the rows that were already there
+    assert [result[:3] for result in search.search(conn, "kiw")] == [("pet", 3, "Kiwi")]
+    assert [result[:3] for result in search.search(conn, "ann")] == [("owner", 1, "Ann Lee")]
+    expected = {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in database.REPORT_TABLES}
+    conn.execute("BEGIN")
+    database.rebuild_reports(conn)
+    assert {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in database.REPORT_TABLES} == expected
+    conn.rollback()
+
+    assert conn.execute("PRAGMA integrity_check").fetchall() == [("ok",)]
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_migrate_again_changes_nothing(baseline):
+    conn = baseline
+    database.migrate(conn)
+    before = dump(conn)
+    changes = conn.total_changes
+    assert database.migrate(conn) == database.SCHEMA_VERSION
+    assert conn.total_changes == changes
+    assert dump(conn) == before
+
+
+def test_newer_database_is_refused(baseline):
+    conn = baseline
+    conn.execute(f"PRAGMA user_version = {database.SCHEMA_VERSION + 1}")
+    with pytest.raises(sqlite3.DatabaseError, match="newer"):
+        database.migrate(conn)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'change_log'").fetchone() == (0,)
@@ -0,0 +1,71 @@
+import gc
+
+import pytest
+
+import database
+import profiling
+
+
+@pytest.fixture
+def profiled(tmp_path):
+    profiler = profiling.QueryProfiler(slow_ms=float("inf"), log_path=None)
+    conn = database.connect(dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db")), profiler)
+    conn.execute("CREATE TABLE t(id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO t(name) VALUES (?)", [(str(number),) for number in range(10)])
+    profiler.reset()
+    yield profiler, conn
+    conn.close()
+
+
+def counts(profiler):
+    return {stats["sql"]: stats["count"] for stats in profiler.statements()}
+
+
+def test_statements_count_once_read(profiled):
+    profiler, conn = profiled
+    rows = conn.execute("SELECT name FROM t WHERE id > ?", (3,))
+    rows.fetchmany(2)
+    assert counts(profiler) == {}
+    rows.fetchall()
+    conn.execute("UPDATE t SET name = ? WHERE id = ?", ("x", 1))
+    for _ in conn.execute("SELECT id FROM t"):
+        pass
+    assert counts(profiler) == {"SELECT name FROM t WHERE id > ?": 1, "UPDATE t SET name = ? WHERE id = ?": 1,
+                                "SELECT id FROM t": 1}
+
+
+def test_dropped_cursor_counts_on_the_next_statement(profiled):
+    profiler, conn = profiled
+    assert conn.execute("SELECT name FROM t WHERE id = ?", (2,)).fetchone() == ("1",)
+    gc.collect()
+    assert counts(profiler) == {}   # nothing happens while the cursor is collected
+    conn.execute("SELECT COUNT(*) FROM t").fetchall()
+    assert counts(profiler) == {"SELECT name FROM t WHERE id = ?": 1, "SELECT COUNT(*) FROM t": 1}
+
+
+def test_interleaved_cursors_and_close(profiled):
+    profiler, conn = profiled
+    outer = conn.execute("SELECT id FROM t ORDER BY id")
+    for row in outer.fetchmany(3):
+        conn.execute("UPDATE t SET name = 'seen' WHERE id = ?", row)
+    # Still being read, so only the updates are in
+    assert counts(profiler) == {"UPDATE t SET name = 'seen' WHERE id = ?": 3}
+    unread = conn.execute("SELECT name FROM t")
+    outer.close()
+    assert counts(profiler)["SELECT id FROM t ORDER BY id"] == 1
+
+    conn.close()
+    assert counts(profiler)["SELECT name FROM t"] == 1
+    del unread      # and collecting its cursor later changes nothing
+    gc.collect()
+    assert counts(profiler)["SELECT name FROM t"] == 1
+
+
+def test_trigger_steps_go_to_their_statement(profiled):
+    profiler, conn = profiled
+    conn.execute("CREATE TABLE log(name TEXT)")
+    conn.execute("CREATE TRIGGER t_log AFTER UPDATE ON t BEGIN INSERT INTO log VALUES (new.name); END")
+    profiler.reset()
+    conn.execute("UPDATE t SET name = 'y'")
+    steps = {stats["sql"]: stats["steps"] for stats in profiler.statements()}
+    assert steps["UPDATE t SET name = 'y'"] > 10   # once per row at least
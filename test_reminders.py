@@ -0,0 +1,123 @@
+import datetime
+import threading
+
+import pytest
+
+import database
+import reminders
+import scheduling
+from repositories import Repositories
+from reminders import ReminderQueue, ReminderScheduler
+
+
+def minutes(text):
+    return scheduling.to_minutes(datetime.datetime.fromisoformat(text))
+
+
+class Backend:
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)   # appointment ids that fail once
+        self.lock = threading.Lock()
+
+    def send(self, reminder):
+        if reminder.appointment_id in self.fail:
+            self.fail.discard(reminder.appointment_id)
+            raise OSError("gateway down")
+        with self.lock:
+            self.sent.append(reminder)
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    profile = dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db"))
+    repos = Repositories.open(profile, limits=scheduling.load_settings(None, {"capacity": 100, "service_capacity": 0}))
+    owner = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+    repos.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    for number in range(40):
+        repos.pets.add(name=f"Pet {number}", age=3, species="dog", breed="collie", owner_id=owner)
+    yield profile, repos
+    repos.close()
+
+
+def test_queue_order_cancel_and_reschedule():
+    queue = ReminderQueue(lead=60)
+    queue.replace([(1, 500), (2, 300), (3, 400), (4, None), (5, 450)], until=1000)
+    assert len(queue) == 4 and queue.next_due() == 240
+
+    queue.update([(1, 350), (6, 900), (7, 1200)], deleted=[3])    # moved, new, past the window, cancelled
+    queue.update([(5, None)])                                       # its date can no longer be read
+    assert len(queue) == 3
+    assert queue.pop_due(239) == []
+    assert queue.pop_due(299) == [(2, 300), (1, 350)]
+    queue.update([(6, 320)])
+    # Due at 260 but already started by now: dropped without a reminder
+    assert queue.pop_due(330) == []
+    assert len(queue) == 0 and queue.next_due() is None
+
+    queue.extend([(7, 1200), (8, 1100)], until=2000)
+    assert queue.pop_due(1099) == [(8, 1100)]
+    assert queue.pop_due(1199) == [(7, 1200)]
+
+
+def test_scheduler_follows_changes(clinic):
+    profile, repos = clinic
+    first = repos.appointments.add(date="2024-03-04", time="10:00", pet_id=1, service_id=1)
+    second = repos.appointments.add(date="2024-03-04", time="12:00", pet_id=2, service_id=1)
+    third = repos.appointments.add(date="2024-03-05", time="09:00", pet_id=3, service_id=1)
+    backend = Backend()
+    scheduler = ReminderScheduler(backend, lead_hours=24)
+    last_seq = database.last_change(repos.conn)
+
+    stats = scheduler.start(repos.conn, minutes("2024-03-03 08:00"))
+    assert (stats["queued"], stats["sent"], stats["wake_at"]) == (0, 0, minutes("2024-03-03 10:00"))
+
+    repos.appointments.update(first, time="11:00")    # rescheduled
+    repos.appointments.delete(second)                 # cancelled
+    changes, last_seq = database.changes_since(repos.conn, last_seq, reminders.MAX_ROW_CHANGES)
+    scheduler.changes(repos.conn, changes["appointments"], minutes("2024-03-03 08:30"))
+
+    stats = scheduler.run(repos.conn, minutes("2024-03-03 12:00"))
+    assert (stats["queued"], stats["sent"]) == (1, 1)
+    assert [(r.appointment_id, r.starts_at) for r in backend.sent] == [(first, minutes("2024-03-04 11:00"))]
+    assert backend.sent[0].email == "ann@example.com" and "Pet 0" in backend.sent[0].message
+
+    stats = scheduler.run(repos.conn, minutes("2024-03-04 09:00"))
+    assert [r.appointment_id for r in backend.sent] == [first, third]
+    # Run again, nothing goes out twice
+    assert scheduler.start(repos.conn, minutes("2024-03-04 09:00"))["sent"] == 0
+
+
+def test_deliver_sends_each_reminder_once(clinic):
+    profile, repos = clinic
+    for number in range(40):
+        repos.appointments.add(date="2024-03-04", time=f"{8 + number // 4:02}:{number % 4 * 15:02}",
+                               pet_id=number + 1, service_id=1)
+    now = minutes("2024-03-03 08:00")
+    due = repos.conn.execute("SELECT id, starts_at FROM appointments").fetchall()
+    assert reminders.queue(repos.conn, due, now) == 40
+    assert reminders.queue(repos.conn, due, now) == 0    # already in the outbox
+
+    # Two schedulers on the same database, delivering small batches at once
+    backend = Backend(fail={5})
+    start = threading.Barrier(2)
+
+    def deliver_all():
+        conn = database.connect(profile)
+        start.wait()
+        while reminders.deliver(conn, backend, limit=3) != (0, 0):
+            pass
+        conn.close()
+
+    threads = [threading.Thread(target=deliver_all) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sent = sorted(reminder.appointment_id for reminder in backend.sent)
+    assert sent == [row_id for row_id, _ in sorted(due)]
+    assert repos.conn.execute("SELECT attempts, error FROM reminder_outbox WHERE appointment_id = 5").fetchone() == (
+        1, "gateway down"
+    )
+    assert repos.conn.execute("SELECT COUNT(*) FROM reminder_outbox WHERE sent_at IS NULL").fetchone() == (0,)
@@ -0,0 +1,59 @@
+import pytest
+
+import archive
+import database
+from repositories import Repositories
+
+
+def rollups(conn):
+    return {
+        table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall())
+        for table in database.REPORT_TABLES
+    }
+
+
+@pytest.fixture
+def repos(tmp_path):
+    repos = Repositories.open(dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db")))
+    yield repos
+    repos.close()
+
+
+def test_rollups_match_a_full_rebuild(repos, tmp_path):
+    owner = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+    dog = repos.pets.add(name="Rex", age=3, species="dog", breed="collie", owner_id=owner)
+    cat = repos.pets.add(name="Tom", age=5, species="cat", breed="tabby", owner_id=owner)
+    checkup = repos.services.add(service_name="Checkup", cost=10, duration_minutes=30)
+    grooming = repos.services.add(service_name="Grooming", cost=25, duration_minutes=60)
+
+    booked = [
+        repos.appointments.add(date=f"2024-01-{day:02}", time="09:00", pet_id=pet, service_id=service)
+        for day, pet, service in [(2, dog, checkup), (3, cat, checkup), (4, dog, grooming), (5, cat, grooming)]
+    ]
+    # Visits already booked keep their price, later ones pay the new cost
+    repos.services.update(checkup, cost=40)
+    booked += [
+        repos.appointments.add(date="2024-02-01", time="10:00", pet_id=dog, service_id=checkup),
+        repos.appointments.add(date="2024-03-01", time="10:00", pet_id=cat, service_id=checkup),
+    ]
+    assert [repos.appointments.get(i).price for i in booked] == [10, 10, 25, 25, 40, 40]
+
+    repos.appointments.update(booked[0], date="2024-02-15")         # keeps its price of 10
+    repos.appointments.update(booked[1], service_id=grooming)       # now charged 25
+    repos.appointments.update(booked[2], pet_id=cat, time="11:00")
+    repos.appointments.update(booked[4], date="2024-03-02", service_id=grooming, pet_id=cat)
+    repos.appointments.delete(booked[3])
+    assert [a.price for a in repos.appointments.list()] == [10, 25, 25, 25, 40]
+
+    revenue = dict(repos.conn.execute("SELECT month, SUM(revenue) FROM report_service_month GROUP BY month"))
+    assert revenue == {"2024-01": 50, "2024-02": 10, "2024-03": 65}
+
+    stats = archive.archive_appointments(repos.conn, str(tmp_path / "archive.db"), "2024-02-01")
+    assert stats["archived"] == 2
+    assert repos.appointments.count() == 3
+
+    expected = rollups(repos.conn)
+    repos.conn.execute("BEGIN")
+    database.rebuild_reports(repos.conn)    # reads the archive too, it is attached
+    assert rollups(repos.conn) == expected
+    repos.conn.rollback()
@@ -0,0 +1,119 @@
+import datetime
+
+import pytest
+
+import database
+import scheduling
+from repositories import Repositories
+from scheduling import BookingConflict
+
+
+MONDAY = "2024-01-01"
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    path = str(tmp_path / "clinic.db")
+    repos = Repositories.open(dict(database.DEFAULT_PROFILE, path=path))
+    owner = repos.owners.add(name="Ann", contact="555-0100", email="ann@example.com", address="1 Elm St")
+    for number in range(4):
+        repos.pets.add(name=f"Pet {number}", age=3, species="dog", breed="collie", owner_id=owner)
+    repos.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    repos.services.add(service_name="Grooming", cost=35, duration_minutes=60)
+    repos.close()
+
+    opened = []
+
+    def open_clinic(**limits):
+        repos = Repositories.open(dict(database.DEFAULT_PROFILE, path=path),
+                                  limits=scheduling.load_settings(None, limits) if limits else None)
+        opened.append(repos)
+        return repos
+    yield open_clinic
+    for repos in opened:
+        repos.close()
+
+
+def book(repos, time, pet_id, service_id=1, date=MONDAY):
+    return repos.appointments.add(date=date, time=time, pet_id=pet_id, service_id=service_id)
+
+
+def test_back_to_back_appointments_dont_overlap(clinic):
+    repos = clinic()
+    book(repos, "09:00", 1)
+    book(repos, "08:30", 1)     # ends at 9:00
+    book(repos, "09:30", 1)     # starts when the first one ends
+    with pytest.raises(BookingConflict, match="Pet 1 already has an appointment"):
+        book(repos, "09:29", 1)
+    with pytest.raises(BookingConflict, match="Pet 1 already has an appointment"):
+        book(repos, "08:45", 1, service_id=2)
+    assert repos.appointments.count() == 3
+
+
+def test_clinic_capacity(clinic):
+    repos = clinic(capacity=2, service_capacity=0)
+    book(repos, "10:00", 1)
+    book(repos, "10:00", 2)
+    with pytest.raises(BookingConflict, match="clinic is fully booked") as conflict:
+        book(repos, "10:15", 3, service_id=2)
+    assert len(conflict.value.conflicts) == 2
+    book(repos, "10:30", 3, service_id=2)
+
+    # Moving into a full slot is checked the same way
+    moved = book(repos, "11:30", 4)
+    with pytest.raises(BookingConflict, match="clinic is fully booked"):
+        repos.appointments.update(moved, time="10:15")
+    repos.appointments.update(moved, time="11:00")
+
+
+def test_service_capacity(clinic):
+    repos = clinic(capacity=3, service_capacity=1)
+    book(repos, "11:00", 1, service_id=1)
+    with pytest.raises(BookingConflict, match="Service 1 is fully booked"):
+        book(repos, "11:15", 2, service_id=1)
+    book(repos, "11:15", 2, service_id=2)
+    book(repos, "11:30", 3, service_id=1)
+
+
+def test_limits_belong_to_the_repositories(clinic):
+    strict = clinic(capacity=1, service_capacity=0)
+    default = clinic()
+    book(strict, "12:00", 1, service_id=2)
+    with pytest.raises(BookingConflict):
+        book(strict, "12:00", 2, service_id=1)
+    # Other connections keep their own limits, here the defaults
+    assert default.appointments.limits is None
+    book(default, "12:00", 2, service_id=1)
+    with pytest.raises(BookingConflict, match="Service 1 is fully booked"):
+        book(default, "12:00", 3, service_id=1)
+
+
+def test_free_slots_skip_past_and_full_times(clinic):
+    repos = clinic(capacity=2, service_capacity=1)
+    book(repos, "14:00", 1, service_id=1)
+    book(repos, "14:00", 2, service_id=2)
+    monday = datetime.date.fromisoformat(MONDAY)
+
+    def starts(now, **kwargs):
+        return [start.strftime("%H:%M") for start, _ in scheduling.free_slots(
+            repos.conn, monday, 1, 30, now=now, limits=repos.appointments.limits, **kwargs
+        )]
+
+    day_before = datetime.datetime(2023, 12, 31, 12, 0)
+    all_day = starts(day_before)
+    assert all_day[0] == "08:00" and all_day[-1] == "17:30"
+    # 14:00 is full, and a half hour slot from 13:45 would run into it
+    assert "13:30" in all_day and "13:45" not in all_day and "14:00" not in all_day
+    assert "14:30" in all_day and "15:00" in all_day  # grooming still runs, one place left
+
+    assert starts(datetime.datetime(2024, 1, 1, 12, 5))[0] == "12:15"
+    assert starts(datetime.datetime(2024, 1, 1, 18, 0)) == []
+    assert "14:30" not in starts(day_before, pet_id=2)
+    assert "14:30" in starts(day_before, service_id=1) and "14:30" not in starts(day_before, service_id=2)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("10:15", "10:15"), ("10.15", "10:15"), ("9:05:30", "09:05"), ("2:30 PM", "14:30"), ("2pm", "14:00"),
+])
+def test_typed_times(text, expected):
+    assert scheduling.parse_time(text).strftime("%H:%M") == expected
@@ -0,0 +1,121 @@
+import json
+import asyncio
+import sqlite3
+import threading
+import http.client
+
+import pytest
+
+import client
+import database
+import scheduling
+import server
+from repositories import Repositories
+
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    """A clinic server on a free port, run on an event loop of its own."""
+    profile = dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db"))
+    limits = scheduling.load_settings(None, {"capacity": 1})
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    clinic = asyncio.run_coroutine_threadsafe(
+        server.ClinicServer(profile, readers=1, token=TOKEN, limits=limits).start("127.0.0.1", 0), loop
+    ).result()
+    clinic.url = f"http://127.0.0.1:{clinic.port}"
+    yield clinic
+    asyncio.run_coroutine_threadsafe(clinic.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def remote(clinic):
+    conn = database.connect({"server": clinic.url, "server_token": TOKEN})
+    repos = Repositories(conn)
+    yield repos
+    repos.close()
+
+
+def add_pet(repos, number=1):
+    owner = repos.owners.add(name=f"Owner {number}", contact=f"555-{number:04}",
+                             email=f"owner{number}@example.com", address="1 Elm St")
+    return repos.pets.add(name=f"Pet {number}", age=3, species="dog", breed="collie", owner_id=owner)
+
+
+def test_token_is_checked(clinic):
+    for token in (None, "wrong"):
+        anonymous = client.Client(clinic.url, token)
+        with pytest.raises(sqlite3.DatabaseError, match="missing or wrong token"):
+            anonymous.request("GET", "/api/status")
+        anonymous.close()
+    trusted = client.Client(clinic.url, TOKEN)
+    assert trusted.request("GET", "/api/status")["schema_version"] == database.SCHEMA_VERSION
+    trusted.close()
+
+
+def test_queries_cant_write(clinic, remote):
+    add_pet(remote)
+    # Gets past the client's check of the first word, the server's read
+    # connections refuse it
+    with pytest.raises(sqlite3.DatabaseError, match="not authorized"):
+        remote.conn.execute("WITH gone AS (SELECT 1) DELETE FROM owners").fetchall()
+    with pytest.raises(sqlite3.DatabaseError, match="not authorized"):
+        remote.conn.client.request("POST", "/api/query", {"sql": "PRAGMA query_only = OFF"})
+    with pytest.raises(sqlite3.OperationalError, match="only reads"):
+        remote.conn.execute("DELETE FROM owners")
+    assert remote.conn.execute("SELECT COUNT(*) FROM owners").fetchone() == (1,)
+
+
+def test_booking_conflict_round_trip(remote):
+    pet, other_pet = add_pet(remote, 1), add_pet(remote, 2)
+    service = remote.services.add(service_name="Checkup", cost=20, duration_minutes=30)
+    booked = remote.appointments.add(date="2024-01-01", time="09:00", pet_id=pet, service_id=service)
+
+    with pytest.raises(scheduling.BookingConflict, match="Pet 1 already has an appointment") as conflict:
+        remote.appointments.add(date="2024-01-01", time="09:15", pet_id=pet, service_id=service)
+    assert [appointment[0] for appointment in conflict.value.conflicts] == [booked]
+    # The server checks against its own limits, a clinic of one
+    with pytest.raises(scheduling.BookingConflict, match="clinic is fully booked"):
+        remote.appointments.add(date="2024-01-01", time="09:00", pet_id=other_pet, service_id=service)
+    assert remote.appointments.count() == 1
+    assert remote.appointments.get(booked).price == 20
+
+
+def test_data_version_follows_the_change_log(clinic, remote):
+    def data_version():
+        return remote.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    before = data_version()
+    add_pet(remote)
+    after = data_version()
+    assert after > before
+    local = database.connect(clinic.profile)
+    assert after == database.last_change(local)
+    local.close()
+    assert data_version() == after
+
+
+def test_dropped_stream_gives_back_its_reader(clinic):
+    # More rows than fit in the socket buffers, so the server is still
+    # sending when the client goes away
+    sql = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n LIMIT 200000) SELECT i, hex(zeroblob(50)) FROM n"
+    dropped = http.client.HTTPConnection("127.0.0.1", clinic.port, timeout=5)
+    dropped.request("POST", "/api/query", json.dumps({"sql": sql}),
+                    {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"})
+    response = dropped.getresponse()
+    assert json.loads(response.readline()) == {"columns": ["i", "hex(zeroblob(50))"]}
+    dropped.sock.close()
+    dropped.close()
+
+    # The pool has one reader, this waits for it
+    trusted = client.Client(clinic.url, TOKEN, timeout=10)
+    response = trusted.request("POST", "/api/query", {"sql": "SELECT 1"}, stream=True)
+    assert [json.loads(line) for line in response.read().splitlines()][1:] == [{"rows": [[1]]}, {"done": True, "count": 1}]
+    trusted.close()
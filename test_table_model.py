@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import Qt, QCoreApplication
+
+import database
+import table_model
+from db_worker import DatabaseThread
+from table_model import SqlTableModel
+
+
+ROWS = 600
+NULL_ROWS = 300     # more than a chunk, so paging has to cross from NULL keys to the rest
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+@pytest.fixture
+def db(app, tmp_path):
+    profile = dict(database.DEFAULT_PROFILE, path=str(tmp_path / "clinic.db"))
+    conn = database.connect(profile)
+    database.migrate(conn)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("INSERT INTO owners(name, contact, email, address) VALUES ('Ann', '555', 'ann@x', 'here')")
+    conn.execute("INSERT INTO pets(name, age, species, breed, owner_id) VALUES ('Rex', 3, 'dog', 'collie', 1)")
+    conn.execute("INSERT INTO services(service_name, cost) VALUES ('Checkup', 20)")
+    for number in range(ROWS):
+        if number % 2:
+            # Legacy rows: a date sqlite can't read leaves starts_at NULL,
+            # and a pet that is gone leaves pet_name NULL
+            conn.execute("INSERT INTO appointments(date, time, pet_id, service_id) VALUES ('someday', 'noon', 99, 1)")
+        else:
+            conn.execute(
+                "INSERT INTO appointments(date, time, pet_id, service_id) VALUES (date('2024-01-01', ?), '09:00', 1, 1)",
+                (f"+{number} days",)
+            )
+    conn.commit()
+    conn.close()
+    thread = DatabaseThread(profile)
+    yield thread
+    thread.close()
+
+
+def wait(db):
+    deadline = time.monotonic() + 10
+    while db.is_busy():
+        assert time.monotonic() < deadline, "database worker didn't finish"
+        QCoreApplication.processEvents()
+        time.sleep(0.001)
+    QCoreApplication.processEvents()
+
+
+def load_page(model):
+    wait(model.db)
+    while model.canFetchMore():
+        model.fetchMore()
+        wait(model.db)
+    column = model.columns.index(model.sort_column)
+    return [(model.row_data(row)[column], model.row_data(row)[0]) for row in range(model.rowCount())]
+
+
+@pytest.mark.parametrize("column", ["starts_at", "pet_name"])
+@pytest.mark.parametrize("order", [Qt.AscendingOrder, Qt.DescendingOrder])
+def test_paging_through_null_sort_values(db, monkeypatch, column, order):
+    monkeypatch.setattr(table_model, "PAGE_SIZE", 400)
+    model = SqlTableModel(db, "appointments")
+    model.refresh()
+    wait(db)
+    model.sort(model.columns.index(column), order)
+    first = load_page(model)
+    assert model.total_rows == ROWS and model.page_count() == 2
+    model.next_page()
+    second = load_page(model)
+    assert (len(first), len(second)) == (400, 200)
+
+    keys = first + second
+    expected = sorted(keys, key=lambda key: (key[0] is not None, key[0] or 0, key[1]))
+    if order == Qt.DescendingOrder:
+        expected.reverse()
+    assert keys == expected
+    assert sum(value is None for value, _ in keys) == NULL_ROWS
+
+    model.previous_page()
+    assert load_page(model) == first
+    model.last_page()
+    assert load_page(model) == second